@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+class ReverseGeocoder(object):
+    """
+    Nearest GeoNames city for batches of lon/lat points.
+
+    Cities are held as flat arrays under a KD-tree, read from the .npz
+    written by jobs/parse_rtree.py, or else from the older rtree index
+    it wrote. Distances are in degrees, as with the rtree index.
+    """
+    def __init__(self,path):
+        self.path = path
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if os.path.exists(self.path + '.npz'):
+            data = np.load(self.path + '.npz')
+            return data['coords'], data['names'], data['admin1'], data['countries']
+
+        from rtree import index
+        idx = index.Rtree(self.path)
+        items = list(idx.intersection(idx.bounds,objects=True))
+        coords = np.array([item.bbox[:2] for item in items],dtype='float64')
+        names, admin1, countries = (np.array(column) for column in zip(*[item.object for item in items]))
+        return coords, names, admin1, countries
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._tree is None:
+                coords, self.names, self.admin1, self.countries = self._load()
+                self._tree = cKDTree(coords)
+
+    def nearest(self,points):
+        """Indexes of the nearest city to each (lon,lat) point."""
+        self._ensure_loaded()
+        _, nearest = self._tree.query(np.asarray(points,dtype='float64').reshape(-1,2),k=1)
+        return nearest
+
+    def lookup(self,points):
+        """[name, admin1, country] of the nearest city to each (lon,lat) point."""
+        if len(points) == 0:
+            return []
+        nearest = self.nearest(points)
+        return [list(row) for row in zip(self.names[nearest].tolist(),self.admin1[nearest].tolist(),self.countries[nearest].tolist())]
+
+    def countries_for(self,points):
+        """Country code of the nearest city to each (lon,lat) point."""
+        if len(points) == 0:
+            return []
+        return self.countries[self.nearest(points)].tolist()
+
+reverse_geocoder = ReverseGeocoder(os.path.join(DIR,'reverse_geocode'))
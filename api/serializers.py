@@ -14,7 +14,7 @@ from django.db import transaction
 from jobs.models import HDXExportRegion, Job, SavedFeatureSelection, validate_aoi, validate_mbtiles, PartnerExportRegion
 from rest_framework import serializers
 from rest_framework_gis import serializers as geo_serializers
-from tasks.models import ExportRun, ExportTask
+from tasks.models import ExportRun, ExportRunStage, ExportTask
 
 # Get an instance of a logger
 LOG = logging.getLogger(__name__)
@@ -33,8 +33,16 @@ class ExportTaskSerializer(serializers.ModelSerializer):
                   'duration', 'filesize_bytes', 'download_urls')
 
 
+class ExportRunStageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportRunStage
+        fields = ('name', 'started_at', 'finished_at', 'wall_time', 'cpu_time',
+                  'bytes_read', 'bytes_written', 'element_counts', 'succeeded')
+
+
 class ExportRunSerializer(serializers.ModelSerializer):
     tasks = ExportTaskSerializer(many=True, read_only=True)
+    stages = ExportRunStageSerializer(many=True, read_only=True)
     user = UserSerializer(
         read_only=True, default=serializers.CurrentUserDefault())
 
@@ -42,7 +50,8 @@ class ExportRunSerializer(serializers.ModelSerializer):
         model = ExportRun
         lookup_field = 'uid'
         fields = ('uid', 'started_at', 'finished_at', 'duration',
-                  'elapsed_time', 'user', 'size', 'status', 'tasks')
+                  'elapsed_time', 'user', 'size', 'status', 'tasks',
+                  'data_timestamp', 'source', 'source_inputs', 'stages')
 
 
 class ConfigurationSerializer(serializers.ModelSerializer):
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from collections import Counter, OrderedDict
+from datetime import datetime, time, timedelta
+
+import pytz
+from django.contrib.auth.models import User
+from django.contrib.gis.db.models.functions import Centroid
+from django.db.models import Sum
+from django.utils import timezone
+
+from jobs.models import Job
+from tasks.models import DailyStats, ExportRun, ExportTask
+
+from .reverse_geocode import reverse_geocoder
+
+def day_range(day):
+    start = datetime.combine(day,time.min).replace(tzinfo=pytz.utc)
+    return start, start + timedelta(days=1)
+
+def compute_day(day):
+    """
+    The DailyStats of a UTC day from the jobs, users, runs and tasks
+    created on it, not saved.
+    """
+    start, end = day_range(day)
+
+    jobs = list(Job.objects.only('created_at').annotate(centroid=Centroid('the_geom')).filter(
+        created_at__gte=start,created_at__lt=end))
+    centroids = [[round(j.centroid.x,4),round(j.centroid.y,4)] for j in jobs]
+    regions = Counter(reverse_geocoder.countries_for(centroids))
+
+    runs = ExportRun.objects.filter(created_at__gte=start,created_at__lt=end)
+    tasks = ExportTask.objects.filter(run__in=runs)
+
+    format_durations = {}
+    for name, started_at, finished_at in tasks.filter(status='SUCCESS',started_at__isnull=False,finished_at__isnull=False).values_list('name','started_at','finished_at'):
+        format_durations.setdefault(name,[]).append((finished_at - started_at).total_seconds())
+    for durations in format_durations.values():
+        durations.sort()
+
+    return DailyStats(
+        date=day,
+        jobs_count=len(jobs),
+        users_count=User.objects.filter(date_joined__gte=start,date_joined__lt=end).count(),
+        runs_count=runs.count(),
+        failed_runs_count=runs.filter(status='FAILED').count(),
+        bytes_produced=tasks.aggregate(total=Sum('filesize_bytes'))['total'] or 0,
+        format_durations=format_durations,
+        regions=dict(regions),
+        centroids=centroids,
+        updated_at=timezone.now()
+    )
+
+def rollup_day(day):
+    """Computes and saves the DailyStats of a UTC day."""
+    stats = compute_day(day)
+    fields = ['jobs_count','users_count','runs_count','failed_runs_count','bytes_produced',
+              'format_durations','regions','centroids','updated_at']
+    stats, _ = DailyStats.objects.update_or_create(date=day,defaults={f:getattr(stats,f) for f in fields})
+    return stats
+
+def daily_stats(after,before):
+    """
+    DailyStats for the days from after to before that have been rolled up,
+    most recent first, with today's computed live. Missing days are left
+    to the rollup_stats command (--since to backfill), as rolling them up
+    here would make a request over a long range run hundreds of queries.
+    """
+    today = timezone.now().date()
+    existing = {s.date:s for s in DailyStats.objects.filter(date__gte=after,date__lte=before)}
+    if after <= today <= before:
+        existing[today] = compute_day(today)
+    return [existing[day] for day in sorted(existing,reverse=True)]
+
+def percentile(values,p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0,int(round(p / 100.0 * len(values))) - 1)]
+
+def aggregate(days,period_fn):
+    """
+    Combines DailyStats into periods, keyed by period_fn of their date,
+    in the order the days are given.
+    """
+    periods = OrderedDict()
+    for s in days:
+        key = period_fn(s.date)
+        if key not in periods:
+            periods[key] = {
+                'start_date':key,
+                'jobs_count':0,
+                'users_count':0,
+                'runs_count':0,
+                'failed_runs_count':0,
+                'bytes_produced':0,
+                'regions':Counter(),
+                'format_durations':{}
+            }
+        period = periods[key]
+        for field in ['jobs_count','users_count','runs_count','failed_runs_count','bytes_produced']:
+            period[field] += getattr(s,field)
+        period['regions'].update(s.regions)
+        for name, durations in s.format_durations.items():
+            period['format_durations'].setdefault(name,[]).extend(durations)
+
+    result = []
+    for period in periods.values():
+        regions = period.pop('regions')
+        period['top_regions'] = ' '.join(['{0}:{1}'.format(r,c) for r, c in regions.most_common(5)])
+        format_durations = period.pop('format_durations')
+        period['format_runtimes'] = {}
+        for name, durations in format_durations.items():
+            durations.sort()
+            period['format_runtimes'][name] = {'p50':percentile(durations,50),'p95':percentile(durations,95)}
+        result.append(period)
+    return result
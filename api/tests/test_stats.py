@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from tasks.models import DailyStats
+
+from ..stats import aggregate, daily_stats, percentile
+
+class TestStatsRollup(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(1,101))
+        self.assertEqual(percentile(values,50),50)
+        self.assertEqual(percentile(values,95),95)
+        self.assertIsNone(percentile([],50))
+
+    def test_aggregate_by_month(self):
+        days = [
+            DailyStats(date=date(2019,2,1),jobs_count=1,users_count=1,regions={'SN':1},format_durations={'shp':[10]}),
+            DailyStats(date=date(2019,1,31),jobs_count=2,runs_count=3,regions={'SN':1,'ML':1},format_durations={'shp':[20,30]}),
+            DailyStats(date=date(2019,1,30),jobs_count=1,regions={'ML':1},format_durations={'kml':[5]}),
+        ]
+        periods = aggregate(days,lambda d: d.strftime('%Y-%m'))
+        self.assertEqual([p['start_date'] for p in periods],['2019-02','2019-01'])
+        self.assertEqual(periods[1]['jobs_count'],3)
+        self.assertEqual(periods[1]['runs_count'],3)
+        self.assertEqual(periods[1]['top_regions'],'ML:2 SN:1')
+        self.assertEqual(periods[1]['format_runtimes']['shp'],{'p50':20,'p95':30})
+
+class TestDailyStats(TestCase):
+    def test_missing_days_are_not_rolled_up(self):
+        yesterday = timezone.now().date() - timedelta(days=1)
+        DailyStats.objects.create(date=yesterday - timedelta(days=3),jobs_count=2)
+        days = daily_stats(yesterday - timedelta(days=30),yesterday)
+        self.assertEqual([d.date for d in days],[yesterday - timedelta(days=3)])
+        self.assertEqual(DailyStats.objects.count(),1)
@@ -317,3 +317,37 @@ class TestHDXExportRegionViewSet(APITestCase):
 
 
 
+
+
+class TestEstimateSize(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='demo', email='demo@demo.com', password='demo'
+        )
+        self.client.force_login(self.user)
+        self.url = '/api/estimate_size'
+
+    def test_estimate_bbox(self):
+        response = self.client.get(self.url, {'bbox': '-17.465,14.719,-17.442,14.741'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['valid'])
+
+    def test_malformed_geometry(self):
+        response = self.client.get(self.url, {'bbox': '-17.465,14.719'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'geojson': '{"type": "Polygon"'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_geometry(self):
+        bowtie = json.dumps({'type': 'Polygon', 'coordinates': [[[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]]})
+        response = self.client.get(self.url, {'geojson': bowtie})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Self-intersection', response.json()['error'])
+
+    def test_oversized_geometry(self):
+        response = self.client.get(self.url, {'bbox': '-180,-85,180,85'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertFalse(data['valid'])
+        self.assertGreater(data['nodes'], data['max_nodes'])
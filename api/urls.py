@@ -6,7 +6,8 @@ from rest_framework.routers import DefaultRouter
 
 from .views import (ConfigurationViewSet, ExportRunViewSet,
                     HDXExportRegionViewSet, PartnerExportRegionViewSet, JobViewSet, permalink, get_overpass_timestamp,
-                    get_user_permissions, request_geonames, get_overpass_status, get_groups, stats, request_nominatim)
+                    get_user_permissions, request_geonames, get_overpass_status, get_groups, stats, request_nominatim,
+                    estimate_size)
 
 router = DefaultRouter(trailing_slash=False)
 router.register(r'jobs', JobViewSet, base_name='jobs')
@@ -33,5 +34,6 @@ urlpatterns += [
     url(r'^overpass_status$', get_overpass_status),
     url(r'^permissions$', get_user_permissions),
     url(r'^groups$',get_groups),
-    url(r'^stats$', stats)
+    url(r'^stats$', stats),
+    url(r'^estimate_size$', estimate_size)
 ]
@@ -1,31 +1,28 @@
 """Provides classes for handling API requests."""
 # -*- coding: utf-8 -*-
 from distutils.util import strtobool
-import itertools
 from itertools import chain
 import logging
 import json
 from django.utils import timezone
 from datetime import datetime, timedelta
-from collections import Counter
 
-import os
 import io
 import csv
 import dateutil.parser
+import pytz
 import requests
-from cachetools.func import ttl_cache
-from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import Group
-from django.contrib.gis.geos import GEOSGeometry, Polygon
-from django.db.models import Q
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, Polygon
+from django.db.models import Count, Q, Sum
 from django.http import JsonResponse, HttpResponse, HttpResponseNotFound, HttpResponseForbidden
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError as DjangoValidationError
-from jobs.models import HDXExportRegion, PartnerExportRegion, Job, SavedFeatureSelection
+from jobs.models import (HDXExportRegion, PartnerExportRegion, Job, SavedFeatureSelection,
+                         check_node_budget, estimate_nodes, MAX_NODES)
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import detail_route
 from rest_framework.renderers import JSONRenderer
@@ -36,14 +33,16 @@ from api.serializers import (ConfigurationSerializer, ExportRunSerializer, Expor
                          HDXExportRegionSerializer, JobGeomSerializer,
                          PartnerExportRegionListSerializer, PartnerExportRegionSerializer,
                          JobSerializer)
-from tasks.models import ExportRun
+from tasks.models import ExportRun, ExportRunStage
 from tasks.task_runners import ExportTaskRunner
+from utils.http_client import geonames_json, nominatim_json
+from utils.overpass import overpass_cache
 
 from .permissions import IsHDXAdmin, IsOwnerOrReadOnly, IsMemberOfGroup
 from .renderers import HOTExportApiRenderer
 
 from hdx_exports.hdx_export_set import sync_region
-from rtree import index
+from .stats import aggregate, daily_stats
 
 # Get an instance of a logger
 LOG = logging.getLogger(__name__)
@@ -51,9 +50,6 @@ LOG = logging.getLogger(__name__)
 # controls how api responses are rendered
 renderer_classes = (JSONRenderer, HOTExportApiRenderer)
 
-DIR = os.path.dirname(os.path.abspath(__file__))
-idx = index.Rtree(os.path.join(DIR,'reverse_geocode'))
-
 def bbox_to_geom(s):
     try:
         return GEOSGeometry(Polygon.from_bbox(s.split(',')), srid=4326)
@@ -121,8 +117,10 @@ class JobViewSet(viewsets.ModelViewSet):
         return queryset
 
     def perform_create(self, serializer):
-        if Job.objects.filter(created_at__gt=timezone.now()-timedelta(minutes=60),user=self.request.user).count() > 5:
-            raise ValidationError({"the_geom":["You are rate limited to 5 exports per hour."]})
+        nodes = estimate_nodes(serializer.validated_data['the_geom'])
+        result = check_node_budget(self.request.user,nodes)
+        if not result.valid:
+            raise ValidationError({"the_geom":[result.message % (result.params or {})]})
         job = serializer.save()
         task_runner = ExportTaskRunner()
         task_runner.run_task(job_uid=str(job.uid))
@@ -183,7 +181,7 @@ class ExportRunViewSet(viewsets.ModelViewSet):
         return Response({'status': 'OK'}, status=status.HTTP_201_CREATED)
 
     def get_queryset(self):
-        return ExportRun.objects.all().order_by('-started_at')
+        return ExportRun.objects.all().prefetch_related('tasks','stages').order_by('-started_at')
 
     def retrieve(self, request, uid=None, *args, **kwargs):
         """
@@ -194,6 +192,21 @@ class ExportRunViewSet(viewsets.ModelViewSet):
             queryset, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @detail_route(methods=['post'])
+    def cancel(self, request, uid=None):
+        """
+        Cancel a submitted or running Export Run, stopping its worker.
+        """
+        run = ExportRun.objects.select_related('job').filter(uid=uid).first()
+        if not run:
+            return HttpResponseNotFound()
+        user = request.user
+        if not (user.is_superuser or user.id in (run.user_id, run.job.user_id)):
+            return Response({'status': 'FORBIDDEN'}, status=status.HTTP_403_FORBIDDEN)
+        if not run.cancel():
+            return Response({'status': run.status}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': run.status}, status=status.HTTP_200_OK)
+
     def list(self, request, *args, **kwargs):
         """
         List the Export Runs for a single Job.
@@ -222,8 +235,7 @@ class HDXExportRegionViewSet(viewsets.ModelViewSet):
         if schedule_period not in [None,'any']:
             queryset = queryset.filter(Q(schedule_period=schedule_period))
 
-        return queryset.prefetch_related(
-            'job__runs__tasks').defer('job__the_geom')
+        return queryset.with_last_run().select_related('job').defer('job__the_geom')
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -256,8 +268,8 @@ class PartnerExportRegionViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         group_ids = self.request.user.groups.values_list('id')
-        return PartnerExportRegion.objects.filter(deleted=False,group_id__in=group_ids).prefetch_related(
-            'job__runs__tasks').defer('job__the_geom')
+        return PartnerExportRegion.objects.filter(deleted=False,group_id__in=group_ids).with_last_run().select_related(
+            'job','group').defer('job__the_geom')
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -308,45 +320,67 @@ def stats(request):
     elif period == 'month':
         period_fn = toMonth
 
-    users = User.objects.only('date_joined').filter(date_joined__gte=after,date_joined__lte=before).order_by('-date_joined')
-
-    grouped_users_by_period = {}
-    for gu in itertools.groupby(users, lambda u:period_fn(u.date_joined)):
-        grouped_users_by_period[gu[0]] = len(list(gu[1]))
-
-    queryset = Job.objects.only('created_at','the_geom').order_by('-created_at')
-    if before:
-        queryset = queryset.filter(Q(created_at__lte=before))
-    if after:
-        queryset = queryset.filter(Q(created_at__gte=after))
+    def toDate(value):
+        if isinstance(value, str):
+            value = dateutil.parser.parse(value)
+        if timezone.is_aware(value):
+            value = value.astimezone(pytz.utc)
+        return value.date()
 
-    grouped_jobs = itertools.groupby(queryset,lambda j:period_fn(j.created_at))
-
-    geoms = []
-    periods = []
-    for x in grouped_jobs:
-        top_regions = Counter()
-        jobs_in_group = list(x[1])
-        for j in jobs_in_group:
-            centroid = j.the_geom.centroid
-            geoms.append([centroid.x,centroid.y])
-            result = next(idx.nearest((centroid.x,centroid.y),1,objects=True))
-            top_regions[result.object[2]] += 1
-
-        users_in_period = grouped_users_by_period.get(x[0],0)
-
-        top_regions_string = ' '.join(["{0}:{1}".format(x[0],x[1]) for x in top_regions.most_common(5)])
-        periods.append({'start_date':x[0],'jobs_count':len(jobs_in_group),'users_count':users_in_period,'top_regions':top_regions_string})
+    # served from the daily rollups kept by the rollup_stats command.
+    days = daily_stats(toDate(after),toDate(before))
+    periods = aggregate(days,period_fn)
+    geoms = [centroid for day in days for centroid in day.centroids]
 
     if is_csv:
+        formats = sorted(set(name for period in periods for name in period['format_runtimes']))
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(['start_date','jobs_count','users_count','top_regions'])
+        writer.writerow(['start_date','jobs_count','users_count','top_regions','runs_count','failed_runs_count','bytes_produced'] +
+            [name + suffix for name in formats for suffix in ['_p50','_p95']])
         for period in periods:
-            writer.writerow([period['start_date'],period['jobs_count'],period['users_count'],period['top_regions']])
+            runtimes = period['format_runtimes']
+            writer.writerow([period['start_date'],period['jobs_count'],period['users_count'],period['top_regions'],
+                period['runs_count'],period['failed_runs_count'],period['bytes_produced']] +
+                [runtimes.get(name,{}).get(p) for name in formats for p in ['p50','p95']])
         return HttpResponse(output.getvalue())
     else:
-        return HttpResponse(json.dumps({'periods':periods,'geoms':geoms}))
+        # where worker time went: totals per stage, and the jobs that took the most.
+        stages = ExportRunStage.objects.filter(started_at__gte=after,started_at__lte=before)
+        stage_totals = stages.values('name').annotate(
+            count=Count('id'),
+            wall_time=Sum('wall_time'),
+            cpu_time=Sum('cpu_time'),
+            bytes_read=Sum('bytes_read'),
+            bytes_written=Sum('bytes_written')
+        ).order_by('-wall_time')
+        top_jobs = stages.values('run__job__uid','run__job__name').annotate(
+            wall_time=Sum('wall_time'),
+            cpu_time=Sum('cpu_time')
+        ).order_by('-wall_time')[:10]
+        top_jobs = [{'uid':str(j['run__job__uid']),'name':j['run__job__name'],'wall_time':j['wall_time'],'cpu_time':j['cpu_time']} for j in top_jobs]
+        return HttpResponse(json.dumps({'periods':periods,'geoms':geoms,'stages':list(stage_totals),'top_jobs':top_jobs}))
+
+
+@require_http_methods(['GET'])
+@login_required()
+def estimate_size(request):
+    """
+    Estimated node count for an area, from either a bbox=w,s,e,n
+    or a geojson= geometry parameter.
+    """
+    try:
+        if request.GET.get('bbox'):
+            geom = bbox_to_geom(request.GET['bbox'])
+        else:
+            geom = GEOSGeometry(request.GET.get('geojson',''), srid=4326)
+    except (ValidationError, GEOSException, ValueError, TypeError):
+        return JsonResponse({'error': 'bbox or geojson parameter is malformed.'}, status=400)
+
+    if not geom.valid:
+        return JsonResponse({'error': geom.valid_reason}, status=400)
+    nodes = estimate_nodes(geom)
+    return JsonResponse({'nodes': nodes, 'max_nodes': MAX_NODES, 'valid': nodes <= MAX_NODES})
 
 
 @require_http_methods(['GET'])
@@ -385,17 +419,21 @@ def request_nominatim(request):
         'format': 'json',
     }
 
-    response = requests.get(nominatim_url, params=params)
-    if response.status_code != 200:
+    try:
+        data = nominatim_json.get(nominatim_url, params)
+    except requests.exceptions.HTTPError:
         error_dict = {
             'error': 'Invalid Status code from nominatim url',
             'status': 400,
         }
         return JsonResponse(error_dict)
-
-    try:
-        data = response.json()
-    except json.decoder.JSONDecodeError:
+    except requests.exceptions.RequestException:
+        error_dict = {
+            'error': 'Could not reach nominatim url',
+            'status': 503,
+        }
+        return JsonResponse(error_dict)
+    except ValueError:
         error_dict = {
             'error': 'Response content not serializable to json',
             'status': 400,
@@ -429,7 +467,10 @@ def request_geonames(request):
     geonames_url = getattr(settings, 'GEONAMES_API_URL')
 
     if geonames_url:
-        response = requests.get(geonames_url, params=payload).json()
+        try:
+            response = geonames_json.get(geonames_url, payload)
+        except (requests.exceptions.RequestException, ValueError):
+            return JsonResponse({'error': 'Could not reach geonames'}, status=503)
         assert (isinstance(response, dict))
         return JsonResponse(response)
     else:
@@ -440,21 +481,27 @@ def request_geonames(request):
             status=500, )
 
 
-@ttl_cache(ttl=60)
 @require_http_methods(['GET'])
 @login_required()
 def get_overpass_timestamp(request):
     """
     Endpoint to show the last OSM update timestamp on the Create page.
-    this sometimes fails, returning a HTTP 200 but empty content.
+    this sometimes fails, returning a HTTP 200 but empty content,
+    in which case the last good timestamp is shown.
     """
-    r = requests.get('{}timestamp'.format(settings.OVERPASS_API_URL))
-    return JsonResponse({'timestamp': dateutil.parser.parse(r.content)})
+    try:
+        timestamp = overpass_cache.get('timestamp')
+    except (requests.exceptions.RequestException, ValueError):
+        return JsonResponse({'error': 'Could not reach Overpass'}, status=503)
+    return JsonResponse({'timestamp': dateutil.parser.parse(timestamp)})
 
 @login_required()
 def get_overpass_status(request):
-    r = requests.get('{}status'.format(settings.OVERPASS_API_URL))
-    return HttpResponse(r.content)
+    try:
+        status = overpass_cache.get('status')
+    except (requests.exceptions.RequestException, ValueError):
+        return HttpResponse('Could not reach Overpass', status=503)
+    return HttpResponse(status)
 
 
 @require_http_methods(['GET'])
@@ -22,7 +22,10 @@ INSTALLED_APPS += (
     'utils',
 )
 
-dramatiq.set_broker(RedisBroker(host="localhost", port=6379))
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+
+dramatiq.set_broker(RedisBroker(host=REDIS_HOST, port=REDIS_PORT))
 
 DATABASES = {}
 
@@ -70,6 +73,75 @@ GENERATE_MWM = os.getenv('GENERATE_MWM','/usr/local/bin/generate_mwm.sh')
 GENERATOR_TOOL = os.getenv('GENERATOR_TOOL','/usr/local/bin/generator_tool')
 PLANET_FILE = os.getenv('PLANET_FILE','')
 
+# index of the continent and country PBFs cut from the planet by
+# jobs/secondary_pipeline.py --regions-interval; defaults to regions/index.json
+# next to PLANET_FILE. Planet-backed runs extract from the smallest one
+# containing their AOI, unless the regions were cut more than
+# PLANET_REGIONS_MAX_AGE hours ago.
+PLANET_REGIONS_INDEX = os.getenv('PLANET_REGIONS_INDEX','')
+PLANET_REGIONS_MAX_AGE = int(os.getenv('PLANET_REGIONS_MAX_AGE', 48))
+
+# max number of regions cut out of the planet in a single osmium pass
+# by the batched scheduled run. osmium keeps per-extract state in memory.
+PLANET_BATCH_SIZE = int(os.getenv('PLANET_BATCH_SIZE', 100))
+
+# number of output formats finalized, packaged or generated at the same time
+# within a single export run.
+EXPORT_WORKER_CONCURRENCY = int(os.getenv('EXPORT_WORKER_CONCURRENCY', 2))
+
+# total size of source extracts kept under EXPORT_STAGING_ROOT/source_cache
+# for reuse by later runs with the same AOI, filter and data timestamp.
+# 0 disables the cache.
+SOURCE_CACHE_MAX_BYTES = int(os.getenv('SOURCE_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+# total size of tag-filtered copies of the planet, one per distinct mapping,
+# kept under EXPORT_STAGING_ROOT/planet_derivatives until the planet changes.
+# 0 disables them.
+PLANET_DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv('PLANET_DERIVATIVE_CACHE_MAX_BYTES', 100 * 1024 ** 3))
+
+# deflate level (0-9) for packaged HDX theme zips, and how many of them
+# are compressed at the same time.
+ZIP_COMPRESSION_LEVEL = int(os.getenv('ZIP_COMPRESSION_LEVEL', 6))
+ZIP_THREADS = int(os.getenv('ZIP_THREADS', 2))
+
+# on-demand runs estimated below SMALL_EXPORT_NODES go to the 'small' queue,
+# and from LARGE_EXPORT_NODES up to the 'large' queue; the rest to 'default'.
+SMALL_EXPORT_NODES = int(os.getenv('SMALL_EXPORT_NODES', 500000))
+LARGE_EXPORT_NODES = int(os.getenv('LARGE_EXPORT_NODES', 5000000))
+
+# admission control: the estimated nodes of jobs created within the last
+# NODE_BUDGET_WINDOW minutes, by one user and by everyone. Every job
+# costs at least MIN_JOB_NODES.
+NODE_BUDGET_WINDOW = int(os.getenv('NODE_BUDGET_WINDOW', 60))
+USER_NODE_BUDGET = int(os.getenv('USER_NODE_BUDGET', 50000000))
+GLOBAL_NODE_BUDGET = int(os.getenv('GLOBAL_NODE_BUDGET', 1000000000))
+MIN_JOB_NODES = int(os.getenv('MIN_JOB_NODES', 50000))
+
+# runs of jobs not tied to the planet are exported from Overpass unless,
+# with a PLANET_FILE at most SOURCE_PLANET_MAX_AGE hours old, they are
+# estimated above SOURCE_PLANET_NODES, Overpass lags further behind than
+# the planet, or at least SOURCE_OVERPASS_MAX_LOAD of its slots are in use.
+# SOURCE_PLANET_NODES must stay below the jobs' MAX_NODES to have any effect.
+SOURCE_PLANET_NODES = int(os.getenv('SOURCE_PLANET_NODES', LARGE_EXPORT_NODES))
+SOURCE_PLANET_MAX_AGE = int(os.getenv('SOURCE_PLANET_MAX_AGE', 48))
+SOURCE_OVERPASS_MAX_LOAD = float(os.getenv('SOURCE_OVERPASS_MAX_LOAD', 1.0))
+
+# directory for the node estimator's memory-mapped copies of osm_nodes.tif,
+# built on first use; the system temp directory if unset.
+NODE_ESTIMATOR_DIR = os.getenv('NODE_ESTIMATOR_DIR')
+
+# Overpass exports estimated above OVERPASS_TILE_NODES are fetched as up to
+# OVERPASS_MAX_TILES separate queries, OVERPASS_TILE_CONCURRENCY at a time,
+# and merged before processing.
+OVERPASS_TILE_NODES = int(os.getenv('OVERPASS_TILE_NODES', 2000000))
+OVERPASS_MAX_TILES = int(os.getenv('OVERPASS_MAX_TILES', 16))
+OVERPASS_TILE_CONCURRENCY = int(os.getenv('OVERPASS_TILE_CONCURRENCY', 4))
+
+# the PDC export is cut from the planet into PDC_BANDS longitude bands of
+# about equal node counts, PDC_WORKERS of which are converted at a time.
+PDC_BANDS = int(os.getenv('PDC_BANDS', 8))
+PDC_WORKERS = int(os.getenv('PDC_WORKERS', 4))
+
 """
 Maximum extent of a Job
 max of (latmax-latmin) * (lonmax-lonmin)
@@ -208,10 +280,22 @@ HDX_API_KEY = os.getenv('HDX_API_KEY')
 HDX_NOTIFICATION_EMAIL = os.getenv('HDX_NOTIFICATION_EMAIL')
 HDX_SITE = os.getenv('HDX_SITE', 'demo')
 
+# HDX datasets of a region created or updated at the same time.
+HDX_SYNC_CONCURRENCY = int(os.getenv('HDX_SYNC_CONCURRENCY', 4))
+
 GEONAMES_API_URL = os.getenv('GEONAMES_API_URL', 'http://api.geonames.org/searchJSON')
 
 NOMINATIM_API_URL = os.getenv('NOMINATIM_API_URL', 'https://nominatim.openstreetmap.org/search.php')
 
+# seconds to wait for Overpass, Nominatim and GeoNames to accept a
+# connection, and then between bytes of their response.
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+
+# seconds the Overpass timestamp and status shown in the UI are served
+# from Redis before one web worker refreshes them in the background.
+OVERPASS_CACHE_INTERVAL = int(os.getenv('OVERPASS_CACHE_INTERVAL', 60))
+
 MATOMO_URL = os.getenv('MATOMO_URL')
 MATOMO_SITEID = os.getenv('MATOMO_SITEID')
 
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django import db
+from django.db import transaction
+from django.utils import timezone
+
+from jobs.models import HDXExportRegion, Job, validate_feature_selection
+
+from .hdx_export_set import sync_region
+
+LOG = logging.getLogger(__name__)
+
+def update_feature_selection(regions,feature_selection):
+    """
+    Validates feature_selection once and sets it on the jobs of all
+    regions in a single transaction. Raises ValidationError if invalid.
+    """
+    validate_feature_selection(feature_selection)
+    job_ids = [region.job_id for region in regions]
+    with transaction.atomic():
+        return Job.objects.filter(id__in=job_ids).update(
+            feature_selection=feature_selection,
+            updated_at=timezone.now()
+        )
+
+def resync_regions(region_ids,workers=4,progress=None):
+    """
+    Syncs the HDX datasets of regions, workers regions at a time.
+    progress, if given, is called with (done, total, region_id, error)
+    after each region, error being None if it succeeded.
+    Returns {region_id: error message} of the regions that failed.
+    """
+    failures = {}
+
+    def sync(region_id):
+        try:
+            sync_region(HDXExportRegion.objects.select_related('job').get(id=region_id))
+        finally:
+            db.connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(sync,region_id): region_id for region_id in region_ids}
+        for done, future in enumerate(as_completed(futures),1):
+            region_id = futures[future]
+            error = None
+            try:
+                future.result()
+            except Exception as e:
+                LOG.warn('HDX sync of region {0} failed: {1}'.format(region_id,e))
+                error = str(e) or e.__class__.__name__
+                failures[region_id] = error
+            if progress:
+                progress(done,len(futures),region_id,error)
+    return failures
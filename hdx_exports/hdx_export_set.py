@@ -1,7 +1,16 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import django.utils.text
+from cachetools.func import ttl_cache
+from django import db
+from django.conf import settings
 from hdx.data.dataset import Dataset
+from hdx.data.hdxobject import HDXError
+from hdx.hdx_configuration import Configuration
+from hdx.hdx_locations import Locations
 from osm_export_tool.mapping import Mapping
 
 FILTER_CRITERIA = """
@@ -27,16 +36,81 @@ def slugify(str):
     s = django.utils.text.slugify(str)
     return s.replace('-','_')
 
-def sync_datasets(datasets,update_dataset_date=False):
-    for dataset in datasets:
-        exists = Dataset.read_from_hdx(dataset['name'])
-        if exists:
-            if update_dataset_date:
-                dataset.set_dataset_date_from_datetime(datetime.now())
-            dataset.update_in_hdx()
-        else:
+@ttl_cache(ttl=60 * 60 * 24)
+def hdx_locations():
+    """
+    The HDX location vocabulary, read at most once a day per process
+    and shared with the hdx library's own lookups.
+    """
+    locations = Configuration.read().call_remoteckan('group_list', {'all_fields': True})
+    Locations.set_validlocations(locations)
+    return locations
+
+def location_groups(locations):
+    """HDX groups for locations, looking each distinct location up once."""
+    groups = []
+    for location in dict.fromkeys(locations):
+        hdx_code, _ = Locations.get_HDX_code_from_location(location, locations=hdx_locations())
+        if hdx_code is None:
+            raise HDXError('Location: %s - cannot find in HDX!' % location)
+        groups.append({'name': hdx_code})
+    return groups
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def dataset_fingerprints(dataset):
+    """
+    Hashes of what a sync would push for a dataset: its metadata, less the
+    fields that change on every sync, and its resources.
+    """
+    metadata = {k: v for k, v in dataset.data.items() if k not in ('updated_by_script', 'dataset_date')}
+    resources = [resource.data for resource in dataset.get_resources()]
+    return fingerprint(metadata), fingerprint(resources)
+
+def sync_dataset(dataset,update_dataset_date=False):
+    # jobs.models imports this module.
+    from jobs.models import HDXDatasetFingerprint
+
+    metadata_hash, resources_hash = dataset_fingerprints(dataset)
+    # a sync without files, e.g. a region saved from the admin, leaves the
+    # dataset's resources as they are, so only its metadata is compared.
+    has_resources = len(dataset.get_resources()) > 0
+    last = HDXDatasetFingerprint.objects.filter(name=dataset['name']).first()
+    resources_changed = has_resources and (last is None or last.resources_hash != resources_hash)
+    if last and last.metadata_hash == metadata_hash and not resources_changed:
+        return False
+
+    # a dataset synced before is known to exist, and update_in_hdx
+    # reads it back itself, so it isn't read from HDX first.
+    exists = last is not None or Dataset.read_from_hdx(dataset['name'])
+    if exists:
+        if update_dataset_date:
             dataset.set_dataset_date_from_datetime(datetime.now())
-            dataset.create_in_hdx(allow_no_resources=True)
+        dataset.update_in_hdx(update_resources=resources_changed)
+    else:
+        dataset.set_dataset_date_from_datetime(datetime.now())
+        dataset.create_in_hdx(allow_no_resources=True)
+
+    defaults = {'metadata_hash': metadata_hash}
+    if has_resources or last is None:
+        defaults['resources_hash'] = resources_hash
+    HDXDatasetFingerprint.objects.update_or_create(name=dataset['name'], defaults=defaults)
+    return True
+
+def sync_datasets(datasets,update_dataset_date=False):
+    # datasets are independent, so they are synced HDX_SYNC_CONCURRENCY at a time;
+    # those that have not changed since their last sync are skipped.
+    def sync(dataset):
+        try:
+            return sync_dataset(dataset,update_dataset_date)
+        finally:
+            db.connection.close()
+
+    with ThreadPoolExecutor(max_workers=settings.HDX_SYNC_CONCURRENCY) as executor:
+        futures = [executor.submit(sync,dataset) for dataset in datasets]
+        synced = [future.result() for future in futures]
+    return synced.count(True)
 
 def sync_region(region,files=[],public_dir=''):
     export_set = HDXExportSet(
@@ -53,7 +127,7 @@ def sync_region(region,files=[],public_dir=''):
         files,
         public_dir
     )
-    sync_datasets(datasets,len(files) > 0)
+    return sync_datasets(datasets,len(files) > 0)
 
 class HDXExportSet(object):
     def __init__(self,mapping,dataset_prefix,name,extra_notes=''):
@@ -101,6 +175,7 @@ class HDXExportSet(object):
         }
 
         d = []
+        groups = location_groups(locations)
         updated_by_script = f'HOT Export Tool ({datetime.now().strftime("%Y-%m-%dT%H:%M:%S")})'
         for theme in self._mapping.themes:
             dataset = Dataset()
@@ -111,7 +186,7 @@ class HDXExportSet(object):
             dataset['methodology_other'] = 'Volunteered geographic information'
             dataset['license_id'] = 'hdx-odc-odbl'
             dataset['updated_by_script'] = updated_by_script
-            dataset['groups'] = []
+            dataset['groups'] = [dict(group) for group in groups]
 
             dataset['name'] = '{0}_{1}'.format(self._dataset_prefix, slugify(theme.name))
             dataset['title'] = '{0} {1} (OpenStreetMap Export)'.format(self._name, theme.name)
@@ -128,10 +203,6 @@ class HDXExportSet(object):
                     tags = [tag.strip() for tag in theme.extra['hdx']['tags'].split(',')]
                     dataset.add_tags(tags)
 
-            for location in locations:
-                # warning: this makes a network call
-                dataset.add_other_location(location)
-
             resources = []
             for f in files:
                 if 'theme' not in f.extra or f.extra['theme'] == theme.name:
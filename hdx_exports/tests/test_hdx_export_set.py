@@ -2,7 +2,9 @@
 
 import json
 import unittest
-from hdx_exports.hdx_export_set import HDXExportSet
+from unittest import mock
+from django.test import TestCase
+from hdx_exports.hdx_export_set import HDXExportSet, sync_dataset
 from hdx.hdx_configuration import Configuration
 from django.contrib.gis.geos import GEOSGeometry
 
@@ -141,3 +143,48 @@ class TestHDXExportSet(unittest.TestCase):
             feature_selection=FeatureSelection(yaml)
         )
         self.assertMultiLineEqual(h.hdx_note('some'),SINGLE_FILTER_NOTE)
+
+
+class FakeResource(object):
+    def __init__(self, data):
+        self.data = data
+
+class FakeDataset(object):
+    """Stands in for hdx Dataset, recording the calls that reach HDX."""
+    def __init__(self, name, resources):
+        self.data = {'name': name, 'title': name}
+        self.resources = [FakeResource(r) for r in resources]
+        self.update_in_hdx = mock.Mock()
+        self.create_in_hdx = mock.Mock()
+        self.set_dataset_date_from_datetime = mock.Mock()
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get_resources(self):
+        return self.resources
+
+class TestSyncDataset(TestCase):
+    @mock.patch('hdx_exports.hdx_export_set.Dataset.read_from_hdx', return_value=True)
+    def test_admin_saves_after_export_do_not_call_hdx(self, read_from_hdx):
+        exported = FakeDataset('hot_dakar_buildings', [{'name': 'buildings_gpkg.zip', 'url': 'http://x/buildings_gpkg.zip'}])
+        self.assertTrue(sync_dataset(exported, True))
+        exported.update_in_hdx.assert_called_once_with(update_resources=True)
+
+        for i in range(2):
+            saved = FakeDataset('hot_dakar_buildings', [])
+            self.assertFalse(sync_dataset(saved))
+            saved.update_in_hdx.assert_not_called()
+            saved.create_in_hdx.assert_not_called()
+
+        # resources are still known from the export.
+        again = FakeDataset('hot_dakar_buildings', [{'name': 'buildings_gpkg.zip', 'url': 'http://x/buildings_gpkg.zip'}])
+        self.assertFalse(sync_dataset(again, True))
+
+    @mock.patch('hdx_exports.hdx_export_set.Dataset.read_from_hdx', return_value=True)
+    def test_admin_save_with_new_metadata_keeps_resources(self, read_from_hdx):
+        sync_dataset(FakeDataset('hot_dakar_buildings', [{'name': 'buildings_gpkg.zip'}]), True)
+        saved = FakeDataset('hot_dakar_buildings', [])
+        saved.data['title'] = 'Dakar Buildings'
+        self.assertTrue(sync_dataset(saved))
+        saved.update_in_hdx.assert_called_once_with(update_resources=False)
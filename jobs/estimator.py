@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import rasterio
+from rasterio import features, windows
+
+Raster = namedtuple('Raster',['transform','width','height','data','sat'])
+
+class NodeEstimator(object):
+    """
+    Estimates OSM node counts from a node density raster in EPSG:3857.
+
+    On first use the raster and its summed-area table are written once to
+    .npy files in cache_dir (the system temp directory by default) and
+    memory-mapped, so every process on a host shares the same pages.
+    Bounding boxes are answered in O(1) from the summed-area table;
+    polygons are rasterized over their own window of the raster only.
+    Estimates are memoized by geometry.
+    """
+    def __init__(self,raster_path,cache_size=1024,cache_dir=None):
+        self.raster_path = raster_path
+        self.cache_dir = cache_dir
+        self._raster = None
+        self._raster_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    @property
+    def raster(self):
+        """The Raster, built or mapped from cache_dir on first access."""
+        if self._raster is None:
+            with self._raster_lock:
+                if self._raster is None:
+                    self._raster = self._open()
+        return self._raster
+
+    @property
+    def transform(self):
+        return self.raster.transform
+
+    @property
+    def width(self):
+        return self.raster.width
+
+    @property
+    def height(self):
+        return self.raster.height
+
+    @property
+    def data(self):
+        return self.raster.data
+
+    @property
+    def sat(self):
+        return self.raster.sat
+
+    def _open(self):
+        cache_dir = self.cache_dir or tempfile.gettempdir()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir,exist_ok=True)
+        st = os.stat(self.raster_path)
+        prefix = os.path.join(cache_dir,'osm_nodes_{0}_{1}'.format(st.st_size,int(st.st_mtime)))
+        with rasterio.open(self.raster_path) as src:
+            data = self._load(prefix + '_data.npy',lambda: src.read(1,masked=True).filled(0).astype('float64'))
+            sat = self._load(prefix + '_sat.npy',lambda: self._summed_area_table(data))
+            return Raster(src.transform,src.width,src.height,data,sat)
+
+    @staticmethod
+    def _load(path,compute):
+        # written under a name of its own and renamed into place, so
+        # processes building the same file at once never read a partial one.
+        if not os.path.exists(path):
+            tmp = '{0}.{1}.tmp.npy'.format(path,os.getpid())
+            np.save(tmp,compute())
+            os.rename(tmp,path)
+        return np.load(path,mmap_mode='r')
+
+    @staticmethod
+    def _summed_area_table(data):
+        # sat[r,c] is the sum of data[:r,:c].
+        height, width = data.shape
+        sat = np.zeros((height + 1,width + 1),dtype='float64')
+        sat[1:,1:] = data.cumsum(axis=0).cumsum(axis=1)
+        return sat
+
+    def _window(self,bounds):
+        """Rows and columns of the pixels whose centers fall within bounds."""
+        minx, miny, maxx, maxy = bounds
+        col0, row0 = ~self.transform * (minx,maxy)
+        col1, row1 = ~self.transform * (maxx,miny)
+        col0, col1 = sorted((col0,col1))
+        row0, row1 = sorted((row0,row1))
+        c0 = min(max(int(math.ceil(col0 - 0.5)),0),self.width)
+        c1 = min(max(int(math.floor(col1 - 0.5)) + 1,0),self.width)
+        r0 = min(max(int(math.ceil(row0 - 0.5)),0),self.height)
+        r1 = min(max(int(math.floor(row1 - 0.5)) + 1,0),self.height)
+        return r0, r1, c0, c1
+
+    def bbox_sum(self,bounds):
+        r0, r1, c0, c1 = self._window(bounds)
+        if r0 >= r1 or c0 >= c1:
+            return 0.0
+        sat = self.sat
+        return float(sat[r1,c1] - sat[r0,c1] - sat[r1,c0] + sat[r0,c0])
+
+    def polygon_sum(self,geojson,bounds):
+        r0, r1, c0, c1 = self._window(bounds)
+        if r0 >= r1 or c0 >= c1:
+            return 0.0
+        window = windows.Window(c0,r0,c1 - c0,r1 - r0)
+        inside = features.geometry_mask(
+            [geojson],
+            out_shape=(r1 - r0,c1 - c0),
+            transform=windows.transform(window,self.transform),
+            all_touched=False,
+            invert=True
+        )
+        return float(self.data[r0:r1,c0:c1][inside].sum())
+
+    def nodes(self,geom):
+        """
+        Estimated node count within geom, a GEOSGeometry in the raster's CRS.
+        """
+        key = hashlib.sha1(bytes(geom.wkb)).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        if geom.equals(geom.envelope):
+            total = self.bbox_sum(geom.extent)
+        else:
+            total = self.polygon_sum(json.loads(geom.json),geom.extent)
+        nodes = int(total * 1000)
+
+        with self._lock:
+            self._cache[key] = nodes
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return nodes
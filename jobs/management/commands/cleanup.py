@@ -27,9 +27,11 @@ class Command(BaseCommand):
             except (ExportRun.DoesNotExist, ValidationError):
                 remove_dir(run_uid)
 
-        # Remove not running folders from staging.
+        # Remove not running folders from staging,
+        # except those of recent failures, which a rerun resumes from.
         staging_folders = os.listdir(settings.EXPORT_STAGING_ROOT)
-        uids = [str(r.uid) for r in ExportRun.objects.exclude(status='RUNNING')]
+        resumable = ExportRun.objects.filter(status='FAILED',finished_at__gt=timezone.now() - timedelta(days=2))
+        uids = [str(r.uid) for r in ExportRun.objects.exclude(status='RUNNING').exclude(id__in=resumable)]
 
         # Filter.
         uids = [r for r in uids if r in staging_folders]
@@ -0,0 +1,62 @@
+import json
+import os
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from hdx_exports.bulk import resync_regions, update_feature_selection
+from jobs.models import HDXExportRegion
+
+class Command(BaseCommand):
+    help = 'Optionally set a new feature selection on HDX regions, then sync them to HDX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', help='Comma-separated region ids')
+        parser.add_argument('--prefix', help='Only regions whose dataset prefix starts with this')
+        parser.add_argument('--all', action='store_true', help='Every HDX region that is not deleted')
+        parser.add_argument('--yaml', help='Feature selection YAML file to set on the regions before syncing')
+        parser.add_argument('--workers', type=int, default=4, help='Regions synced at the same time')
+        parser.add_argument(
+            '--failures', default='hdx_resync_failures.json',
+            help='File the ids and errors of failed regions are written to')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Only sync the regions listed in the failures file')
+
+    def handle(self, *args, **kwargs):
+        regions = HDXExportRegion.objects.filter(deleted=False)
+        if kwargs['resume']:
+            if not os.path.exists(kwargs['failures']):
+                raise CommandError('No failures file at {0}'.format(kwargs['failures']))
+            with open(kwargs['failures']) as f:
+                regions = regions.filter(id__in=[int(region_id) for region_id in json.load(f)])
+        elif kwargs['ids']:
+            regions = regions.filter(id__in=[int(region_id) for region_id in kwargs['ids'].split(',')])
+        elif kwargs['prefix']:
+            regions = regions.filter(job__name__startswith=kwargs['prefix'])
+        elif not kwargs['all']:
+            raise CommandError('Select regions with --ids, --prefix, --all or --resume')
+        regions = list(regions.order_by('id'))
+
+        if kwargs['yaml']:
+            with open(kwargs['yaml']) as f:
+                feature_selection = f.read()
+            try:
+                updated = update_feature_selection(regions, feature_selection)
+            except ValidationError as e:
+                raise CommandError('Invalid feature selection: {0}'.format('; '.join(e.messages)))
+            self.stdout.write('Updated the feature selection of {0} regions'.format(updated))
+
+        def progress(done, total, region_id, error):
+            status = 'failed: {0}'.format(error) if error else 'synced'
+            self.stdout.write('[{0}/{1}] region {2} {3}'.format(done, total, region_id, status))
+
+        failures = resync_regions([region.id for region in regions], kwargs['workers'], progress)
+
+        if failures:
+            with open(kwargs['failures'], 'w') as f:
+                json.dump(failures, f, indent=2, sort_keys=True)
+            self.stdout.write('{0} regions failed, rerun with --resume to retry them; see {1}'.format(
+                len(failures), kwargs['failures']))
+        else:
+            if os.path.exists(kwargs['failures']):
+                os.remove(kwargs['failures'])
+            self.stdout.write('Synced {0} regions'.format(len(regions)))
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.stats import rollup_day
+
+class Command(BaseCommand):
+    help = 'Roll up daily usage statistics for the stats API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=2,
+            help='Number of most recent days to roll up; runs can finish the day after they are created')
+        parser.add_argument(
+            '--since',
+            help='Roll up every day from this date (YYYY-MM-DD) instead, to backfill')
+
+    def handle(self, *args, **kwargs):
+        today = timezone.now().date()
+        if kwargs['since']:
+            day = datetime.strptime(kwargs['since'], '%Y-%m-%d').date()
+        else:
+            day = today - timedelta(days=kwargs['days'] - 1)
+
+        while day <= today:
+            stats = rollup_day(day)
+            self.stdout.write('{0}: {1} jobs, {2} runs'.format(day, stats.jobs_count, stats.runs_count))
+            day += timedelta(days=1)
@@ -12,8 +12,14 @@ from django.conf import settings
 class Command(BaseCommand):
     help = 'Displays current time'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', action='store_true', default=False,
+            help='Extract all due planet-backed regions in a single pass over the planet file')
+
     def handle(self, *args, **kwargs):
         now = timezone.now()
+        planet_job_uids = []
 
         for regioncls in [HDXExportRegion, PartnerExportRegion]: 
             for region in regioncls.objects.exclude(schedule_period='disabled'):
@@ -49,7 +55,13 @@ class Command(BaseCommand):
                         now.day == 1 and
                         region.schedule_hour == now.hour and
                         delta > timedelta(hours=2)):
-                    ExportTaskRunner().run_task(job_uid=region.job.uid,ondemand=False)
+                    if kwargs['batch'] and region.planet_file and not getattr(region,'is_pdc_task',False):
+                        planet_job_uids.append(region.job.uid)
+                    else:
+                        ExportTaskRunner().run_task(job_uid=region.job.uid,ondemand=False)
+
+        if planet_job_uids:
+            ExportTaskRunner().run_planet_batch(planet_job_uids)
 
 
 
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from hdx_exports.bulk import update_feature_selection
 from jobs.models import HDXExportRegion
 
 NEW_YAML = """
@@ -218,8 +219,8 @@ Railways:
 """
 
 class Command(BaseCommand):
+    help = 'Set the default feature selection on every HDX region; sync them with resync_hdx_regions --all'
+
     def handle(self, *args, **kwargs):
-        for region in HDXExportRegion.objects.all():
-            job = region.job
-            job.feature_selection = NEW_YAML
-            job.save()
+        updated = update_feature_selection(HDXExportRegion.objects.all(), NEW_YAML)
+        self.stdout.write('Updated the feature selection of {0} regions'.format(updated))
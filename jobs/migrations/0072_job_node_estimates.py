@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0071_auto_20210209_1235'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='estimated_nodes',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='observed_elements',
+            field=django.contrib.postgres.fields.jsonb.JSONField(editable=False, null=True),
+        ),
+    ]
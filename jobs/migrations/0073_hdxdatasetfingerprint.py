@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0072_job_node_estimates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HDXDatasetFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('metadata_hash', models.CharField(max_length=64)),
+                ('resources_hash', models.CharField(max_length=64)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'hdx_dataset_fingerprints',
+            },
+        ),
+    ]
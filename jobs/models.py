@@ -4,7 +4,6 @@ from __future__ import unicode_literals
 import calendar
 from datetime import timedelta
 import logging
-import json
 import uuid
 import re
 import os
@@ -13,7 +12,8 @@ import math
 from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.contrib.gis.db import models
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.db.models import OuterRef, Subquery, Sum
 from django.db.models.fields import CharField
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -21,10 +21,10 @@ from collections import namedtuple
 import mercantile
 
 from utils.aoi_utils import simplify_geom, force2d
+from jobs.estimator import NodeEstimator
+from cachetools.func import ttl_cache
 from django.contrib import admin
 
-import rasterio
-from rasterio import mask
 from osm_export_tool.mapping import Mapping
 from hdx_exports.hdx_export_set import HDXExportSet
 
@@ -32,7 +32,8 @@ LOG = logging.getLogger(__name__)
 MAX_TILE_COUNT = 10000
 
 DIR = os.path.dirname(os.path.abspath(__file__))
-RASTER = rasterio.open(os.path.join(DIR,'osm_nodes.tif'))
+# built on first use, not at import.
+ESTIMATOR = NodeEstimator(os.path.join(DIR,'osm_nodes.tif'),cache_dir=settings.NODE_ESTIMATOR_DIR)
 
 Group.add_to_class('is_partner', models.BooleanField(null=False, default=False))
 
@@ -63,13 +64,53 @@ def get_geodesic_area(geom):
 MAX_NODES = 10000000
 ValidateResult = namedtuple('ValidateResult',['valid','message','params'])
 
+def estimate_nodes(aoi):
+    """Estimated number of OSM nodes within a 4326 AOI."""
+    aoi.srid = 4326
+    return ESTIMATOR.nodes(aoi.transform(3857,clone=True))
+
+@ttl_cache(ttl=60 * 60)
+def estimate_calibration():
+    """
+    Median ratio of observed to estimated nodes over recent unfiltered runs,
+    which see every node in their AOI. 1.0 until there is enough data.
+    """
+    ratios = []
+    jobs = Job.objects.filter(estimated_nodes__gt=0,observed_elements__filtered=False).order_by(
+        '-id').values_list('estimated_nodes','observed_elements')[:500]
+    for estimated, observed in jobs:
+        ratios.append(observed['nodes'] / estimated)
+    if len(ratios) < 20:
+        return 1.0
+    ratios.sort()
+    return ratios[len(ratios) // 2]
+
+def job_cost(nodes):
+    """Nodes charged against budgets for an export estimated at nodes."""
+    return max(int((nodes or 0) * estimate_calibration()),settings.MIN_JOB_NODES)
+
+def check_node_budget(user,nodes):
+    """
+    Admission control for new exports: the calibrated estimated nodes of
+    the jobs created in the last NODE_BUDGET_WINDOW minutes, plus the new
+    one, must stay within the per-user and the global budgets.
+    """
+    since = timezone.now() - timedelta(minutes=settings.NODE_BUDGET_WINDOW)
+    recent = list(Job.objects.filter(created_at__gt=since).values_list('user_id','estimated_nodes'))
+    cost = job_cost(nodes)
+    user_total = cost + sum(job_cost(n) for u, n in recent if u == user.id)
+    global_total = cost + sum(job_cost(n) for u, n in recent)
+    if user_total > settings.USER_NODE_BUDGET:
+        return ValidateResult(False,"You have exported about %(nodes)s nodes recently. \
+            Please wait before starting another export of this size.",{'nodes':user_total - cost})
+    if global_total > settings.GLOBAL_NODE_BUDGET:
+        return ValidateResult(False,"The export service is busy. Please try again later.",None)
+    return ValidateResult(True,None,None)
+
 def check_extent(aoi,url):
     if not aoi.valid:
         return ValidateResult(False,aoi.valid_reason,None)
-    aoi.srid = 4326
-    transformed = aoi.transform(3857,clone=True)
-    masked = mask.mask(RASTER,[json.loads(transformed.json)],all_touched=False)
-    nodes = masked[0].sum() * 1000
+    nodes = estimate_nodes(aoi)
     if nodes > MAX_NODES:
         return ValidateResult(False, "The selected area's bounding box contains about %(nodes)s nodes.\
             The maximum is %(maxnodes)s. Please choose a smaller area.",
@@ -157,6 +198,11 @@ class Job(models.Model):
     pinned = models.BooleanField(default=False)
     unfiltered = models.BooleanField(default=False)
 
+    # estimated nodes in the_geom, and the elements its last run actually read
+    # ({'nodes','ways','areas','filtered'}), for admission control and calibration.
+    estimated_nodes = models.BigIntegerField(null=True, editable=False)
+    observed_elements = JSONField(null=True, editable=False)
+
     class Meta:  # pragma: no cover
         managed = True
         db_table = 'jobs'
@@ -170,10 +216,31 @@ class Job(models.Model):
     def area(self):
         return get_geodesic_area(self.the_geom)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Job, cls).from_db(db, field_names, values)
+        instance._remember_geom()
+        return instance
+
+    def _remember_geom(self):
+        # what the derived geometry fields were computed from, see save().
+        if 'the_geom' in self.__dict__ and self.the_geom is not None:
+            self._saved_geom = (bytes(self.the_geom.ewkb), self.buffer_aoi)
+
+    def _geom_changed(self):
+        saved = getattr(self, '_saved_geom', None)
+        return (saved is None or self.simplified_geom is None or self.estimated_nodes is None or
+                saved != (bytes(self.the_geom.ewkb), self.buffer_aoi))
+
     def save(self, *args, **kwargs):
-        self.the_geom = force2d(self.the_geom)
-        self.simplified_geom = simplify_geom(self.the_geom,force_buffer=self.buffer_aoi)
+        # simplifying detailed boundaries is slow, so only redo it when the
+        # geometry or buffering changed, such as on creation.
+        if self._geom_changed():
+            self.the_geom = force2d(self.the_geom)
+            self.simplified_geom = simplify_geom(self.the_geom,force_buffer=self.buffer_aoi)
+            self.estimated_nodes = estimate_nodes(self.the_geom)
         super(Job, self).save(*args, **kwargs)
+        self._remember_geom()
 
     def __str__(self):
         return str(self.uid)
@@ -206,16 +273,45 @@ PERIOD_CHOICES = (
 )
 HOUR_CHOICES = zip(range(0, 24), range(0, 24))
 
+class RegionQuerySet(models.QuerySet):
+    def with_last_run(self):
+        """
+        Annotates each region with the id, finish time and total file size
+        of its job's latest run, so listing regions doesn't query per region.
+        """
+        from tasks.models import ExportRun, ExportTask
+        runs = ExportRun.objects.filter(job_id=OuterRef('job_id')).order_by('-created_at')
+        sizes = ExportTask.objects.filter(run_id=OuterRef('last_run_id')).order_by().values(
+            'run_id').annotate(total=Sum('filesize_bytes')).values('total')
+        return self.annotate(
+            last_run_id=Subquery(runs.values('id')[:1]),
+            last_run_finished_at=Subquery(runs.values('finished_at')[:1])
+        ).annotate(
+            last_run_size=Subquery(sizes, output_field=models.BigIntegerField())
+        )
+
 class RegionMixin:
+    @property
+    def _last_run_annotated(self):
+        return hasattr(self, 'last_run_id')
+
     @property
     def last_run(self): # noqa
-        if self.job.runs.count() > 0:
-            return self.job.runs.all()[self.job.runs.count() - 1].finished_at
+        if self._last_run_annotated:
+            return self.last_run_finished_at
+        run = self.job.runs.last()
+        if run:
+            return run.finished_at
 
     @property
     def last_size(self):
-        if self.job.runs.count() > 0:
-            return self.job.runs.all()[self.job.runs.count() - 1].size
+        if self._last_run_annotated:
+            if self.last_run_id is not None:
+                return self.last_run_size or 0
+            return None
+        run = self.job.runs.last()
+        if run:
+            return run.size
 
     @property
     def next_run(self): # noqa
@@ -300,6 +396,8 @@ class PartnerExportRegion(models.Model, RegionMixin):
     planet_file = models.BooleanField(default=False)
     polygon_centroid = models.BooleanField(default=False)
 
+    objects = RegionQuerySet.as_manager()
+
     @property
     def export_formats(self): # noqa
         return self.job.export_formats
@@ -320,6 +418,11 @@ class PartnerExportRegion(models.Model, RegionMixin):
     def group_name(self):
         return self.group.name
 
+    @property
+    def is_pdc_task(self):
+        """PDC point/centroid exports are produced from the whole planet by tasks.pdc."""
+        return self.group.name == "PDC" and self.planet_file and self.polygon_centroid
+
 class HDXExportRegion(models.Model, RegionMixin): # noqa
     """ Mutable database table for hdx - additional attributes on a Job."""
     schedule_period = models.CharField(
@@ -337,6 +440,8 @@ class HDXExportRegion(models.Model, RegionMixin): # noqa
     extra_notes = models.TextField(null=True,blank=True)
     planet_file = models.BooleanField(default=False)
 
+    objects = RegionQuerySet.as_manager()
+
     class Meta: # noqa
         db_table = 'hdx_export_regions'
 
@@ -385,3 +490,19 @@ class HDXExportRegion(models.Model, RegionMixin): # noqa
             return 30
 
         return 0
+
+class HDXDatasetFingerprint(models.Model):
+    """
+    Hashes of the metadata and resources last pushed to an HDX dataset,
+    so that syncing skips what has not changed since.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    metadata_hash = models.CharField(max_length=64)
+    resources_hash = models.CharField(max_length=64)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta: # noqa
+        db_table = 'hdx_dataset_fingerprints'
+
+    def __str__(self):
+        return self.name
@@ -1,5 +1,9 @@
 from rtree import index
 import csv
+import numpy as np
+
+# builds the reverse geocoding index used by api/reverse_geocode.py
+# from GeoNames cities1000.txt and admin1CodesASCII.txt.
 
 def readtsv(fname):
   with open(fname,'r') as f:
@@ -12,6 +16,11 @@ for row in readtsv('admin1CodesASCII.txt'):
   # concat code -> unicode name
   admin1codes[row[0]] = row[1]
 
+coords = []
+names = []
+admin1s = []
+countries = []
+
 idx = index.Rtree('reverse_geocode')
 for row in readtsv('cities1000.txt'):
   gnclass = row[7]
@@ -27,6 +36,14 @@ for row in readtsv('cities1000.txt'):
     if concat in admin1codes:
       admin_1 = admin1codes[concat]
     idx.insert(int(row[0]),(lon,lat,lon,lat),obj=[name,admin_1,country])
+    coords.append((lon,lat))
+    names.append(name)
+    admin1s.append(admin_1)
+    countries.append(country)
 
-
-
+# flat arrays for the KD-tree: much smaller and faster to load than the rtree.
+np.savez_compressed('reverse_geocode.npz',
+  coords=np.array(coords,dtype='float64'),
+  names=np.array(names),
+  admin1=np.array(admin1s),
+  countries=np.array(countries))
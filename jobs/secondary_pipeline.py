@@ -1,61 +1,306 @@
 import argparse
+import ast
+import fcntl
 import glob
-import shutil
 import json
 import os
 import logging
+import shutil
 import subprocess
-from osmium.replication import server
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime,timezone
 
-# 0 3 * * * /home/exports/venv/bin/python /home/exports/osm-export-tool/jobs/secondary_pipeline.py /mnt/data/planet/ >> /home/exports/secondary_pipeline.log 2>&1
+import requests
+from osmium.replication import server
+
+# 0 * * * * /home/exports/venv/bin/python /home/exports/osm-export-tool/jobs/secondary_pipeline.py /mnt/data/planet/ --granularity hour --regions-interval 24 >> /home/exports/secondary_pipeline.log 2>&1
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',level=logging.INFO)
 
 parser = argparse.ArgumentParser(description='osmium-tool based pipeline')
 parser.add_argument('directory', help='Working directory - needs a lot of space')
+parser.add_argument('--granularity', choices=['minute','hour','day'], default='day', help='Replication diffs to apply')
+parser.add_argument('--workers', type=int, default=4, help='Diffs to download at once')
+parser.add_argument('--max-diffs', type=int, default=1000, help='Most diffs to apply in one run; the rest are applied on the next run')
+parser.add_argument('--regions-interval', type=int, default=0, help='Hours between cuts of the continent and country PBFs; 0 to not cut them')
 parsed = parser.parse_args()
 workdir = parsed.directory
 planet = os.path.join(workdir,'planet.osm.pbf')
+planet_updated = os.path.join(workdir,'planet-updated.osm.pbf')
+# read by tasks.planet.planet_timestamp - keep the name in sync.
+state_file = planet + '.state.json'
+diff_dir = os.path.join(workdir,'tmp')
+merged = os.path.join(workdir,'merged-changes.osc.gz')
+# read by tasks.planet.RegionIndex - keep the name in sync.
+regions_dir = os.path.join(workdir,'regions')
+regions_index = os.path.join(regions_dir,'index.json')
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDC_MODULE = os.path.join(REPO,'tasks','pdc.py')
+ADM0_DIR = os.path.join(REPO,'hdx_exports','adm0')
+
+# countries are cut from the smallest continent containing them,
+# those no continent contains straight from the planet.
+CONTINENTS = {
+	'africa':(-26.0,-47.0,64.0,38.0),
+	'asia':(25.0,-12.0,180.0,82.0),
+	'australia-oceania':(110.0,-56.0,180.0,0.0),
+	'central-america':(-120.0,5.0,-55.0,33.0),
+	'europe':(-32.0,34.0,45.0,82.0),
+	'north-america':(-180.0,5.0,-50.0,84.0),
+	'south-america':(-93.0,-57.0,-32.0,13.0),
+}
 
 PLANET_OSM_PBF = 'https://planet.openstreetmap.org/pbf/planet-latest.osm.pbf'
+REPLICATION_URL = 'https://planet.openstreetmap.org/replication/{0}'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
-if not os.path.isfile(planet):
-	logging.warning('Downloading planet.osm.pbf')
-	subprocess.call(['wget','-O',planet,PLANET_OSM_PBF])
-
-fileinfo = json.loads(subprocess.check_output(['osmium','fileinfo','-j',planet]))
-option = fileinfo['header']['option']
-daily = server.ReplicationServer('https://planet.openstreetmap.org/replication/day')
-
-if 'osmosis_replication_sequence_number' in option:
-	seqnum = int(option['osmosis_replication_sequence_number'])
-else:
-	timestamp = fileinfo['header']['option']['osmosis_replication_timestamp']
-	timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
-	timestamp = timestamp.replace(tzinfo=timezone.utc)
-	logging.warning("Timestamp is {0}".format(timestamp))
-	seqnum = daily.timestamp_to_sequence(timestamp)
-
-logging.warning("Seqnum is {0}".format(seqnum))
-latest = daily.get_state_info().sequence
-logging.warning("Latest is {0}".format(latest))
-if seqnum == latest:
-	exit(0)
+def download(url,path,attempts=3):
+	"""
+	Downloads url to path through path.part, resuming a partial
+	download with a Range request where the server allows it.
+	"""
+	if os.path.isfile(path):
+		return path
+	part = path + '.part'
+	for attempt in range(attempts):
+		offset = os.path.getsize(part) if os.path.isfile(part) else 0
+		headers = {'Range':'bytes={0}-'.format(offset)} if offset else {}
+		try:
+			r = requests.get(url,headers=headers,stream=True,timeout=60)
+			try:
+				r.raise_for_status()
+				with open(part,'ab' if r.status_code == 206 else 'wb') as f:
+					for chunk in r.iter_content(chunk_size=1024 * 1024):
+						f.write(chunk)
+			finally:
+				r.close()
+			os.rename(part,path)
+			return path
+		except (requests.exceptions.RequestException, IOError) as e:
+			logging.warning('Download of {0} failed ({1}), attempt {2} of {3}'.format(url,e,attempt + 1,attempts))
+			time.sleep(2 ** attempt)
+	raise IOError('Could not download {0}'.format(url))
+
+def fileinfo(path,extended=False):
+	cmd = ['osmium','fileinfo','-j',path]
+	if extended:
+		cmd.insert(2,'-e')
+	return json.loads(subprocess.check_output(cmd).decode())
+
+def read_state():
+	try:
+		with open(state_file) as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+def write_state(sequence,timestamp):
+	tmp = state_file + '.tmp'
+	with open(tmp,'w') as f:
+		json.dump({'granularity':parsed.granularity,'sequence':sequence,'timestamp':timestamp},f)
+	os.replace(tmp,state_file)
+
+def current_sequence(repserv):
+	"""
+	Sequence number of the last diff applied to the planet, at the
+	configured granularity: from the state file if it was written for this
+	granularity, otherwise looked up from the planet's timestamp.
+	"""
+	state = read_state()
+	if state and state.get('granularity') == parsed.granularity:
+		return state['sequence']
+	option = fileinfo(planet)['header']['option']
+	if state is None and parsed.granularity == 'day' and 'osmosis_replication_sequence_number' in option:
+		# planets updated before there was a state file carry a daily sequence.
+		return int(option['osmosis_replication_sequence_number'])
+	timestamp = state['timestamp'] if state else option['osmosis_replication_timestamp']
+	timestamp = datetime.strptime(timestamp,TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+	logging.info('Timestamp is {0}'.format(timestamp))
+	return repserv.timestamp_to_sequence(timestamp)
+
+def update(repserv):
+	seqnum = current_sequence(repserv)
+	logging.info('Seqnum is {0}'.format(seqnum))
+	latest = repserv.get_state_info()
+	if latest is None:
+		raise IOError('Could not read replication state from {0}'.format(repserv.baseurl))
+	logging.info('Latest is {0}'.format(latest.sequence))
+	target = min(latest.sequence,seqnum + parsed.max_diffs)
+	if seqnum >= target:
+		return
+	target_state = latest if target == latest.sequence else repserv.get_state_info(target)
+	if target_state is None:
+		raise IOError('Could not read replication state {0}'.format(target))
+	timestamp = target_state.timestamp.strftime(TIMESTAMP_FORMAT)
+
+	# diffs are kept across failed runs, so a retry only fetches what is missing.
+	os.makedirs(diff_dir,exist_ok=True)
+	sequences = range(seqnum + 1,target + 1)
+	with ThreadPoolExecutor(max_workers=parsed.workers) as executor:
+		futures = [executor.submit(download,repserv.get_diff_url(i),os.path.join(diff_dir,'{0}.osc.gz'.format(i))) for i in sequences]
+		diffs = [future.result() for future in futures]
+
+	subprocess.check_call(['osmium','merge-changes','--overwrite','--simplify',*diffs,'-o',merged])
+	subprocess.check_call([
+		'osmium','apply-changes','--overwrite',
+		'--output-header','osmosis_replication_sequence_number={0}'.format(target),
+		'--output-header','osmosis_replication_timestamp={0}'.format(timestamp),
+		'--output-header','osmosis_replication_base_url={0}'.format(repserv.baseurl),
+		planet,merged,'-o',planet_updated
+	])
 
+	# read the whole new planet before it replaces the old one.
+	info = fileinfo(planet_updated,extended=True)
+	if info['header']['option'].get('osmosis_replication_timestamp') != timestamp or not info['data']['count']['nodes']:
+		raise ValueError('{0} failed verification'.format(planet_updated))
+	os.replace(planet_updated,planet)
+	write_state(target,timestamp)
+	logging.info('Planet updated to sequence {0} ({1})'.format(target,timestamp))
+
+	shutil.rmtree(diff_dir)
+	os.remove(merged)
+
+def country_bboxes():
+	"""
+	The BBOXES table of tasks/pdc.py, read without importing it
+	(and Django with it) into this script.
+	"""
+	with open(PDC_MODULE) as f:
+		tree = ast.parse(f.read())
+	for node in tree.body:
+		if isinstance(node,ast.Assign) and getattr(node.targets[0],'id',None) == 'BBOXES':
+			return ast.literal_eval(node.value)
+	raise ValueError('No BBOXES in {0}'.format(PDC_MODULE))
+
+def polygon_bbox(geometry):
+	polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+	points = [point for polygon in polygons for ring in polygon for point in ring]
+	return (min(p[0] for p in points),min(p[1] for p in points),max(p[0] for p in points),max(p[1] for p in points))
+
+def contains(outer,inner):
+	return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+def area(bbox):
+	return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+def region_table(out):
+	"""
+	Continents, the country bboxes of tasks/pdc.py and the polygons of
+	hdx_exports/adm0, the latter copied into out as GeoJSON features.
+	"""
+	regions = [{'name':name,'level':'continent','bbox':bbox} for name, bbox in sorted(CONTINENTS.items())]
+	for iso, (name, bbox) in sorted(country_bboxes().items()):
+		regions.append({'name':iso.lower(),'level':'country','bbox':bbox})
+	for path in sorted(glob.glob(os.path.join(ADM0_DIR,'*_adm0.geojson'))):
+		with open(path) as f:
+			geometry = json.load(f)
+		polygon = os.path.join(out,os.path.basename(path))
+		with open(polygon,'w') as f:
+			json.dump({'type':'Feature','properties':{},'geometry':geometry},f)
+		name = os.path.basename(path)[:-len('.geojson')].lower()
+		regions.append({'name':name,'level':'country','bbox':polygon_bbox(geometry),'polygon':polygon})
+
+	for region in regions:
+		region['path'] = os.path.join(out,region['name'] + '.osm.pbf')
+		if region['level'] == 'continent':
+			continue
+		parents = [r for r in regions if r['level'] == 'continent' and contains(r['bbox'],region['bbox'])]
+		if parents:
+			region['parent'] = min(parents,key=lambda r: area(r['bbox']))['name']
+	return regions
+
+def extract(source,regions,out):
+	"""Cuts regions out of source in a single osmium read of it."""
+	extracts = []
+	for region in regions:
+		e = {'output':os.path.basename(region['path'])}
+		if 'polygon' in region:
+			e['polygon'] = {'file_name':region['polygon'],'file_type':'geojson'}
+		else:
+			e['bbox'] = list(region['bbox'])
+		extracts.append(e)
+	config = os.path.join(out,'extract-{0}.json'.format(os.path.basename(source).split('.')[0]))
+	with open(config,'w') as f:
+		json.dump({'directory':out,'extracts':extracts},f)
+	logging.info('Cutting {0} regions from {1}'.format(len(extracts),source))
+	subprocess.check_call(['osmium','extract','-c',config,source,'--overwrite','--no-progress'])
+	os.remove(config)
+
+def cut_regions():
+	"""
+	Cuts continent PBFs from the planet, then country PBFs from their
+	continent, into a new directory per planet sequence, then swaps
+	index.json to point at them. The previous cut is kept for exports
+	still reading it.
+	"""
+	state = read_state() or {}
+	option = fileinfo(planet)['header']['option']
+	sequence = state.get('sequence',option.get('osmosis_replication_sequence_number','0'))
+	timestamp = state.get('timestamp',option.get('osmosis_replication_timestamp'))
+	try:
+		with open(regions_index) as f:
+			if str(json.load(f)['sequence']) == str(sequence):
+				# nothing new; never rewrite files exports may be reading.
+				os.utime(regions_index,None)
+				return
+	except (IOError, ValueError, KeyError):
+		pass
+	out = os.path.join(regions_dir,str(sequence))
+	os.makedirs(out,exist_ok=True)
+
+	regions = region_table(out)
+	extract(planet,[r for r in regions if 'parent' not in r],out)
+	for continent in [r for r in regions if r['level'] == 'continent']:
+		children = [r for r in regions if r.get('parent') == continent['name']]
+		if children:
+			extract(continent['path'],children,out)
+
+	for region in regions:
+		region['size'] = os.path.getsize(region['path'])
+		region.pop('parent',None)
+	tmp = regions_index + '.tmp'
+	with open(tmp,'w') as f:
+		json.dump({'sequence':sequence,'timestamp':timestamp,'regions':regions},f)
+	os.replace(tmp,regions_index)
+	logging.info('Cut {0} regions at sequence {1}'.format(len(regions),sequence))
+
+	cuts = sorted((d for d in os.listdir(regions_dir) if d.isdigit()),key=int)
+	for old in cuts[:-2]:
+		shutil.rmtree(os.path.join(regions_dir,old))
+
+def regions_stale():
+	try:
+		age = time.time() - os.path.getmtime(regions_index)
+	except OSError:
+		return True
+	return age > parsed.regions_interval * 60 * 60 - 5 * 60
+
+lock = open(os.path.join(workdir,'.secondary_pipeline.lock'),'w')
 try:
-	os.mkdir(os.path.join(workdir,'tmp'))
-except:
-	pass
+	fcntl.flock(lock,fcntl.LOCK_EX | fcntl.LOCK_NB)
+except IOError:
+	logging.warning('Another update is running, exiting')
+	sys.exit(0)
+
+if not os.path.isfile(planet):
+	logging.warning('Downloading planet.osm.pbf')
+	subprocess.check_call(['wget','-c','-O',planet + '.part',PLANET_OSM_PBF])
+	os.rename(planet + '.part',planet)
 
 try:
-	for i in range(seqnum+1,latest+1):
-		subprocess.call(['wget','-O',os.path.join(workdir,'tmp','{0}.osc.gz'.format(i)),daily.get_diff_url(i)])
-
-	g = glob.glob(os.path.join(workdir,'tmp','*.osc.gz'))
-	subprocess.call(['osmium','merge-changes','--overwrite','--simplify',*g,'-o',os.path.join(workdir,'merged-changes.osc.gz')])
-	subprocess.call(['osmium','apply-changes','--output-header','osmosis_replication_sequence_number={0}'.format(latest),planet,os.path.join(workdir,'merged-changes.osc.gz'),'-o',os.path.join(workdir,'planet-updated.osm.pbf')])
-	os.rename(os.path.join(workdir,'planet-updated.osm.pbf'),planet)
-except:
-	pass
-finally:
-	shutil.rmtree(os.path.join(workdir,'tmp'))
+	update(server.ReplicationServer(REPLICATION_URL.format(parsed.granularity)))
+except Exception:
+	logging.exception('Planet update failed, keeping the current planet')
+	if os.path.isfile(planet_updated):
+		os.remove(planet_updated)
+	sys.exit(1)
 
+if parsed.regions_interval and regions_stale():
+	try:
+		cut_regions()
+	except Exception:
+		logging.exception('Cutting regions failed, keeping the current ones')
+		sys.exit(1)
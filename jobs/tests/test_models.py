@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+import shutil
+import tempfile
 from unittest import skip
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
 
-from jobs.models import Job, HDXExportRegion
+from jobs.estimator import NodeEstimator
+from jobs.models import DIR, ESTIMATOR, Job, HDXExportRegion, check_node_budget
 from feature_selection.feature_selection import FeatureSelection
+from utils.aoi_utils import simplify_geom
 
 LOG = logging.getLogger(__name__)
 
@@ -55,6 +63,36 @@ class TestJob(TestCase):
             job.full_clean()
         self.assertTrue('export_formats' in e.exception.message_dict)
 
+    @override_settings(MIN_JOB_NODES=10 ** 9,USER_NODE_BUDGET=25 * 10 ** 8,GLOBAL_NODE_BUDGET=10 ** 10)
+    def test_node_budget(self):
+        user = self.fixture['user']
+        Job.objects.create(**self.fixture)
+        self.assertTrue(check_node_budget(user,0).valid)
+        Job.objects.create(**self.fixture)
+        result = check_node_budget(user,0)
+        self.assertFalse(result.valid)
+        self.assertEqual(result.params,{'nodes':2 * 10 ** 9})
+
+        other = User.objects.create(username='other', email='other@demo.com', password='demo')
+        self.assertTrue(check_node_budget(other,0).valid)
+
+    def test_simplify_geom(self):
+        detailed = Point(0,0).buffer(1,quadsegs=1000)
+        simplified = simplify_geom(detailed)
+        self.assertLessEqual(simplified.num_coords,500)
+        self.assertTrue(simplified.contains(detailed))
+        self.assertTrue(simplify_geom(detailed).equals_exact(simplified))
+
+    def test_save_keeps_simplified_geom(self):
+        job = Job.objects.create(**self.fixture)
+        job = Job.objects.get(id=job.id)
+        job.simplified_geom = Polygon.from_bbox((0,0,1,1))
+        job.save()
+        self.assertEqual(job.simplified_geom.extent,(0,0,1,1))
+        job.buffer_aoi = True
+        job.save()
+        self.assertNotEqual(job.simplified_geom.extent,(0,0,1,1))
+
     def test_max_lengths(self):
         self.fixture['name'] = 'a' * 101
         job = Job(**self.fixture)
@@ -79,6 +117,24 @@ class TestJob(TestCase):
         self.assertEqual(e.exception.message_dict['feature_selection'],[u'YAML must be dict, not list'])
         
 
+class TestNodeEstimator(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_arrays_are_built_on_first_use(self):
+        cache_dir = os.path.join(self.dir,'estimator')
+        estimator = NodeEstimator(os.path.join(DIR,'osm_nodes.tif'),cache_dir=cache_dir)
+        self.assertFalse(os.path.exists(cache_dir))
+
+        aoi = Polygon.from_bbox((-10.80029,6.3254236,-10.79809,6.32752))
+        aoi.srid = 4326
+        aoi.transform(3857)
+        self.assertEqual(estimator.nodes(aoi),ESTIMATOR.nodes(aoi))
+        self.assertEqual(sorted(f.rsplit('_',1)[1] for f in os.listdir(cache_dir)),['data.npy','sat.npy'])
+
 class TestHDXExportRegion(TestCase):
     def setUp(self,):
         user = User.objects.create(
@@ -113,3 +169,62 @@ class TestHDXExportRegion(TestCase):
         with self.assertRaises(ValidationError) as e:
             region.full_clean()
         self.assertTrue('dataset_prefix' in e.exception.message_dict)
+
+    def test_region_last_run_annotation(self):
+        from tasks.models import ExportRun, ExportTask
+        region = HDXExportRegion.objects.create(**self.fixture)
+        self.assertIsNone(HDXExportRegion.objects.with_last_run().get(id=region.id).last_size)
+
+        ExportRun.objects.create(job=self.job,user=self.job.user)
+        run = ExportRun.objects.create(job=self.job,user=self.job.user,finished_at=timezone.now())
+        ExportTask.objects.create(run=run,name='shp',filesize_bytes=10)
+        ExportTask.objects.create(run=run,name='kml',filesize_bytes=5)
+
+        annotated = HDXExportRegion.objects.with_last_run().get(id=region.id)
+        self.assertEqual(annotated.last_run,run.finished_at)
+        self.assertEqual(annotated.last_size,15)
+        self.assertEqual(region.last_size,15)
+
+    def test_bulk_update_feature_selection(self):
+        from hdx_exports.bulk import update_feature_selection
+        region = HDXExportRegion.objects.create(**self.fixture)
+        with self.assertRaises(ValidationError):
+            update_feature_selection([region],'not: [valid')
+        self.assertEqual(Job.objects.get(id=self.job.id).feature_selection,FeatureSelection.example('simple'))
+
+        yaml = '''
+        amenities:
+            types:
+                - points
+            select:
+                - amenity
+        '''
+        self.assertEqual(update_feature_selection([region],yaml),1)
+        self.assertEqual(Job.objects.get(id=self.job.id).feature_selection,yaml)
+
+    @patch('tasks.task_runners.sync_regions_async')
+    def test_admin_update_feature_selection(self,sync_regions_async):
+        region = HDXExportRegion.objects.create(**self.fixture)
+        self.client.force_login(User.objects.create_superuser('admin','admin@demo.com','admin'))
+        url = reverse('admin:jobs_hdxexportregion_changelist')
+        action = {'action':'update_feature_selection','_selected_action':[region.id]}
+
+        # the action first asks for the YAML.
+        self.assertContains(self.client.post(url,action),'Update and sync')
+
+        response = self.client.post(url,dict(action,apply='1',feature_selection='not: [valid'))
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(Job.objects.get(id=self.job.id).feature_selection,FeatureSelection.example('simple'))
+        sync_regions_async.send.assert_not_called()
+
+        yaml = '''
+        amenities:
+            types:
+                - points
+            select:
+                - amenity
+        '''
+        response = self.client.post(url,dict(action,apply='1',feature_selection=yaml))
+        self.assertEqual(response.status_code,302)
+        self.assertEqual(Job.objects.get(id=self.job.id).feature_selection,yaml)
+        sync_regions_async.send.assert_called_once_with([region.id])
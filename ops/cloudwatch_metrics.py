@@ -5,7 +5,10 @@ import redis
 
 r = redis.Redis(host='localhost', port=6379, db=0)
 ondemand_len = r.llen('dramatiq:default')
+small_len = r.llen('dramatiq:small')
+large_len = r.llen('dramatiq:large')
 scheduled_len = r.llen('dramatiq:scheduled')
+hdx_len = r.llen('dramatiq:hdx')
 
 disk_usage = shutil.disk_usage('/mnt/data')
 disk_used_percent = disk_usage.used / disk_usage.total * 100
@@ -23,9 +26,24 @@ boto3.client('cloudwatch','us-east-1').put_metric_data(
             'Value':ondemand_len,
             'Unit':'Count'
         },
+        {
+            'MetricName':'QueueLenSmall',
+            'Value':small_len,
+            'Unit':'Count'
+        },
+        {
+            'MetricName':'QueueLenLarge',
+            'Value':large_len,
+            'Unit':'Count'
+        },
         {
             'MetricName':'QueueLenScheduled',
             'Value':scheduled_len,
             'Unit':'Count'
+        },
+        {
+            'MetricName':'QueueLenHDX',
+            'Value':hdx_len,
+            'Unit':'Count'
         }
     ])
\ No newline at end of file
@@ -85,6 +85,9 @@ su - postgres -c 'psql exports -c "create extension hstore;"'
 mv /tmp/nginx.conf /etc/nginx/nginx.conf
 mv /tmp/django.service /etc/systemd/system/django.service
 mv /tmp/worker-ondemand.service /etc/systemd/system/worker-ondemand.service
+mv /tmp/worker-ondemand-small.service /etc/systemd/system/worker-ondemand-small.service
+mv /tmp/worker-ondemand-large.service /etc/systemd/system/worker-ondemand-large.service
+mv /tmp/worker-hdx.service /etc/systemd/system/worker-hdx.service
 mv /tmp/worker-scheduled.service /etc/systemd/system/worker-scheduled.service
 
 yarn global add tl @mapbox/mbtiles @mapbox/tilelive @mapbox/tilejson tilelive-http --prefix /usr/local/
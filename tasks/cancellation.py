@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import logging
+import os
+import signal
+import threading
+
+from django import db
+from dramatiq.middleware.threading import raise_thread_exception
+
+from tasks.models import ExportRun
+
+LOG = logging.getLogger(__name__)
+
+# seconds between checks of a running run's status.
+POLL_INTERVAL = 5
+
+class RunCanceled(Exception):
+    pass
+
+def descendants(pids):
+    """Process ids of all children of pids, and their children."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(entry)) as f:
+                # the command name may contain spaces; ppid follows its closing paren.
+                ppid = int(f.read().rsplit(')',1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid,[]).append(int(entry))
+
+    result = []
+    stack = list(pids)
+    while stack:
+        for child in children.get(stack.pop(),[]):
+            result.append(child)
+            stack.append(child)
+    return result
+
+def thread_id():
+    """Kernel id of the current thread, under which /proc lists its children."""
+    if hasattr(threading,'get_native_id'):
+        return threading.get_native_id()
+    # SYS_gettid on x86_64, for python < 3.8.
+    return ctypes.CDLL(None,use_errno=True).syscall(186)
+
+def thread_children(tid):
+    """Process ids of the children started by thread tid of this process."""
+    with open('/proc/{0}/task/{1}/children'.format(os.getpid(),tid)) as f:
+        return [int(pid) for pid in f.read().split()]
+
+_local = threading.local()
+
+def current_watcher():
+    """The CancelWatcher of the run processed on this thread, if any."""
+    return getattr(_local,'watcher',None)
+
+class CancelWatcher(threading.Thread):
+    """
+    Watches a run while it is processed on the current thread.
+    Once the run is marked CANCELED it kills the subprocesses started by
+    the run's threads and raises RunCanceled in the processing thread, the
+    same way dramatiq enforces time limits. Killing is repeated until the
+    watcher is stopped, in case steps on other threads start new
+    subprocesses meanwhile. RunCanceled is raised at most once, and never
+    after stop() has returned, so it can't land in cleanup or in whatever
+    the thread processes next.
+    """
+    def __init__(self,run_uid):
+        super(CancelWatcher,self).__init__(daemon=True)
+        self.run_uid = run_uid
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.canceled = False
+        self.active = True
+        self.threads = set()
+        self._lock = threading.Lock()
+        self.add_thread()
+
+    def add_thread(self):
+        """Counts subprocesses started by the current thread as the run's."""
+        with self._lock:
+            self.threads.add(thread_id())
+        _local.watcher = self
+
+    def remove_thread(self):
+        with self._lock:
+            self.threads.discard(thread_id())
+        _local.watcher = None
+
+    def kill_subprocesses(self):
+        with self._lock:
+            threads = list(self.threads)
+        children = []
+        for tid in threads:
+            try:
+                children += thread_children(tid)
+            except (IOError, OSError):
+                continue
+        if not children:
+            return
+        for pid in children + descendants(children):
+            try:
+                os.kill(pid,signal.SIGKILL)
+            except OSError:
+                pass
+
+    def run(self):
+        try:
+            while not self.stopped.wait(POLL_INTERVAL):
+                if not self.canceled:
+                    self.canceled = ExportRun.objects.filter(uid=self.run_uid,status='CANCELED').exists()
+                    if self.canceled:
+                        LOG.warn('ExportRun {0} was canceled, stopping it.'.format(self.run_uid))
+                        self.kill_subprocesses()
+                        with self._lock:
+                            if self.active:
+                                raise_thread_exception(self.thread_id,RunCanceled)
+                else:
+                    self.kill_subprocesses()
+        finally:
+            db.connection.close()
+
+    def stop(self):
+        """
+        Stops watching and waits for the watcher to exit. Called on the
+        processing thread, where RunCanceled may still surface until it returns.
+        """
+        try:
+            with self._lock:
+                self.active = False
+        finally:
+            self.stopped.set()
+            _local.watcher = None
+            if self.is_alive():
+                self.join()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0036_auto_20170522_2220'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportrun',
+            name='data_timestamp',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0037_exportrun_data_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportRunStage',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=50)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('finished_at', models.DateTimeField(editable=False, null=True)),
+                ('wall_time', models.FloatField(null=True)),
+                ('cpu_time', models.FloatField(null=True)),
+                ('max_rss', models.BigIntegerField(null=True)),
+                ('bytes_read', models.BigIntegerField(null=True)),
+                ('bytes_written', models.BigIntegerField(null=True)),
+                ('element_counts', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='tasks.ExportRun')),
+            ],
+            options={
+                'db_table': 'export_run_stages',
+                'ordering': ['started_at'],
+            },
+        ),
+    ]
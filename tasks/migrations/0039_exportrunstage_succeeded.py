@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0038_exportrunstage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportrunstage',
+            name='succeeded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
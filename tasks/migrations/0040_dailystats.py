@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0039_exportrunstage_succeeded'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('jobs_count', models.IntegerField(default=0)),
+                ('users_count', models.IntegerField(default=0)),
+                ('runs_count', models.IntegerField(default=0)),
+                ('failed_runs_count', models.IntegerField(default=0)),
+                ('bytes_produced', models.BigIntegerField(default=0)),
+                ('format_durations', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('regions', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('centroids', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+            options={
+                'db_table': 'daily_stats',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0040_dailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportrun',
+            name='source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='exportrun',
+            name='source_inputs',
+            field=django.contrib.postgres.fields.jsonb.JSONField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0042_exporttask_themes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='exportrunstage',
+            name='max_rss',
+        ),
+    ]
@@ -4,16 +4,19 @@ from __future__ import unicode_literals
 import uuid
 import os
 
+from django import forms
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
 from jobs.models import Job, HDXExportRegion, SavedFeatureSelection, PartnerExportRegion
 from django.contrib import admin
 from django.contrib.gis.admin import GeoModelAdmin
 from django.utils.safestring import mark_safe
 from django.core.urlresolvers import reverse
+from django.template.response import TemplateResponse
 
 class ExportRun(models.Model):
     """
@@ -31,6 +34,12 @@ class ExportRun(models.Model):
     )
     started_at = models.DateTimeField(default=timezone.now, editable=False)
     finished_at = models.DateTimeField(editable=False, null=True)
+    # replication timestamp of the OSM data the run was exported from.
+    data_timestamp = models.DateTimeField(editable=False, null=True)
+    # 'overpass' or 'planet', as chosen by tasks.source_planner, and
+    # what it was chosen from.
+    source = models.CharField(max_length=20, blank=True, default='', editable=False)
+    source_inputs = JSONField(null=True, editable=False)
 
     class Meta:
         db_table = 'export_runs'
@@ -54,6 +63,17 @@ class ExportRun(models.Model):
         return sum(map(
             lambda task: task.filesize_bytes or 0, self.tasks.all()))
 
+    def cancel(self):
+        """
+        Marks the run CANCELED if it hasn't finished. A worker processing it
+        stops at its next status check (see tasks.cancellation).
+        """
+        canceled = ExportRun.objects.filter(id=self.id, status__in=['SUBMITTED', 'RUNNING']).update(
+            status='CANCELED', finished_at=timezone.now())
+        if canceled:
+            self.refresh_from_db()
+        return canceled > 0
+
 
 class ExportTask(models.Model):
     """
@@ -70,6 +90,8 @@ class ExportTask(models.Model):
     finished_at = models.DateTimeField(editable=False, null=True)
     filesize_bytes = models.IntegerField(null=True)
     filenames = ArrayField(models.TextField(null=True),default=list)
+    # theme of each of filenames, None for files that have none.
+    themes = ArrayField(models.TextField(null=True),default=list)
 
     class Meta:
         db_table = 'export_tasks'
@@ -103,19 +125,80 @@ class ExportTask(models.Model):
 
 
 
+class ExportRunStage(models.Model):
+    """
+    Time and resources spent on one step of an export run.
+    Written by tasks.stages.stage.
+    """
+    id = models.AutoField(primary_key=True, editable=False)
+    run = models.ForeignKey(ExportRun, related_name='stages')
+    name = models.CharField(max_length=50)
+    started_at = models.DateTimeField(default=timezone.now, editable=False)
+    finished_at = models.DateTimeField(editable=False, null=True)
+    # seconds
+    wall_time = models.FloatField(null=True)
+    cpu_time = models.FloatField(null=True)
+    # bytes
+    bytes_read = models.BigIntegerField(null=True)
+    bytes_written = models.BigIntegerField(null=True)
+    # OSM element counts, for stages that read OSM data.
+    element_counts = JSONField(null=True)
+    # completed stages are checkpoints a rerun of the run can resume from.
+    succeeded = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'export_run_stages'
+        ordering = ['started_at']
+
+    def __str__(self):
+        return '{0} {1}'.format(self.run_id, self.name)
+
+
+class DailyStats(models.Model):
+    """
+    Usage statistics for one UTC day, maintained by the rollup_stats
+    command and served by the stats API.
+    Jobs, runs and tasks are counted on the day they were created.
+    """
+    date = models.DateField(unique=True)
+    jobs_count = models.IntegerField(default=0)
+    users_count = models.IntegerField(default=0)
+    runs_count = models.IntegerField(default=0)
+    failed_runs_count = models.IntegerField(default=0)
+    bytes_produced = models.BigIntegerField(default=0)
+    # format name -> sorted durations in seconds of its successful tasks.
+    format_durations = JSONField(default=dict)
+    # country code -> number of jobs centred nearest to it.
+    regions = JSONField(default=dict)
+    # [lon, lat] centroid of each job.
+    centroids = JSONField(default=list)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        db_table = 'daily_stats'
+        ordering = ['-date']
+
+    def __str__(self):
+        return '{0}'.format(self.date)
+
+
 class ExportRunAdmin(admin.ModelAdmin):
 
     def start(self, request, queryset):
-        from tasks.task_runners import run_task_async_ondemand
+        from tasks.task_runners import send_ondemand
+        for run in queryset.select_related('job'):
+            send_ondemand(run)
+
+    def cancel(self, request, queryset):
         for run in queryset:
-            run_task_async_ondemand.send(str(run.uid))
+            run.cancel()
 
     list_display = ['uid','job','status','user','created_at']
     list_filter = ('status',)
     readonly_fields = ('uid','user','created_at')
     raw_id_fields = ('job',)
     search_fields = ['uid']
-    actions = [start]
+    actions = [start, cancel]
     ordering = ('-created_at',)
 
     def job_link(self, obj):
@@ -153,11 +236,50 @@ class JobAdmin(GeoModelAdmin):
     readonly_fields=('simplified_geom_raw',)
     inlines = [ExportRunsInline]
 
+class FeatureSelectionForm(forms.Form):
+    # unstripped: stripping the first line's indentation would break the YAML.
+    feature_selection = forms.CharField(strip=False, widget=forms.Textarea(attrs={'rows': 30, 'cols': 80}))
+
 class HDXExportRegionAdmin(admin.ModelAdmin):
+
+    def sync_to_hdx(self, request, queryset):
+        from tasks.task_runners import sync_regions_async
+        region_ids = list(queryset.values_list('id', flat=True))
+        sync_regions_async.send(region_ids)
+        self.message_user(request, 'Queued {0} regions for HDX sync.'.format(len(region_ids)))
+
+    def update_feature_selection(self, request, queryset):
+        """
+        Asks for a feature selection YAML, sets it on the selected
+        regions' jobs and queues them for HDX sync.
+        """
+        from hdx_exports.bulk import update_feature_selection
+        from tasks.task_runners import sync_regions_async
+        form = FeatureSelectionForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            try:
+                updated = update_feature_selection(queryset, form.cleaned_data['feature_selection'])
+            except ValidationError as e:
+                form.add_error('feature_selection', e)
+            else:
+                sync_regions_async.send(list(queryset.values_list('id', flat=True)))
+                self.message_user(request, 'Updated {0} regions and queued them for HDX sync.'.format(updated))
+                return None
+        return TemplateResponse(request, 'admin/update_feature_selection.html', {
+            'title': 'Update feature selection',
+            'opts': self.model._meta,
+            'form': form,
+            'regions': queryset,
+            'action_checkbox_name': admin.ACTION_CHECKBOX_NAME,
+        })
+
     raw_id_fields = ("job",)
+    list_select_related = ('job',)
+    actions = [sync_to_hdx, update_feature_selection]
 
 class PartnerExportRegionAdmin(admin.ModelAdmin):
     raw_id_fields = ('job',)
+    list_select_related = ('job',)
 
 class SavedFeatureSelectionAdmin(admin.ModelAdmin):
     raw_id_fields = ("user",)
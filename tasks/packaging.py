@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+def open_zip(destination):
+    return zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED, True,
+                           compresslevel=settings.ZIP_COMPRESSION_LEVEL)
+
+def write_zip(destination,parts,readme=None):
+    """
+    Streams staged parts into the zip at destination, deleting each part
+    as soon as it has been added so that the staged and zipped copies
+    of an export are never both on disk in full.
+    """
+    with open_zip(destination) as z:
+        if readme:
+            z.writestr("README.txt", readme)
+        for part in parts:
+            z.write(part, os.path.basename(part))
+            os.remove(part)
+    return destination
+
+def write_zips(zips):
+    """
+    Writes several (destination, parts, readme) zips at once.
+    zlib releases the GIL while compressing, so these run in parallel
+    on up to settings.ZIP_THREADS threads.
+    """
+    with ThreadPoolExecutor(max_workers=settings.ZIP_THREADS) as executor:
+        futures = [executor.submit(write_zip,*z) for z in zips]
+        return [future.result() for future in futures]
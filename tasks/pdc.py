@@ -1,14 +1,22 @@
 # extracted from http//www.naturalearthdata.com/download/110m/cultural/ne_110m_admin_0_countries.zip
 # under public domain terms
+import json
 import logging
-import optparse
+import math
+import multiprocessing
 import os
-from glob import glob
-from os.path import join, abspath, dirname
-from shutil import rmtree
-from osm_export_tool.mapping import Mapping
-from osm_export_tool.sources import OsmiumTool
-from configparser import ConfigParser
+import sqlite3
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+
+import numpy as np
+import osmium
+import osgeo.ogr as ogr
+import osgeo.osr as osr
+from shapely.wkb import loads
+
+fab = osmium.geom.WKBFactory()
 
 
 logger = logging.getLogger()
@@ -263,36 +271,9 @@ BBOXES = {
 }
 
 
-def process_country(k, v, params, keys):
-    # logger.info(f"Processing country - {k}")
-
-    TEMP = params.get("TEMP")
-    OUTPUT_GPKG = params.get("OUTPUT_GPKG")
-    PBF_EXTRACT = params.get("PBF_EXTRACT")
-    OSM_CONF = params.get("OSM_CONF")
-
-    output_file = f"{join(TEMP, k)}.pbf"
-    gpkg = f"{join(TEMP, k)}.gpkg"
-
-    name, bbox = v
-    bbox = ",".join([str(b) for b in bbox])
-    layer_name = name.lower().replace(" ", "_")
-
-    cmd = f"osmium extract -b {bbox} {PBF_EXTRACT} -o  {output_file} --no-progress"
-    os.system(cmd)
-
-    # Transform into geopackage.
-    cmd = f'ogr2ogr -f GPKG {gpkg} {output_file} -oo CONFIG_FILE="{OSM_CONF}"'
-    os.system(cmd)
-
-    # Get points.
-    cmd = f"ogr2ogr -append {OUTPUT_GPKG} {gpkg} -nln {layer_name} points"
-    os.system(cmd)
-
-    # Get polygon centroids.
-    columns = keys.replace(":", "_")
-    cmd = f'ogr2ogr -append {OUTPUT_GPKG} -sql "select name,type,other_tags,{columns},st_centroid(geom) AS geom from multipolygons" {gpkg} -nln {layer_name}'
-    os.system(cmd)
+def run(cmd):
+    logging.info(" ".join(cmd))
+    subprocess.check_call(cmd)
 
 
 def generate_planet_extraction(params):
@@ -300,74 +281,253 @@ def generate_planet_extraction(params):
     MAPPING = params.get("MAPPING")
     PBF_EXTRACT = params.get("PBF_EXTRACT")
 
-    logging.info("Run planet file extraction")
-
-    source = OsmiumTool("", "", None, "", mapping=MAPPING)
-    statement = " ".join(source.filters(MAPPING))
+    # imported here, as band processes import this module without Django.
+    from tasks.source_cache import filtered_planet
 
-    cmd = f"osmium tags-filter {PLANET_FILE} {statement} -o {PBF_EXTRACT}"
-    logging.info(cmd)
-    os.system(cmd)
+    logging.info("Run planet file extraction")
+    filtered_planet(PLANET_FILE, MAPPING, PBF_EXTRACT)
     logging.info(f"Finished planet file extraction: {PBF_EXTRACT}")
 
 
-def create_osm_conf(params):
-    MAPPING = params.get("MAPPING")
-    OSM_CONF = params.get("OSM_CONF")
-
-    config_path = join(dirname(abspath(__file__)), "osmconf.ini")
-
-    with open(config_path, "r") as f:
-        config = "".join(f.readlines())
-
-    # For points and multipolygons.
-    keys = [m.keys for m in MAPPING.themes]
-    keys = set([item for sublist in keys for item in sublist])
-
-    keys = ",".join([i for i in keys if i not in ("name", "type")])
-    out = config.format(attrs=keys)
-
-    with open(OSM_CONF, "w") as configfile:
-        configfile.write(out)
-
-    return keys
+def band_edges(bands):
+    """
+    Longitudes splitting the world into bands of about equal estimated
+    node counts, from the per-column totals of the node density raster.
+    """
+    from jobs.models import ESTIMATOR
+
+    columns = np.cumsum(np.diff(ESTIMATOR.sat[-1]))
+    edges = [-180.0]
+    for i in range(1, bands):
+        col = int(np.searchsorted(columns, columns[-1] * i / bands))
+        x, _ = ESTIMATOR.transform * (col, 0)
+        lon = round(math.degrees(x / 6378137.0), 6)
+        if edges[-1] < lon < 180:
+            edges.append(lon)
+    edges.append(180.0)
+    return edges
+
+
+def split_extract(params, edges):
+    """
+    Cuts PBF_EXTRACT into one file per band in a single osmium pass.
+    The smart strategy completes the multipolygon and boundary relations
+    that cross a band edge, so they can be assembled in every band.
+    """
+    TEMP = params.get("TEMP")
+    PBF_EXTRACT = params.get("PBF_EXTRACT")
 
+    config = join(TEMP, "bands.json")
+    with open(config, "w") as f:
+        json.dump({
+            "directory": TEMP,
+            "extracts": [
+                {"output": f"band_{i}.osm.pbf", "bbox": [west, -90, east, 90]}
+                for i, (west, east) in enumerate(zip(edges, edges[1:]))
+            ]
+        }, f)
+    run([
+        "osmium", "extract", "-c", config, PBF_EXTRACT,
+        "--strategy", "smart", "-S", "types=multipolygon,boundary",
+        "--overwrite", "--no-progress",
+    ])
+    return [join(TEMP, f"band_{i}.osm.pbf") for i in range(len(edges) - 1)]
+
+
+# Tag handling of the OGR OSM driver with the osmconf.ini this export used.
+CLOSED_WAY_KEYS = {
+    "aeroway", "amenity", "boundary", "building", "craft", "geological", "historic", "landuse",
+    "leisure", "military", "natural", "office", "place", "shop", "sport", "tourism",
+}
+CLOSED_WAY_KEYVALS = {"highway": "platform", "public_transport": "platform"}
+UNSIGNIFICANT = {"created_by", "converted_by", "source", "time", "ele", "attribution"}
+IGNORE = {"created_by", "converted_by", "source", "time", "ele", "note", "fixme", "FIXME"}
+IGNORE_PREFIXES = ("openGeoDB:",)
+
+# features written per transaction.
+BATCH_SIZE = 65536
+
+
+def ignored(key, area):
+    return key in IGNORE or key.startswith(IGNORE_PREFIXES) or (area and key == "area")
+
+
+def closed_way_is_polygon(tags):
+    if tags.get("area") == "no":
+        return False
+    if tags.get("area") == "yes" or CLOSED_WAY_KEYS.intersection(tags):
+        return True
+    return any(tags.get(k) == v for k, v in CLOSED_WAY_KEYVALS.items())
+
+
+def other_tags(tags):
+    """Tags without a column, in the hstore form OGR writes them."""
+    def quote(s):
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    if not tags:
+        return None
+    return ",".join(f"{quote(k)}=>{quote(v)}" for k, v in tags.items())
+
+
+class PointsWriter(osmium.SimpleHandler):
+    """
+    Writes the nodes and the centroids of the areas of a band of the
+    extract to a GeoPackage points layer in one pass, without a spatial
+    index, which is built once all bands are merged. Features are kept by
+    the band their point or centroid falls in, so ways and relations cut
+    into several bands with their complete geometry are only kept once.
+    """
+    def __init__(self, path, keys, west, east, last):
+        super(PointsWriter, self).__init__()
+        self.west, self.east, self.last = west, east, last
+        self.columns = ["name", "type"] + keys
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        self.ds = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+        self.layer = self.ds.CreateLayer("points", srs, ogr.wkbPoint, options=["SPATIAL_INDEX=NO"])
+        # attribute_name_laundering: ':' is not kept in column names.
+        for name in ["osm_id"] + [c.replace(":", "_") for c in self.columns] + ["other_tags"]:
+            self.layer.CreateField(ogr.FieldDefn(name, ogr.OFTString))
+        self.defn = self.layer.GetLayerDefn()
+        self.pending = 0
+        # areas that could not be assembled, logged once per band.
+        self.skipped_areas = 0
+        self.ds.StartTransaction()
+
+    def contains(self, lon):
+        return self.west <= lon and (lon <= self.east if self.last else lon < self.east)
+
+    def write(self, osm_id, tags, area, geom):
+        tags = {k: v for k, v in tags.items() if not ignored(k, area)}
+        feature = ogr.Feature(self.defn)
+        feature.SetGeometry(geom)
+        if osm_id is not None:
+            feature.SetField("osm_id", osm_id)
+        for column in self.columns:
+            if column in tags:
+                feature.SetField(column.replace(":", "_"), tags.pop(column))
+        if tags:
+            feature.SetField("other_tags", other_tags(tags))
+        self.layer.CreateFeature(feature)
+        self.pending += 1
+        if self.pending >= BATCH_SIZE:
+            self.ds.CommitTransaction()
+            self.ds.StartTransaction()
+            self.pending = 0
+
+    def node(self, n):
+        tags = {t.k: t.v for t in n.tags}
+        if not any(k not in UNSIGNIFICANT and not ignored(k, False) for k in tags):
+            return
+        if not self.contains(n.location.lon):
+            return
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(n.location.lon, n.location.lat)
+        self.write(str(n.id), tags, False, point)
+
+    def area(self, a):
+        tags = {t.k: t.v for t in a.tags}
+        if a.from_way() and not closed_way_is_polygon(tags):
+            return
+        try:
+            centroid = loads(fab.create_multipolygon(a), hex=True).centroid
+        except RuntimeError:
+            # invalid or incomplete geometry, which OGR skips too.
+            self.skipped_areas += 1
+            return
+        if centroid.is_empty or not self.contains(centroid.x):
+            return
+        # only areas from ways have an id, as with osm_way_id before.
+        osm_id = str(a.orig_id()) if a.from_way() else None
+        self.write(osm_id, tags, True, ogr.CreateGeometryFromWkb(centroid.wkb))
+
+    def close(self):
+        self.ds.CommitTransaction()
+        self.layer = None
+        self.ds = None
+
+
+def convert_band(pbf, west, east, last, keys):
+    gpkg = pbf.replace(".osm.pbf", ".gpkg")
+    if os.path.exists(gpkg):
+        os.remove(gpkg)
+    writer = PointsWriter(gpkg, keys, west, east, last)
+    writer.apply_file(pbf, locations=True, idx="sparse_file_array")
+    writer.close()
+    if writer.skipped_areas:
+        logging.warning(f"{pbf}: skipped {writer.skipped_areas} invalid or incomplete areas")
+    os.remove(pbf)
+    return gpkg
+
+
+def merge_bands(gpkgs, output):
+    """
+    Appends the points of every band to the first band's GeoPackage,
+    one transaction per band, moves it to output and indexes it.
+    """
+    os.replace(gpkgs[0], output)
+    extent_sql = "SELECT min_x, min_y, max_x, max_y FROM {0}gpkg_contents WHERE table_name = 'points'"
+
+    conn = sqlite3.connect(output, isolation_level=None)
+    columns = ",".join(f'"{row[1]}"' for row in conn.execute("PRAGMA table_info(points)") if row[1] != "fid")
+    extent = list(conn.execute(extent_sql.format("")).fetchone())
+    for gpkg in gpkgs[1:]:
+        conn.execute("ATTACH DATABASE ? AS band", (gpkg,))
+        conn.execute("BEGIN")
+        conn.execute(f"INSERT INTO points ({columns}) SELECT {columns} FROM band.points")
+        conn.execute("COMMIT")
+        band = conn.execute(extent_sql.format("band.")).fetchone()
+        conn.execute("DETACH DATABASE band")
+        os.remove(gpkg)
+        for i, value in enumerate(band):
+            if value is not None:
+                extent[i] = value if extent[i] is None else (min if i < 2 else max)(extent[i], value)
+    conn.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = 'points'", extent)
+    conn.close()
+
+    ds = ogr.Open(output, 1)
+    result = ds.ExecuteSQL("SELECT CreateSpatialIndex('points', 'geom')")
+    if result is not None:
+        ds.ReleaseResultSet(result)
+    ds = None
+
+
+def mapping_keys(mapping):
+    """Tag keys with a column in the points layer, besides name and type."""
+    keys = set(key for theme in mapping.themes for key in theme.keys)
+    return sorted(key for key in keys if key not in ("name", "type"))
 
 def run_pdc_task(params):
     TEMP = join(params.get("STAGE_DIR"), "temp")
     VALID_NAME = params.get("VALID_NAME")
     PBF_EXTRACT = join(TEMP, f"{VALID_NAME}.osm.pbf")
     OUTPUT_GPKG = join(params.get("STAGE_DIR"), f"{VALID_NAME}.gpkg")
-    OSM_CONF = join(TEMP, "osmconf.ini")
 
-    os.makedirs(TEMP)
+    os.makedirs(TEMP, exist_ok=True)
     params.update(
         {
             "TEMP": TEMP,
             "PBF_EXTRACT": PBF_EXTRACT,
             "OUTPUT_GPKG": OUTPUT_GPKG,
-            "OSM_CONF": OSM_CONF,
         }
     )
 
     logging.info("Running planet file extraction")
-    keys = create_osm_conf(params)
     generate_planet_extraction(params)
 
-    # Transform into geopackage.
-    TEMP_GPKG = join(TEMP, f"{VALID_NAME}_temp.gpkg")
-    cmd = f'ogr2ogr -f GPKG {TEMP_GPKG} {PBF_EXTRACT} -oo CONFIG_FILE="{OSM_CONF}"'
-    os.system(cmd)
-
-    # Get points.
-    LAYER_NAME = "points"
-    cmd = f"ogr2ogr -append {OUTPUT_GPKG} {TEMP_GPKG} -nln {LAYER_NAME} points"
-    os.system(cmd)
-
-    # Get polygon centroids.
-    columns = keys.replace(":", "_")
-    cmd = f'ogr2ogr -append {OUTPUT_GPKG} -sql "select name,type,other_tags,{columns},st_centroid(geom) AS geom, osm_way_id AS osm_id from multipolygons" {TEMP_GPKG} -nln {LAYER_NAME}'
-    os.system(cmd)
+    # Convert bands of the extract at the same time, in spawned processes
+    # that share nothing with the worker, such as its database connection.
+    edges = band_edges(params.get("BANDS", 8))
+    bands = split_extract(params, edges)
+    keys = mapping_keys(params.get("MAPPING"))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=params.get("WORKERS", 4), mp_context=context) as executor:
+        futures = [
+            executor.submit(convert_band, pbf, west, east, i == len(bands) - 1, keys)
+            for i, (pbf, west, east) in enumerate(zip(bands, edges, edges[1:]))
+        ]
+        band_gpkgs = [future.result() for future in futures]
+
+    merge_bands(band_gpkgs, OUTPUT_GPKG)
 
     return {"geopackage": OUTPUT_GPKG, "osm_pbf": PBF_EXTRACT}
-
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from datetime import timedelta
+from os.path import join, exists
+
+import dateutil.parser
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.utils import timezone
+
+LOG = logging.getLogger(__name__)
+
+# name of a run's pre-cut planet extract, inside its staging dir.
+PLANET_EXTRACT = 'planet_extract.osm.pbf'
+
+class RegionIndex(object):
+    """
+    The continent and country PBFs cut from the planet by
+    jobs/secondary_pipeline.py, read from the index.json it writes
+    next to them. Reloaded whenever the index is replaced.
+    """
+    def __init__(self,path,max_age):
+        self.path = path
+        self.max_age = max_age
+        self.mtime = None
+        self.regions = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return []
+        with self._lock:
+            if mtime != self.mtime:
+                with open(self.path) as f:
+                    index = json.load(f)
+                cut_at = dateutil.parser.parse(index['timestamp'])
+                if timezone.now() - cut_at > self.max_age:
+                    # the pipeline has stopped cutting: regions lag the planet.
+                    LOG.warn('Ignoring planet regions cut from {0}'.format(index['timestamp']))
+                    self.regions = []
+                else:
+                    self.regions = sorted(index['regions'],key=lambda r: r['size'])
+                self.mtime = mtime
+            return self.regions
+
+    def boundary(self,region):
+        if 'boundary' not in region:
+            if region.get('polygon'):
+                with open(region['polygon']) as f:
+                    region['boundary'] = GEOSGeometry(json.dumps(json.load(f)['geometry']),srid=4326)
+            else:
+                region['boundary'] = Polygon.from_bbox(region['bbox'])
+        return region['boundary']
+
+    def smallest_containing(self,geom):
+        """Path of the smallest region whose boundary contains geom, or None."""
+        try:
+            regions = self.load()
+        except (IOError, ValueError, KeyError) as e:
+            LOG.warn('Could not read planet regions index: {0}'.format(e))
+            return None
+        w, s, e, n = geom.extent
+        for region in regions:
+            rw, rs, re, rn = region['bbox']
+            if not (rw <= w and rs <= s and e <= re and n <= rn):
+                continue
+            if exists(region['path']) and self.boundary(region).contains(geom):
+                return region['path']
+        return None
+
+planet_regions = RegionIndex(
+    settings.PLANET_REGIONS_INDEX or join(os.path.dirname(settings.PLANET_FILE),'regions','index.json'),
+    timedelta(hours=settings.PLANET_REGIONS_MAX_AGE)
+)
+
+def planet_source(stage_dir,geom=None):
+    """
+    The file a planet-backed run should extract from: its pre-cut batch
+    extract if one was made, else the smallest regional PBF containing
+    geom, otherwise the full planet.
+    """
+    precut = join(stage_dir,PLANET_EXTRACT)
+    if exists(precut):
+        return precut
+    if geom is not None:
+        region = planet_regions.smallest_containing(geom)
+        if region:
+            LOG.debug('Extracting from regional file {0}'.format(region))
+            return region
+    return settings.PLANET_FILE
+
+def planet_version(path):
+    """
+    Identifies the data in a planet file: its replication header,
+    plus size and mtime, which change whenever the file is replaced.
+    """
+    st = os.stat(path)
+    fileinfo = json.loads(subprocess.check_output(['osmium','fileinfo','-j',path]).decode())
+    option = fileinfo['header']['option']
+    return '{0}:{1}:{2}:{3}'.format(
+        option.get('osmosis_replication_sequence_number',''),
+        option.get('osmosis_replication_timestamp',''),
+        st.st_size,
+        int(st.st_mtime)
+    )
+
+def planet_timestamp(path):
+    """
+    Replication timestamp of the data in a planet file, as written
+    next to it by jobs/secondary_pipeline.py, else from its header.
+    """
+    try:
+        with open(path + '.state.json') as f:
+            return json.load(f)['timestamp']
+    except (IOError, ValueError, KeyError):
+        pass
+    fileinfo = json.loads(subprocess.check_output(['osmium','fileinfo','-j',path]).decode())
+    return fileinfo['header']['option'].get('osmosis_replication_timestamp')
+
+def chunks(l,n):
+    for i in range(0,len(l),n):
+        yield l[i:i + n]
+
+def extract_regions(runs):
+    """
+    Cut the AOI of every run out of the planet with one osmium multi-extract
+    pass per chunk of settings.PLANET_BATCH_SIZE runs, instead of one full
+    planet read per run.
+    Each extract is moved into its run's staging dir as PLANET_EXTRACT.
+    """
+    batch_dir = join(settings.EXPORT_STAGING_ROOT,'planet_batch_{0}'.format(timezone.now().strftime('%Y%m%d%H%M%S')))
+    os.makedirs(batch_dir)
+    try:
+        for chunk in chunks(list(runs),settings.PLANET_BATCH_SIZE):
+            extracts = []
+            for run in chunk:
+                run_uid = str(run.uid)
+                region_json = join(batch_dir,run_uid + '.geojson')
+                with open(region_json,'w') as f:
+                    f.write(json.dumps({'type':'Feature','geometry':json.loads(run.job.simplified_geom.json)}))
+                extracts.append({
+                    'output':run_uid + '.osm.pbf',
+                    'polygon':{'file_name':region_json,'file_type':'geojson'}
+                })
+
+            config = join(batch_dir,'config.json')
+            with open(config,'w') as f:
+                f.write(json.dumps({'directory':batch_dir,'extracts':extracts}))
+
+            LOG.debug('Extracting {0} regions from {1}'.format(len(extracts),settings.PLANET_FILE))
+            subprocess.check_call(['osmium','extract','-c',config,settings.PLANET_FILE,'--overwrite','--no-progress'])
+
+            for run in chunk:
+                run_uid = str(run.uid)
+                stage_dir = join(settings.EXPORT_STAGING_ROOT,run_uid)
+                if not exists(stage_dir):
+                    os.makedirs(stage_dir)
+                os.rename(join(batch_dir,run_uid + '.osm.pbf'),join(stage_dir,PLANET_EXTRACT))
+    finally:
+        shutil.rmtree(batch_dir,True)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from os.path import join, exists
+
+from django.conf import settings
+from osm_export_tool.sources import Overpass, OsmiumTool
+
+from .planet import PLANET_EXTRACT, planet_version
+
+LOG = logging.getLogger(__name__)
+
+# seconds after which a temporary or lock file in a cache is taken as left
+# behind by a worker that died, rather than a put in progress.
+STALE_TMP_AGE = 6 * 60 * 60
+
+def link_or_copy(source,target):
+    try:
+        os.link(source,target)
+    except OSError:
+        shutil.copyfile(source,target)
+
+class SourceCache(object):
+    """
+    Content-addressed store of source extracts.
+    Entries are hardlinked in and out of run staging dirs, and evicted
+    least recently used first once their total size exceeds max_bytes.
+    """
+    def __init__(self,root,max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self,key):
+        return join(self.root,key + '.osm.pbf')
+
+    def get(self,key,target):
+        path = self.path(key)
+        try:
+            link_or_copy(path,target)
+        except (OSError, IOError):
+            return False
+        # mtime marks the last use, for eviction.
+        os.utime(path,None)
+        LOG.debug('Source cache hit: {0}'.format(key))
+        return True
+
+    def put(self,key,source):
+        if not exists(self.root):
+            os.makedirs(self.root)
+        # link under a temporary name first so readers never see a partial entry.
+        tmp = '{0}.{1}.tmp'.format(self.path(key),os.getpid())
+        link_or_copy(source,tmp)
+        os.rename(tmp,self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = join(self.root,name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(('.tmp','.lock')):
+                # another worker's put or filter in progress, unless left
+                # by one that died or a key that is no longer used.
+                if now - st.st_mtime > STALE_TMP_AGE:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            entries.append((st.st_mtime,st.st_size,path))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def source_key(kind,geom,filters,timestamp):
+    """
+    Cache key for an extract: what kind of source it came from,
+    the clipping geometry (None if not clipped), the tag filters applied
+    (None if unfiltered) and the timestamp of the data it was cut from.
+    """
+    h = hashlib.sha256()
+    h.update(kind.encode())
+    if geom is not None:
+        h.update(bytes(geom.wkb))
+    h.update(json.dumps(filters,sort_keys=True).encode())
+    h.update(str(timestamp).encode())
+    return h.hexdigest()
+
+def overpass_filters(mapping):
+    if mapping is None:
+        return None
+    return [sorted(f) for f in Overpass.filters(mapping)]
+
+def osmium_filters(mapping):
+    if mapping is None:
+        return None
+    return sorted(OsmiumTool.filters(mapping))
+
+def overpass_key(geom,mapping,timestamp):
+    if not timestamp:
+        LOG.warn('Not caching Overpass source, no timestamp')
+        return None
+    return source_key('overpass',geom,overpass_filters(mapping),timestamp)
+
+def planet_key(source_file,geom,mapping):
+    if os.path.basename(source_file) == PLANET_EXTRACT:
+        # pre-cut batch extracts are already specific to one run.
+        return None
+    try:
+        version = planet_version(source_file)
+    except Exception as e:
+        LOG.warn('Not caching planet source, no version: {0}'.format(e))
+        return None
+    kind = 'planet' if source_file == settings.PLANET_FILE else 'planet:' + os.path.basename(source_file)
+    return source_key(kind,geom,osmium_filters(mapping),version)
+
+source_cache = SourceCache(
+    join(settings.EXPORT_STAGING_ROOT,'source_cache'),
+    settings.SOURCE_CACHE_MAX_BYTES
+)
+
+def fetch_source(source,target,key):
+    """
+    Returns source.path(), hardlinking a cached copy of the extract
+    to target instead of fetching it again when one exists for key.
+    """
+    if key is None or settings.SOURCE_CACHE_MAX_BYTES <= 0:
+        return source.path()
+    if source_cache.get(key,target):
+        return target
+    path = source.path()
+    try:
+        source_cache.put(key,path)
+    except (OSError, IOError) as e:
+        LOG.warn('Could not cache source {0}: {1}'.format(key,e))
+    return path
+
+# the planet filtered to the tags of a mapping, for every export
+# with that mapping until the planet is updated.
+derivative_cache = SourceCache(
+    join(settings.EXPORT_STAGING_ROOT,'planet_derivatives'),
+    settings.PLANET_DERIVATIVE_CACHE_MAX_BYTES
+)
+
+def filtered_planet(planet,mapping,target):
+    """
+    planet filtered to the tags of mapping, at target: hardlinked from
+    the derivative cache, or else made with osmium tags-filter and cached.
+    Workers needing the same filtered planet wait on a lock file for the
+    one making it, instead of each filtering the planet.
+    """
+    key = source_key('planet-filtered',None,osmium_filters(mapping),planet_version(planet))
+    # target may be a link to a cache entry, which must not be written through.
+    if exists(target):
+        os.remove(target)
+    if derivative_cache.get(key,target):
+        return target
+
+    os.makedirs(derivative_cache.root,exist_ok=True)
+    with open(join(derivative_cache.root,key + '.lock'),'w') as lock:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        if derivative_cache.get(key,target):
+            return target
+        tmp = '{0}.{1}.tmp'.format(target,os.getpid())
+        try:
+            subprocess.check_call(['osmium','tags-filter',planet] + osmium_filters(mapping) + ['-o',tmp,'--overwrite'])
+            os.rename(tmp,target)
+        finally:
+            if exists(tmp):
+                os.remove(tmp)
+        try:
+            derivative_cache.put(key,target)
+        except (OSError, IOError) as e:
+            LOG.warn('Could not cache filtered planet {0}: {1}'.format(key,e))
+    return target
+
+class FilteredPlanetExtract(object):
+    """
+    Source like OsmiumTool with a mapping, but clipped from the cached
+    filtered planet instead of scanning the full planet each time.
+    """
+    def __init__(self,planet,geom,output_path,mapping,tempdir):
+        self.planet = planet
+        self.geom = geom
+        self.output_path = output_path
+        self.mapping = mapping
+        self.tempdir = tempdir
+
+    def path(self):
+        filtered = filtered_planet(self.planet,self.mapping,join(self.tempdir,'filtered.osm.pbf'))
+        # as OsmiumTool, AOIs this large are not clipped.
+        if self.geom.area < 6e4:
+            OsmiumTool('osmium',filtered,self.geom,self.output_path,tempdir=self.tempdir).fetch()
+            os.remove(filtered)
+        else:
+            os.replace(filtered,self.output_path)
+        return self.output_path
+
+def planet_extract_source(planet,geom,target,mapping,tempdir):
+    if planet == settings.PLANET_FILE and mapping is not None and settings.PLANET_DERIVATIVE_CACHE_MAX_BYTES > 0:
+        return FilteredPlanetExtract(planet,geom,target,mapping,tempdir)
+    return OsmiumTool('osmium',planet,geom,target,tempdir=tempdir,mapping=mapping)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+from collections import namedtuple
+
+import dateutil.parser
+from django.conf import settings
+from django.utils import timezone
+
+from utils.overpass import overpass_cache
+
+from .planet import planet_timestamp
+
+LOG = logging.getLogger(__name__)
+
+SourcePlan = namedtuple('SourcePlan',['source','inputs'])
+
+def overpass_load(status):
+    """
+    Share of our Overpass slots in use, from the text of its /status,
+    or None if it has no rate limit.
+    """
+    rate_limit = re.search(r'Rate limit: (\d+)',status)
+    if not rate_limit or not int(rate_limit.group(1)):
+        return None
+    available = re.search(r'(\d+) slots? available now',status)
+    available = int(available.group(1)) if available else 0
+    return 1 - available / int(rate_limit.group(1))
+
+def age(timestamp):
+    """Seconds since an OSM replication timestamp."""
+    return (timezone.now() - dateutil.parser.parse(timestamp)).total_seconds()
+
+def choose(estimated_nodes,overpass_lag,planet_age,load):
+    """
+    'overpass' or 'planet', and why. Ages are in seconds, None when
+    unknown: a source that can't report its age is treated as down,
+    but a planet older than SOURCE_PLANET_MAX_AGE is never used.
+    """
+    if planet_age is None:
+        return 'overpass', 'no planet'
+    if planet_age > settings.SOURCE_PLANET_MAX_AGE * 60 * 60:
+        return 'overpass', 'planet too old'
+    if overpass_lag is None:
+        return 'planet', 'overpass unavailable'
+    if estimated_nodes and estimated_nodes > settings.SOURCE_PLANET_NODES:
+        return 'planet', 'large'
+    if overpass_lag >= planet_age:
+        return 'planet', 'overpass behind planet'
+    if load is not None and load >= settings.SOURCE_OVERPASS_MAX_LOAD:
+        return 'planet', 'overpass busy'
+    return 'overpass', 'fresher'
+
+def plan_source(job,planet_file,planet_path):
+    """
+    Where a run of job should be exported from. Regions flagged
+    planet_file always use the planet; other runs weigh the job's
+    estimated size, Overpass replication lag and load, and the age of
+    planet_path, the planet file the run would read (None if there is none).
+    """
+    if planet_file:
+        return SourcePlan('planet',{'reason':'region uses the planet'})
+
+    overpass_lag = None
+    load = None
+    planet_age = None
+    try:
+        overpass_lag = age(overpass_cache.get('timestamp'))
+        load = overpass_load(overpass_cache.get('status'))
+    except Exception as e:
+        LOG.warn('Could not read Overpass state: {0}'.format(e))
+    if planet_path:
+        try:
+            timestamp = planet_timestamp(planet_path)
+            planet_age = age(timestamp) if timestamp else None
+        except Exception as e:
+            LOG.warn('Could not read planet timestamp: {0}'.format(e))
+
+    source, reason = choose(job.estimated_nodes,overpass_lag,planet_age,load)
+    inputs = {
+        'reason':reason,
+        'estimated_nodes':job.estimated_nodes,
+        'overpass_lag':overpass_lag,
+        'overpass_load':load,
+        'planet_age':planet_age
+    }
+    LOG.debug('Source for job {0}: {1} ({2})'.format(job.uid,source,reason))
+    return SourcePlan(source,inputs)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import logging
+import resource
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+import osm_export_tool.tabular as tabular
+
+from tasks.models import ExportRunStage
+
+LOG = logging.getLogger(__name__)
+
+# per-thread usage where the platform has it, so concurrent stages
+# (see task_runners.run_parallel) don't count each other's CPU time.
+RUSAGE_THREAD = getattr(resource,'RUSAGE_THREAD',resource.RUSAGE_SELF)
+
+# getrusage counts block IO in 512 byte units.
+BLOCK_SIZE = 512
+
+Usage = namedtuple('Usage',['cpu_time','blocks_read','blocks_written'])
+
+def usage():
+    """
+    CPU time and block IO of the calling thread plus all subprocesses
+    that have been waited for, such as osmium or ogr2ogr.
+    """
+    own = resource.getrusage(RUSAGE_THREAD)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return Usage(
+        own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        own.ru_inblock + children.ru_inblock,
+        own.ru_oublock + children.ru_oublock
+    )
+
+@contextmanager
+def stage(run,name):
+    """
+    Records the time and resources spent in the body as an ExportRunStage
+    of run, whether or not the body succeeds, and whether it did.
+    The body may set element_counts on the yielded stage.
+    """
+    record = ExportRunStage(run=run,name=name)
+    start = time.monotonic()
+    before = usage()
+    try:
+        yield record
+        record.succeeded = True
+    finally:
+        after = usage()
+        record.finished_at = timezone.now()
+        record.wall_time = time.monotonic() - start
+        record.cpu_time = after.cpu_time - before.cpu_time
+        record.bytes_read = (after.blocks_read - before.blocks_read) * BLOCK_SIZE
+        record.bytes_written = (after.blocks_written - before.blocks_written) * BLOCK_SIZE
+        try:
+            record.save()
+        except Exception as e:
+            LOG.warn('Could not save stage {0} of run {1}: {2}'.format(name,run.uid,e))
+
+class CountingHandler(tabular.Handler):
+    """
+    tabular.Handler that also counts the OSM elements it is given.
+    """
+    def __init__(self,*args,**kwargs):
+        super(CountingHandler,self).__init__(*args,**kwargs)
+        self.counts = {'nodes':0,'ways':0,'areas':0}
+
+    def node(self,n):
+        self.counts['nodes'] += 1
+        super(CountingHandler,self).node(n)
+
+    def way(self,w):
+        self.counts['ways'] += 1
+        super(CountingHandler,self).way(w)
+
+    def area(self,a):
+        self.counts['areas'] += 1
+        super(CountingHandler,self).area(a)
@@ -6,8 +6,10 @@ import os
 from os.path import join, exists, basename
 import json
 import shutil
-import zipfile
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import dateutil.parser
 
 import django
 from django.apps import apps
@@ -26,17 +28,19 @@ from django.utils.text import get_valid_filename
 from jobs.models import Job, HDXExportRegion, PartnerExportRegion
 from tasks.models import ExportRun, ExportTask
 from hdx_exports.hdx_export_set import slugify, sync_region
+from hdx_exports.bulk import resync_regions
 
 import osm_export_tool
 import osm_export_tool.tabular as tabular
 import osm_export_tool.nontabular as nontabular
 from osm_export_tool.mapping import Mapping
 from osm_export_tool.geometry import load_geometry
-from osm_export_tool.sources import Overpass, OsmiumTool
 from osm_export_tool.package import create_package, create_posm_bundle
 
 import shapely.geometry
 
+from utils.overpass import fetch_timestamp
+
 from .email import (
     send_completion_notification,
     send_error_notification,
@@ -45,6 +49,13 @@ from .email import (
 )
 
 from .pdc import run_pdc_task
+from .cancellation import CancelWatcher, RunCanceled, current_watcher
+from .planet import PLANET_EXTRACT, extract_regions, planet_source, planet_timestamp
+from .source_cache import fetch_source, overpass_key, planet_extract_source, planet_key
+from .source_planner import plan_source
+from .packaging import write_zips
+from .stages import stage, CountingHandler
+from .tiling import overpass_source
 
 client = Client()
 
@@ -67,6 +78,26 @@ This file is made available under the Open Database License: http://opendatacomm
 
 class ExportTaskRunner(object):
     def run_task(self, job_uid=None, user=None, ondemand=True): # noqa
+        run = self.create_run(job_uid=job_uid, user=user)
+        run_uid = str(run.uid)
+
+        if ondemand:
+            send_ondemand(run)
+        else:
+            run_task_async_scheduled.send(run_uid)
+        return run
+
+    def run_planet_batch(self, job_uids): # noqa
+        """
+        Creates a run for each planet-backed job and processes them together,
+        sharing a single pass over the planet file.
+        """
+        run_uids = [str(self.create_run(job_uid=job_uid).uid) for job_uid in job_uids]
+        if run_uids:
+            run_planet_batch_async_scheduled.send(run_uids)
+        return run_uids
+
+    def create_run(self, job_uid=None, user=None): # noqa
         LOG.debug('Running Job with id: {0}'.format(job_uid))
         job = Job.objects.get(uid=job_uid)
         if not user:
@@ -83,39 +114,156 @@ class ExportTaskRunner(object):
                 name=format_name
             )
             LOG.debug('Saved task: {0}'.format(format_name))
-
-        if ondemand:
-            run_task_async_ondemand.send(run_uid)
-        else:
-            run_task_async_scheduled.send(run_uid)
         return run
 
-@dramatiq.actor(max_retries=0,queue_name='default',time_limit=1000*60*60*6)
+def send_ondemand(run):
+    """
+    Queues an on-demand run by its estimated size, so that small exports
+    are not stuck behind large ones. The default worker pool also takes
+    small runs, preferring them by actor priority. Jobs without a stored
+    estimate go to the default queue.
+    """
+    nodes = run.job.estimated_nodes
+    if nodes is None:
+        actor = run_task_async_ondemand
+    elif nodes < settings.SMALL_EXPORT_NODES:
+        actor = run_task_async_ondemand_small
+    elif nodes >= settings.LARGE_EXPORT_NODES:
+        actor = run_task_async_ondemand_large
+    else:
+        actor = run_task_async_ondemand
+    LOG.debug('Sending run {0} (~{1} nodes) to {2}'.format(run.uid,nodes,actor.queue_name))
+    actor.send(str(run.uid))
+
+@dramatiq.actor(max_retries=0,queue_name='small',priority=0,time_limit=1000*60*60)
+def run_task_async_ondemand_small(run_uid):
+    run_task_remote(run_uid)
+    db.close_old_connections()
+
+@dramatiq.actor(max_retries=0,queue_name='default',priority=10,time_limit=1000*60*60*6)
 def run_task_async_ondemand(run_uid):
     run_task_remote(run_uid)
     db.close_old_connections()
 
+@dramatiq.actor(max_retries=0,queue_name='large',priority=20,time_limit=1000*60*60*12)
+def run_task_async_ondemand_large(run_uid):
+    run_task_remote(run_uid)
+    db.close_old_connections()
+
 @dramatiq.actor(max_retries=0,queue_name='scheduled',time_limit=1000*60*60*6)
 def run_task_async_scheduled(run_uid):
     run_task_remote(run_uid)
     db.close_old_connections()
 
+@dramatiq.actor(max_retries=0,queue_name='scheduled',time_limit=1000*60*60*24)
+def run_planet_batch_async_scheduled(run_uids):
+    """
+    Cuts the AOIs of all runs out of the planet in shared passes, then
+    queues each run on its own, to be exported from its pre-cut extract.
+    """
+    try:
+        extract_regions(ExportRun.objects.filter(uid__in=run_uids).select_related('job'))
+    except Exception as e:
+        # each run falls back to extracting from the full planet.
+        client.captureException(extra={'run_uids': run_uids})
+        LOG.warn('Planet batch extract failed: {0}'.format(e))
+        LOG.warn(traceback.format_exc())
+    db.close_old_connections()
+
+    for run_uid in run_uids:
+        run_task_async_scheduled.send(run_uid)
+
+@dramatiq.actor(max_retries=0,queue_name='hdx',time_limit=1000*60*60)
+def sync_region_async(run_uid,files,public_dir):
+    """
+    Syncs the HDX datasets of a finished run, given its zips
+    as [output_name, parts, extra] lists.
+    """
+    run = ExportRun.objects.get(uid=run_uid)
+    region = HDXExportRegion.objects.get(job_id=run.job_id)
+    try:
+        with stage(run,'hdx_sync'):
+            sync_region(region,[osm_export_tool.File(*f) for f in files],public_dir)
+        send_hdx_completion_notification(run, region)
+    except Exception as e:
+        client.captureException(extra={'run_uid': run_uid})
+        LOG.warn('HDX sync of ExportRun {0} failed: {1}'.format(run_uid, e))
+        LOG.warn(traceback.format_exc())
+        send_hdx_error_notification(run, region)
+    finally:
+        db.close_old_connections()
+
+@dramatiq.actor(max_retries=0,queue_name='hdx',time_limit=1000*60*60*6)
+def sync_regions_async(region_ids):
+    """Syncs the HDX datasets of regions, e.g. after a bulk configuration change."""
+    def progress(done,total,region_id,error):
+        LOG.info('HDX sync {0}/{1}: region {2} {3}'.format(done,total,region_id,error or 'synced'))
+
+    failures = resync_regions(region_ids,settings.HDX_SYNC_CONCURRENCY,progress)
+    if failures:
+        client.captureMessage('HDX sync failed for {0} regions'.format(len(failures)),extra={'failures': failures})
+    db.close_old_connections()
+
+# source extracts in a run's staging dir, kept for a rerun once fetched.
+SOURCE_FILES = ['extract.osm.pbf','overpass.osm.pbf']
+
+def resume_stage_dir(run,stage_dir):
+    """
+    Clears what an earlier attempt at run left in stage_dir, except source
+    extracts that were completely fetched, so that a rerun starts from them.
+    Formats the earlier attempt finished are skipped by run_task.
+    """
+    keep = [PLANET_EXTRACT]
+    if run.stages.filter(name='source',succeeded=True).exists():
+        keep += SOURCE_FILES
+    for name in os.listdir(stage_dir):
+        if name in keep:
+            continue
+        path = join(stage_dir,name)
+        if os.path.isdir(path):
+            shutil.rmtree(path,True)
+        else:
+            os.remove(path)
+
 def run_task_remote(run_uid):
+    stage_dir = join(settings.EXPORT_STAGING_ROOT, run_uid)
     try:
         run = ExportRun.objects.get(uid=run_uid)
+        if run.status == 'CANCELED':
+            LOG.warn('ExportRun {0} was canceled before it started.'.format(run_uid))
+            return
         run.status = 'RUNNING'
         run.started_at = timezone.now()
         run.save()
-        stage_dir = join(settings.EXPORT_STAGING_ROOT, run_uid)
         download_dir = join(settings.EXPORT_DOWNLOAD_ROOT,run_uid)
-        if not exists(stage_dir):
+        if exists(stage_dir):
+            LOG.debug('Resuming ExportRun {0}'.format(run_uid))
+            resume_stage_dir(run,stage_dir)
+        else:
             os.makedirs(stage_dir)
         if not exists(download_dir):
             os.makedirs(download_dir)
-        run_task(run_uid,run,stage_dir,download_dir)
+        watcher = CancelWatcher(run_uid)
+        watcher.start()
+        try:
+            run_task(run_uid,run,stage_dir,download_dir)
+        finally:
+            # RunCanceled can only surface before this returns.
+            watcher.stop()
+        shutil.rmtree(stage_dir)
     except (Job.DoesNotExist,ExportRun.DoesNotExist,ExportTask.DoesNotExist):
         LOG.warn('Job was deleted - exiting.')
+        shutil.rmtree(stage_dir,True)
+    except RunCanceled:
+        LOG.warn('ExportRun {0} canceled.'.format(run_uid))
+        shutil.rmtree(stage_dir,True)
     except Exception as e:
+        if ExportRun.objects.filter(uid=run_uid,status='CANCELED').exists():
+            # a subprocess killed by the cancellation failed first.
+            LOG.warn('ExportRun {0} canceled.'.format(run_uid))
+            shutil.rmtree(stage_dir,True)
+            return
+
         client.captureException(extra={'run_uid': run_uid})
         run.status = 'FAILED'
         run.finished_at = timezone.now()
@@ -125,8 +273,43 @@ def run_task_remote(run_uid):
             send_hdx_error_notification(run, run.job.hdx_export_region_set.first())
         LOG.warn('ExportRun {0} failed: {1}'.format(run_uid, e))
         LOG.warn(traceback.format_exc())
-    finally:
-        shutil.rmtree(stage_dir)
+        # stage_dir is kept so that rerunning the run resumes it;
+        # the cleanup command removes it once it is old enough.
+
+def source_timestamp(planet_path):
+    """
+    Replication timestamp of the data a run will be exported from,
+    or None if the source can't report one.
+    """
+    try:
+        if planet_path:
+            return planet_timestamp(planet_path)
+        return fetch_timestamp()
+    except Exception as e:
+        LOG.warn('Could not read source timestamp: {0}'.format(e))
+        return None
+
+def run_parallel(steps):
+    """
+    Runs independent output steps on a pool of at most
+    settings.EXPORT_WORKER_CONCURRENCY threads.
+    Returns their results in the order given, raising the first failure.
+    """
+    watcher = current_watcher()
+
+    def run_step(step):
+        if watcher:
+            watcher.add_thread()
+        try:
+            return step()
+        finally:
+            if watcher:
+                watcher.remove_thread()
+            db.connection.close()
+
+    with ThreadPoolExecutor(max_workers=settings.EXPORT_WORKER_CONCURRENCY) as executor:
+        futures = [executor.submit(run_step,step) for step in steps]
+        return [future.result() for future in futures]
 
 def run_task(run_uid,run,stage_dir,download_dir):
     LOG.debug('Running ExportRun with id: {0}'.format(run_uid))
@@ -137,6 +320,10 @@ def run_task(run_uid,run,stage_dir,download_dir):
     export_formats = job.export_formats
     mapping = Mapping(job.feature_selection)
 
+    # formats an earlier attempt at this run finished are not redone.
+    tasks = {task.name: task for task in run.tasks.all()}
+    pending = [name for name in export_formats if name not in tasks or tasks[name].status != 'SUCCESS']
+
     def start_task(name):
         task = ExportTask.objects.get(run__uid=run_uid, name=name)
         task.status = 'RUNNING'
@@ -150,6 +337,7 @@ def run_task(run_uid,run,stage_dir,download_dir):
         task.finished_at = timezone.now()
         # assumes each file only has one part (all are zips or PBFs)
         task.filenames = [basename(file.parts[0]) for file in created_files]
+        task.themes = [file.extra.get('theme') if isinstance(file.extra,dict) else None for file in created_files]
         if planet_file is False:
             total_bytes = 0
             for file in created_files:
@@ -169,36 +357,55 @@ def run_task(run_uid,run,stage_dir,download_dir):
         planet_file = export_region.planet_file
         polygon_centroid = export_region.polygon_centroid
 
-        # Run PDC special task.
-        if export_region.group.name == "PDC" and planet_file is True and polygon_centroid is True:
-            params = {
-                "PLANET_FILE": settings.PLANET_FILE,
-                "MAPPING": mapping,
-                "STAGE_DIR": stage_dir,
-                "DOWNLOAD_DIR": download_dir,
-                "VALID_NAME": valid_name
-            }
-
-            if "geopackage" not in export_formats:
-                raise ValueError("geopackage must be the export format")
-
+    # an earlier attempt's choice is kept, so its source can be reused.
+    if not run.source:
+        candidate = planet_source(stage_dir,job.simplified_geom) if settings.PLANET_FILE else None
+        plan = plan_source(job,planet_file,candidate)
+        run.source = plan.source
+        run.source_inputs = plan.inputs
+        run.save(update_fields=['source','source_inputs'])
+    use_planet = run.source == 'planet'
+    planet_path = planet_source(stage_dir,job.simplified_geom) if use_planet else None
+
+    reused_source = any(exists(join(stage_dir,name)) for name in SOURCE_FILES)
+    data_timestamp = source_timestamp(planet_path)
+    if data_timestamp and not reused_source:
+        run.data_timestamp = dateutil.parser.parse(data_timestamp)
+        run.save(update_fields=['data_timestamp'])
+
+    # Run PDC special task.
+    if is_partner_export and export_region.is_pdc_task:
+        params = {
+            "PLANET_FILE": settings.PLANET_FILE,
+            "MAPPING": mapping,
+            "STAGE_DIR": stage_dir,
+            "DOWNLOAD_DIR": download_dir,
+            "VALID_NAME": valid_name,
+            "BANDS": settings.PDC_BANDS,
+            "WORKERS": settings.PDC_WORKERS
+        }
+
+        if "geopackage" not in export_formats:
+            raise ValueError("geopackage must be the export format")
+
+        with stage(run,'pdc'):
             paths = run_pdc_task(params)
 
-            start_task("geopackage")
-            target = join(download_dir, "{}.gpkg".format(valid_name))
-            shutil.move(paths["geopackage"], target)
-            os.chmod(target, 0o644)
+        start_task("geopackage")
+        target = join(download_dir, "{}.gpkg".format(valid_name))
+        shutil.move(paths["geopackage"], target)
+        os.chmod(target, 0o644)
 
-            finish_task("geopackage",[osm_export_tool.File("gpkg",[target],'')], planet_file)
+        finish_task("geopackage",[osm_export_tool.File("gpkg",[target],'')], planet_file)
 
-            send_completion_notification(run)
+        send_completion_notification(run)
 
-            run.status = 'COMPLETED'
-            run.finished_at = timezone.now()
-            run.save()
-            LOG.debug('Finished ExportRun with id: {0}'.format(run_uid))
+        run.status = 'COMPLETED'
+        run.finished_at = timezone.now()
+        run.save()
+        LOG.debug('Finished ExportRun with id: {0}'.format(run_uid))
 
-            return
+        return
 
     if is_hdx_export:
         geopackage = None
@@ -206,203 +413,266 @@ def run_task(run_uid,run,stage_dir,download_dir):
         kml = None
 
         tabular_outputs = []
-        if 'geopackage' in export_formats:
+        if 'geopackage' in pending:
             geopackage = tabular.MultiGeopackage(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(geopackage)
             start_task('geopackage')
 
-        if 'shp' in export_formats:
+        if 'shp' in pending:
             shp = tabular.Shapefile(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(shp)
             start_task('shp')
 
-        if 'kml' in export_formats:
+        if 'kml' in pending:
             kml = tabular.Kml(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(kml)
             start_task('kml')
 
-        if planet_file:
-            h = tabular.Handler(tabular_outputs,mapping,polygon_centroid=polygon_centroid)
-            source = OsmiumTool('osmium',settings.PLANET_FILE,geom,join(stage_dir,'extract.osm.pbf'),tempdir=stage_dir)
+        if use_planet:
+            # a region's own planet extract is exported whole; a run the planner
+            # sent to the planet is clipped to its geometry, as from Overpass.
+            clipping_geom = None if planet_file else geom
+            h = CountingHandler(tabular_outputs,mapping,clipping_geom=clipping_geom,polygon_centroid=polygon_centroid)
+            source_target = join(stage_dir,'extract.osm.pbf')
+            mapping_filter = None if job.unfiltered else mapping
+            source = planet_extract_source(planet_path,geom,source_target,mapping_filter,stage_dir)
+            source_key = planet_key(planet_path,job.simplified_geom,mapping_filter)
+            source_filtered = mapping_filter is not None
         else:
-            h = tabular.Handler(tabular_outputs,mapping,clipping_geom=geom,polygon_centroid=polygon_centroid)
+            h = CountingHandler(tabular_outputs,mapping,clipping_geom=geom,polygon_centroid=polygon_centroid)
             mapping_filter = mapping
             if job.unfiltered:
                 mapping_filter = None
-            source = Overpass(settings.OVERPASS_API_URL,geom,join(stage_dir,'overpass.osm.pbf'),tempdir=stage_dir,use_curl=True,mapping=mapping_filter)
-
-        LOG.debug('Source start for run: {0}'.format(run_uid))
-        source_path = source.path()
-        LOG.debug('Source end for run: {0}'.format(run_uid))
-        h.apply_file(source_path, locations=True, idx='sparse_file_array')
+            source_target = join(stage_dir,'overpass.osm.pbf')
+            source = overpass_source(job.simplified_geom,job.estimated_nodes,source_target,stage_dir,mapping=mapping_filter)
+            source_key = overpass_key(job.simplified_geom,mapping_filter,data_timestamp)
+            source_filtered = mapping_filter is not None
+
+        if exists(source_target):
+            LOG.debug('Reusing source of an earlier attempt for run: {0}'.format(run_uid))
+            source_path = source_target
+        elif pending:
+            LOG.debug('Source start for run: {0}'.format(run_uid))
+            with stage(run,'source'):
+                source_path = fetch_source(source,source_target,source_key)
+            LOG.debug('Source end for run: {0}'.format(run_uid))
+        if tabular_outputs:
+            with stage(run,'osm_data') as osm_data:
+                h.apply_file(source_path, locations=True, idx='sparse_file_array')
+                osm_data.element_counts = h.counts
+            Job.objects.filter(id=job.id).update(observed_elements=dict(h.counts,filtered=source_filtered))
 
         all_zips = []
 
-        def add_metadata(z,theme):
+        def theme_readme(theme):
             columns = []
             for key in theme.keys:
                 columns.append('{0} http://wiki.openstreetmap.org/wiki/Key:{0}'.format(key))
             columns = '\n'.join(columns)
-            readme = ZIP_README.format(criteria=theme.matcher.to_sql(),columns=columns)
-            z.writestr("README.txt", readme)
+            return ZIP_README.format(criteria=theme.matcher.to_sql(),columns=columns)
 
-        if geopackage:
-            geopackage.finalize()
+        def package_geopackage():
+            with stage(run,'finalize_geopackage'):
+                geopackage.finalize()
             zips = []
             for theme in mapping.themes:
                 destination = join(download_dir,valid_name + '_' + slugify(theme.name) + '_gpkg.zip')
                 matching_files = [f for f in geopackage.files if 'theme' in f.extra and f.extra['theme'] == theme.name]
-                with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED, True) as z:
-                    add_metadata(z,theme)
-                    for file in matching_files:
-                        for part in file.parts:
-                            z.write(part, os.path.basename(part))
-                zips.append(osm_export_tool.File('geopackage',[destination],{'theme':theme.name}))
+                parts = [part for file in matching_files for part in file.parts]
+                zips.append((destination,parts,theme_readme(theme)))
+            with stage(run,'zip_geopackage'):
+                write_zips(zips)
+            zips = [osm_export_tool.File('geopackage',[z[0]],{'theme':theme.name}) for z, theme in zip(zips,mapping.themes)]
             finish_task('geopackage',zips)
-            all_zips += zips
+            return zips
 
-        if shp:
-            shp.finalize()
+        def package_themes(output,name):
+            with stage(run,'finalize_' + name):
+                output.finalize()
             zips = []
-            for file in shp.files:
+            for file in output.files:
                 # for HDX geopreview to work
                 # each file (_polygons, _lines) is a separate zip resource
                 # the zipfile must end with only .zip (not .shp.zip)
                 destination = join(download_dir,os.path.basename(file.parts[0]).replace('.','_') + '.zip')
-                with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED, True) as z:
-                    theme = [t for t in mapping.themes if t.name == file.extra['theme']][0]
-                    add_metadata(z,theme)
-                    for part in file.parts:
-                        z.write(part, os.path.basename(part))
-                zips.append(osm_export_tool.File('shp',[destination],{'theme':file.extra['theme']}))
-            finish_task('shp',zips)
-            all_zips += zips
+                theme = [t for t in mapping.themes if t.name == file.extra['theme']][0]
+                zips.append((destination,file.parts,theme_readme(theme)))
+            with stage(run,'zip_' + name):
+                write_zips(zips)
+            zips = [osm_export_tool.File(name,[z[0]],{'theme':file.extra['theme']}) for z, file in zip(zips,output.files)]
+            finish_task(name,zips)
+            return zips
+
+        def package_garmin():
+            start_task('garmin_img')
+            garmin_dir = join(stage_dir,'garmin')
+            if not exists(garmin_dir):
+                os.makedirs(garmin_dir)
+            with stage(run,'generate_garmin_img'):
+                garmin_files = nontabular.garmin(source_path,settings.GARMIN_SPLITTER,settings.GARMIN_MKGMAP,tempdir=garmin_dir)
+            with stage(run,'zip_garmin_img'):
+                zipped = create_package(join(download_dir,valid_name + '_gmapsupp_img.zip'),garmin_files,boundary_geom=geom,output_name='garmin_img')
+            finish_task('garmin_img',[zipped])
+            return [zipped]
 
+        steps = []
+        if geopackage:
+            steps.append(package_geopackage)
+        if shp:
+            steps.append(lambda: package_themes(shp,'shp'))
         if kml:
-            kml.finalize()
-            zips = []
-            for file in kml.files:
-                destination = join(download_dir,os.path.basename(file.parts[0]).replace('.','_') + '.zip')
-                with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED, True) as z:
-                    theme = [t for t in mapping.themes if t.name == file.extra['theme']][0]
-                    add_metadata(z,theme)
-                    for part in file.parts:
-                        z.write(part, os.path.basename(part))
-                zips.append(osm_export_tool.File('kml',[destination],{'theme':file.extra['theme']}))
-            finish_task('kml',zips)
+            steps.append(lambda: package_themes(kml,'kml'))
+        if 'garmin_img' in pending:
+            steps.append(package_garmin)
+
+        for zips in run_parallel(steps):
             all_zips += zips
 
-        if 'garmin_img' in export_formats:
-            start_task('garmin_img')
-            garmin_files = nontabular.garmin(source_path,settings.GARMIN_SPLITTER,settings.GARMIN_MKGMAP,tempdir=stage_dir)
-            zipped = create_package(join(download_dir,valid_name + '_gmapsupp_img.zip'),garmin_files,boundary_geom=geom,output_name='garmin_img')
-            all_zips.append(zipped)
-            finish_task('garmin_img',[zipped])
+        def finished_zips(name):
+            # zips of a format finished by an earlier attempt, with their themes.
+            task = tasks[name]
+            themes = task.themes or [None] * len(task.filenames)
+            return [
+                osm_export_tool.File(name,[join(download_dir,f)],{'theme':theme} if theme else {})
+                for f, theme in zip(task.filenames,themes)
+            ]
+
+        for name in ['geopackage','shp','kml','garmin_img']:
+            if name in export_formats and name not in pending:
+                all_zips += finished_zips(name)
 
         if settings.SYNC_TO_HDX:
-            print("Syncing to HDX")
-            region = HDXExportRegion.objects.get(job_id=run.job_id)
+            # synced by an hdx worker, so that this worker can take the next export.
+            LOG.debug('Queueing HDX sync for run: {0}'.format(run_uid))
             public_dir = settings.HOSTNAME + join(settings.EXPORT_MEDIA_ROOT, run_uid)
-            sync_region(region,all_zips,public_dir)
-        send_hdx_completion_notification(run, run.job.hdx_export_region_set.first())
+            sync_region_async.send(str(run_uid),[[f.output_name,f.parts,f.extra] for f in all_zips],public_dir)
+        else:
+            send_hdx_completion_notification(run, run.job.hdx_export_region_set.first())
     else:
+        if 'bundle' in pending:
+            # the bundle is built from the staged files of every format.
+            pending = list(export_formats)
+
         geopackage = None
         shp = None
         kml = None
 
         tabular_outputs = []
-        if 'geopackage' in export_formats:
+        if 'geopackage' in pending:
             geopackage = tabular.Geopackage(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(geopackage)
             start_task('geopackage')
 
-        if 'shp' in export_formats:
+        if 'shp' in pending:
             shp = tabular.Shapefile(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(shp)
             start_task('shp')
 
-        if 'kml' in export_formats:
+        if 'kml' in pending:
             kml = tabular.Kml(join(stage_dir,valid_name),mapping)
             tabular_outputs.append(kml)
             start_task('kml')
 
-        if planet_file:
-            h = tabular.Handler(tabular_outputs,mapping,polygon_centroid=polygon_centroid)
-            source = OsmiumTool('osmium',settings.PLANET_FILE,geom,join(stage_dir,'extract.osm.pbf'),tempdir=stage_dir, mapping=mapping)
+        if use_planet:
+            # a region's own planet extract is exported whole; a run the planner
+            # sent to the planet is clipped to its geometry, as from Overpass.
+            clipping_geom = None if planet_file else geom
+            h = CountingHandler(tabular_outputs,mapping,clipping_geom=clipping_geom,polygon_centroid=polygon_centroid)
+            source_target = join(stage_dir,'extract.osm.pbf')
+            mapping_filter = None if job.unfiltered else mapping
+            source = planet_extract_source(planet_path,geom,source_target,mapping_filter,stage_dir)
+            source_key = planet_key(planet_path,job.simplified_geom,mapping_filter)
+            source_filtered = mapping_filter is not None
         else:
-            h = tabular.Handler(tabular_outputs,mapping,clipping_geom=geom,polygon_centroid=polygon_centroid)
+            h = CountingHandler(tabular_outputs,mapping,clipping_geom=geom,polygon_centroid=polygon_centroid)
             mapping_filter = mapping
             if job.unfiltered:
                 mapping_filter = None
-            source = Overpass(settings.OVERPASS_API_URL,geom,join(stage_dir,'overpass.osm.pbf'),tempdir=stage_dir,use_curl=True,mapping=mapping_filter)
-
-        LOG.debug('Source start for run: {0}'.format(run_uid))
-        source_path = source.path()
-        LOG.debug('Source end for run: {0}'.format(run_uid))
-
-        h.apply_file(source_path, locations=True, idx='sparse_file_array')
+            source_target = join(stage_dir,'overpass.osm.pbf')
+            source = overpass_source(job.simplified_geom,job.estimated_nodes,source_target,stage_dir,mapping=mapping_filter)
+            source_key = overpass_key(job.simplified_geom,mapping_filter,data_timestamp)
+            source_filtered = mapping_filter is not None
+
+        if exists(source_target):
+            LOG.debug('Reusing source of an earlier attempt for run: {0}'.format(run_uid))
+            source_path = source_target
+        elif pending:
+            LOG.debug('Source start for run: {0}'.format(run_uid))
+            with stage(run,'source'):
+                source_path = fetch_source(source,source_target,source_key)
+            LOG.debug('Source end for run: {0}'.format(run_uid))
+
+        if tabular_outputs:
+            with stage(run,'osm_data') as osm_data:
+                h.apply_file(source_path, locations=True, idx='sparse_file_array')
+                osm_data.element_counts = h.counts
+            Job.objects.filter(id=job.id).update(observed_elements=dict(h.counts,filtered=source_filtered))
 
         bundle_files = []
 
+        def package_tabular(output,name,suffix):
+            with stage(run,'finalize_' + name):
+                output.finalize()
+            with stage(run,'zip_' + name):
+                zipped = create_package(join(download_dir,valid_name + suffix),output.files,boundary_geom=geom)
+            finish_task(name,[zipped])
+            return output.files
+
+        def package_nontabular(name,suffix,generate):
+            start_task(name)
+            with stage(run,'generate_' + name):
+                files = generate()
+            with stage(run,'zip_' + name):
+                zipped = create_package(join(download_dir,valid_name + suffix),files,boundary_geom=geom)
+            finish_task(name,[zipped])
+            return files
+
+        def tempdir(name):
+            # nontabular tools write intermediate files into their tempdir,
+            # so each one gets its own while they run concurrently.
+            d = join(stage_dir,name)
+            if not exists(d):
+                os.makedirs(d)
+            return d
+
+        steps = []
         if geopackage:
-            geopackage.finalize()
-            zipped = create_package(join(download_dir,valid_name + '_gpkg.zip'),geopackage.files,boundary_geom=geom)
-            bundle_files += geopackage.files
-            finish_task('geopackage',[zipped])
-
+            steps.append(lambda: package_tabular(geopackage,'geopackage','_gpkg.zip'))
         if shp:
-            shp.finalize()
-            zipped = create_package(join(download_dir,valid_name + '_shp.zip'),shp.files,boundary_geom=geom)
-            bundle_files += shp.files
-            finish_task('shp',[zipped])
-
+            steps.append(lambda: package_tabular(shp,'shp','_shp.zip'))
         if kml:
-            kml.finalize()
-            zipped = create_package(join(download_dir,valid_name + '_kml.zip'),kml.files,boundary_geom=geom)
-            bundle_files += kml.files
-            finish_task('kml',[zipped])
+            steps.append(lambda: package_tabular(kml,'kml','_kml.zip'))
 
-        if 'garmin_img' in export_formats:
-            start_task('garmin_img')
-            garmin_files = nontabular.garmin(source_path,settings.GARMIN_SPLITTER,settings.GARMIN_MKGMAP,tempdir=stage_dir)
-            bundle_files += garmin_files
-            zipped = create_package(join(download_dir,valid_name + '_gmapsupp_img.zip'),garmin_files,boundary_geom=geom)
-            finish_task('garmin_img',[zipped])
+        if 'garmin_img' in pending:
+            steps.append(lambda: package_nontabular('garmin_img','_gmapsupp_img.zip',
+                lambda: nontabular.garmin(source_path,settings.GARMIN_SPLITTER,settings.GARMIN_MKGMAP,tempdir=tempdir('garmin'))))
+
+        if 'mwm' in pending:
+            steps.append(lambda: package_nontabular('mwm','_mwm.zip',
+                lambda: nontabular.mwm(source_path,tempdir('mwm'),settings.GENERATE_MWM,settings.GENERATOR_TOOL)))
+
+        if 'osmand_obf' in pending:
+            steps.append(lambda: package_nontabular('osmand_obf','_Osmand2_obf.zip',
+                lambda: nontabular.osmand(source_path,settings.OSMAND_MAP_CREATOR_DIR,tempdir=tempdir('osmand'))))
+
+        if 'mbtiles' in pending:
+            steps.append(lambda: package_nontabular('mbtiles','_mbtiles.zip',
+                lambda: nontabular.mbtiles(geom,join(stage_dir,valid_name + '.mbtiles'),job.mbtiles_source,job.mbtiles_minzoom,job.mbtiles_maxzoom)))
+
+        for files in run_parallel(steps):
+            bundle_files += files
 
-        if 'mwm' in export_formats:
-            start_task('mwm')
-            mwm_dir = join(stage_dir,'mwm')
-            if not exists(mwm_dir):
-                os.makedirs(mwm_dir)
-            mwm_files = nontabular.mwm(source_path,mwm_dir,settings.GENERATE_MWM,settings.GENERATOR_TOOL)
-            bundle_files += mwm_files
-            zipped = create_package(join(download_dir,valid_name + '_mwm.zip'),mwm_files,boundary_geom=geom)
-            finish_task('mwm',[zipped])
-
-        if 'osmand_obf' in export_formats:
-            start_task('osmand_obf')
-            osmand_files = nontabular.osmand(source_path,settings.OSMAND_MAP_CREATOR_DIR,tempdir=stage_dir)
-            bundle_files += osmand_files
-            zipped = create_package(join(download_dir,valid_name + '_Osmand2_obf.zip'),osmand_files,boundary_geom=geom)
-            finish_task('osmand_obf',[zipped])
-
-        if 'mbtiles' in export_formats:
-            start_task('mbtiles')
-            mbtiles_files = nontabular.mbtiles(geom,join(stage_dir,valid_name + '.mbtiles'),job.mbtiles_source,job.mbtiles_minzoom,job.mbtiles_maxzoom)
-            bundle_files += mbtiles_files
-            zipped = create_package(join(download_dir,valid_name + '_mbtiles.zip'),mbtiles_files,boundary_geom=geom)
-            finish_task('mbtiles',[zipped])
-
-        if 'osm_pbf' in export_formats:
+        if 'osm_pbf' in pending:
             bundle_files += [osm_export_tool.File('osm_pbf',[source_path],'')]
 
-        if 'bundle' in export_formats:
+        if 'bundle' in pending:
             start_task('bundle')
-            zipped = create_posm_bundle(join(download_dir,valid_name + '-bundle.tar.gz'),bundle_files,job.name,valid_name,job.description,geom)
+            with stage(run,'bundle'):
+                zipped = create_posm_bundle(join(download_dir,valid_name + '-bundle.tar.gz'),bundle_files,job.name,valid_name,job.description,geom)
             finish_task('bundle',[zipped])
 
         # do this last so we can do a mv instead of a copy
-        if 'osm_pbf' in export_formats:
+        if 'osm_pbf' in pending:
             start_task('osm_pbf')
             target = join(download_dir,valid_name + '.osm.pbf')
             shutil.move(source_path,target)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import threading
+
+from django.test import SimpleTestCase
+
+from ..cancellation import CancelWatcher, current_watcher
+
+class TestCancelWatcher(SimpleTestCase):
+    def test_kills_only_the_runs_subprocesses(self):
+        other = {}
+        def start_other():
+            other['process'] = subprocess.Popen(['sleep','60'])
+        thread = threading.Thread(target=start_other)
+        thread.start()
+        thread.join()
+
+        watcher = CancelWatcher('run')
+        own = subprocess.Popen(['sleep','60'])
+        try:
+            watcher.kill_subprocesses()
+            self.assertEqual(own.wait(5),-9)
+            self.assertIsNone(other['process'].poll())
+        finally:
+            other['process'].kill()
+            other['process'].wait()
+            watcher.stop()
+
+    def test_stop_clears_current_watcher(self):
+        watcher = CancelWatcher('run')
+        self.assertIs(current_watcher(),watcher)
+        watcher.stop()
+        self.assertIsNone(current_watcher())
+        self.assertFalse(watcher.active)
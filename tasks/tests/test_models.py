@@ -90,3 +90,20 @@ class TestExportRunAndTask(TestCase):
 
 
 
+
+    def test_stage_recorded_on_failure(self):
+        from ..stages import stage
+        run = ExportRun.objects.create(
+            job=self.job,
+            user=self.user1
+        )
+        with stage(run,'source') as s:
+            s.element_counts = {'nodes':1}
+        with self.assertRaises(ValueError):
+            with stage(run,'osm_data'):
+                raise ValueError()
+        stages = list(run.stages.all())
+        self.assertEqual([s.name for s in stages],['source','osm_data'])
+        self.assertEqual(stages[0].element_counts,{'nodes':1})
+        self.assertIsNotNone(stages[1].wall_time)
+        self.assertIsNotNone(stages[1].finished_at)
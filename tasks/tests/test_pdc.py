@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+from os.path import join
+
+import osgeo.ogr as ogr
+from django.test import SimpleTestCase
+
+from ..pdc import closed_way_is_polygon, convert_band, other_tags, split_extract
+
+# a lake whose outer ring is two ways: one west of 0°, one crossing it.
+# Its centroid is east of 0°.
+STRADDLING_LAKE = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="10" version="1" lat="0.5" lon="-0.1"/>
+  <node id="11" version="1" lat="0.0" lon="-0.2"/>
+  <node id="12" version="1" lat="-0.5" lon="-0.1"/>
+  <node id="13" version="1" lat="-0.5" lon="0.6"/>
+  <node id="14" version="1" lat="0.5" lon="0.6"/>
+  <way id="20" version="1">
+    <nd ref="10"/><nd ref="11"/><nd ref="12"/>
+  </way>
+  <way id="21" version="1">
+    <nd ref="12"/><nd ref="13"/><nd ref="14"/><nd ref="10"/>
+  </way>
+  <relation id="30" version="1">
+    <member type="way" ref="20" role="outer"/>
+    <member type="way" ref="21" role="outer"/>
+    <tag k="type" v="multipolygon"/>
+    <tag k="natural" v="water"/>
+    <tag k="name" v="Lake"/>
+  </relation>
+</osm>
+"""
+
+# tagged nodes and closed ways, read with the rules of the osmconf.ini
+# ogr2ogr used before PointsWriter.
+TAGGED = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" version="1" lat="0.1" lon="0.1">
+    <tag k="name" v="Bakery"/>
+    <tag k="shop" v="bakery"/>
+    <tag k="addr:street" v="Main Street"/>
+    <tag k="opening_hours" v="24/7"/>
+    <tag k="source" v="survey"/>
+    <tag k="fixme" v="check"/>
+    <tag k="openGeoDB:id" v="1"/>
+  </node>
+  <node id="2" version="1" lat="0.2" lon="0.2">
+    <tag k="source" v="survey"/>
+    <tag k="created_by" v="JOSM"/>
+  </node>
+  <node id="3" version="1" lat="0.3" lon="0.3"/>
+  <node id="4" version="1" lat="0.3" lon="0.4"/>
+  <node id="5" version="1" lat="0.4" lon="0.4"/>
+  <node id="6" version="1" lat="0.4" lon="0.3"/>
+  <way id="40" version="1">
+    <nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="6"/><nd ref="3"/>
+    <tag k="building" v="yes"/>
+    <tag k="area" v="yes"/>
+    <tag k="name" v="House"/>
+  </way>
+  <way id="41" version="1">
+    <nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="6"/><nd ref="3"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="42" version="1">
+    <nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="6"/><nd ref="3"/>
+    <tag k="highway" v="platform"/>
+  </way>
+  <way id="43" version="1">
+    <nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="6"/><nd ref="3"/>
+    <tag k="building" v="yes"/>
+    <tag k="area" v="no"/>
+  </way>
+</osm>
+"""
+
+def read_points(gpkg):
+    ds = ogr.Open(gpkg)
+    layer = ds.GetLayerByName('points')
+    rows = [feature.items() for feature in layer]
+    ds = None
+    return rows
+
+def convert(directory,osm,edges,keys):
+    """Points of osm split into bands at edges, as run_pdc_task writes them."""
+    extract = join(directory,'extract.osm')
+    with open(extract,'w') as f:
+        f.write(osm)
+    bands = split_extract({'TEMP':directory,'PBF_EXTRACT':extract},edges)
+    rows = []
+    for i, (pbf, west, east) in enumerate(zip(bands,edges,edges[1:])):
+        rows.extend(read_points(convert_band(pbf,west,east,i == len(bands) - 1,keys)))
+    return rows
+
+class TestPdcBands(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_relation_across_band_edge_is_kept_once(self):
+        rows = convert(self.dir,STRADDLING_LAKE,[-1.0,0.0,1.0],[])
+        self.assertEqual([row['name'] for row in rows],['Lake'])
+
+class TestPointsWriter(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_other_tags(self):
+        self.assertEqual(other_tags({'a':'b','c"d':'e\\f'}),'"a"=>"b","c\\"d"=>"e\\\\f"')
+        self.assertIsNone(other_tags({}))
+
+    def test_closed_way_is_polygon(self):
+        self.assertTrue(closed_way_is_polygon({'building':'yes'}))
+        self.assertTrue(closed_way_is_polygon({'highway':'platform'}))
+        self.assertTrue(closed_way_is_polygon({'highway':'footway','area':'yes'}))
+        self.assertFalse(closed_way_is_polygon({'highway':'footway'}))
+        self.assertFalse(closed_way_is_polygon({'building':'yes','area':'no'}))
+
+    def test_matches_osmconf(self):
+        rows = convert(self.dir,TAGGED,[-1.0,1.0],['addr:street','shop'])
+        rows = {row['osm_id']: row for row in rows}
+        # only significant nodes; closed ways that are areas, with their way id.
+        self.assertEqual(sorted(rows),['1','40','42'])
+        bakery = rows['1']
+        self.assertEqual(bakery['name'],'Bakery')
+        self.assertEqual(bakery['shop'],'bakery')
+        # attribute_name_laundering
+        self.assertEqual(bakery['addr_street'],'Main Street')
+        # ignored keys are dropped, other keys go to other_tags.
+        self.assertEqual(bakery['other_tags'],'"opening_hours"=>"24/7"')
+        # area is ignored on areas only.
+        self.assertEqual(rows['40']['name'],'House')
+        self.assertEqual(rows['40']['other_tags'],'"building"=>"yes"')
+        self.assertEqual(rows['42']['other_tags'],'"highway"=>"platform"')
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from os.path import join
+
+from django.contrib.gis.geos import Polygon
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from ..planet import RegionIndex
+
+class TestRegionIndex(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = RegionIndex(join(self.dir,'index.json'),timedelta(hours=48))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_index(self,regions,timestamp=None):
+        for region in regions:
+            region['path'] = join(self.dir,region['name'] + '.osm.pbf')
+            open(region['path'],'w').close()
+        timestamp = timestamp or timezone.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+        with open(self.index.path,'w') as f:
+            json.dump({'sequence':1,'timestamp':timestamp,'regions':regions},f)
+
+    def test_smallest_containing(self):
+        self.write_index([
+            {'name':'africa','level':'continent','bbox':[-26,-47,64,38],'size':100},
+            {'name':'sl','level':'country','bbox':[-13.5,6.8,-10.2,10.1],'size':10},
+        ])
+        freetown = Polygon.from_bbox((-13.3,8.4,-13.1,8.5))
+        self.assertEqual(self.index.smallest_containing(freetown),join(self.dir,'sl.osm.pbf'))
+        accra = Polygon.from_bbox((-0.3,5.5,-0.1,5.7))
+        self.assertEqual(self.index.smallest_containing(accra),join(self.dir,'africa.osm.pbf'))
+        self.assertIsNone(self.index.smallest_containing(Polygon.from_bbox((100,0,101,1))))
+
+    def test_stale_index_is_ignored(self):
+        self.write_index(
+            [{'name':'africa','level':'continent','bbox':[-26,-47,64,38],'size':100}],
+            timestamp='2000-01-01T00:00:00Z'
+        )
+        self.assertIsNone(self.index.smallest_containing(Polygon.from_bbox((-0.3,5.5,-0.1,5.7))))
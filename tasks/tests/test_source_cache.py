@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+from os.path import join, exists
+
+from django.contrib.gis.geos import Polygon
+from django.test import SimpleTestCase
+
+from ..source_cache import SourceCache, source_key
+
+class TestSourceCache(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = SourceCache(join(self.dir,'cache'),10)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self,name,size):
+        path = join(self.dir,name)
+        with open(path,'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_put_and_get(self):
+        self.cache.put('a',self.write('a.osm.pbf',4))
+        target = join(self.dir,'target.osm.pbf')
+        self.assertTrue(self.cache.get('a',target))
+        self.assertEqual(os.path.getsize(target),4)
+        self.assertFalse(self.cache.get('missing',join(self.dir,'other.osm.pbf')))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a',self.write('a.osm.pbf',4))
+        os.utime(self.cache.path('a'),(time.time() - 20,time.time() - 20))
+        self.cache.put('b',self.write('b.osm.pbf',4))
+        os.utime(self.cache.path('b'),(time.time() - 10,time.time() - 10))
+        self.cache.get('a',join(self.dir,'target.osm.pbf'))
+        self.cache.put('c',self.write('c.osm.pbf',4))
+        self.assertTrue(exists(self.cache.path('a')))
+        self.assertFalse(exists(self.cache.path('b')))
+        self.assertTrue(exists(self.cache.path('c')))
+
+    def test_evict_skips_puts_in_progress(self):
+        os.makedirs(self.cache.root)
+        in_progress = self.cache.path('x') + '.123.tmp'
+        stale = self.cache.path('y') + '.456.tmp'
+        for path in (in_progress,stale):
+            with open(path,'wb') as f:
+                f.write(b'x' * 20)
+        os.utime(stale,(time.time() - 7 * 60 * 60,time.time() - 7 * 60 * 60))
+        self.cache.put('a',self.write('a.osm.pbf',4))
+        self.assertTrue(exists(in_progress))
+        self.assertFalse(exists(stale))
+        self.assertTrue(exists(self.cache.path('a')))
+
+    def test_unclipped_key(self):
+        geom = Polygon.from_bbox((0,0,1,1))
+        filters = ['n/amenity','w/building']
+        self.assertEqual(source_key('planet-filtered',None,filters,'1'),source_key('planet-filtered',None,filters,'1'))
+        self.assertNotEqual(source_key('planet-filtered',None,filters,'1'),source_key('planet-filtered',None,filters,'2'))
+        self.assertNotEqual(source_key('planet-filtered',None,filters,'1'),source_key('planet-filtered',geom,filters,'1'))
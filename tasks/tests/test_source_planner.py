@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from django.test import SimpleTestCase, override_settings
+
+from jobs.models import MAX_NODES
+
+from ..source_planner import choose, overpass_load
+
+STATUS = """Connected as: 1234
+Current time: 2026-10-17T12:00:00Z
+Rate limit: 4
+1 slots available now.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+@override_settings(SOURCE_PLANET_MAX_AGE=48,SOURCE_OVERPASS_MAX_LOAD=1.0)
+class TestSourcePlanner(SimpleTestCase):
+    def test_overpass_load(self):
+        self.assertEqual(overpass_load(STATUS),0.75)
+        self.assertEqual(overpass_load(STATUS.replace('1 slots available now.','Slot available after: 2026-10-17T12:00:05Z, in 5 seconds.')),1)
+        self.assertIsNone(overpass_load(STATUS.replace('Rate limit: 4','Rate limit: 0')))
+
+    def test_small_fresh_job_uses_overpass(self):
+        self.assertEqual(choose(100,60,3600,0.5)[0],'overpass')
+
+    def test_large_job_uses_planet(self):
+        # the largest job the API accepts is large enough for the planet.
+        self.assertEqual(choose(MAX_NODES,60,3600,0.5),('planet','large'))
+
+    def test_lagging_or_busy_overpass_uses_planet(self):
+        self.assertEqual(choose(100,7200,3600,0.5)[0],'planet')
+        self.assertEqual(choose(100,60,3600,1.0)[0],'planet')
+
+    def test_old_or_missing_planet_uses_overpass(self):
+        self.assertEqual(choose(MAX_NODES,60,72 * 3600,0.5)[0],'overpass')
+        self.assertEqual(choose(MAX_NODES,60,None,0.5)[0],'overpass')
+
+    def test_unknown_overpass_state_uses_planet_only_if_fresh(self):
+        self.assertEqual(choose(100,None,3600,None)[0],'planet')
+        self.assertEqual(choose(100,None,72 * 3600,None)[0],'overpass')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import shutil
+import subprocess
+import tempfile
+import threading
+from os.path import join
+from unittest import mock
+
+import osmium
+from django.contrib.gis.geos import GeometryCollection, GEOSGeometry, LineString, MultiPolygon, Point, Polygon
+from django.test import SimpleTestCase
+
+from jobs.models import estimate_nodes
+
+from ..cancellation import CancelWatcher
+from ..tiling import TiledOverpass, areal_parts, plan_tiles
+
+# what Overpass returns for two tiles split at 0.5°: both return the
+# way crossing the seam, with its nodes.
+TILE_OSM = ["""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" version="1" lat="0.1" lon="0.1"><tag k="amenity" v="school"/></node>
+  <node id="2" version="1" lat="0.2" lon="0.4"/>
+  <node id="3" version="1" lat="0.2" lon="0.6"/>
+  <way id="10" version="1"><nd ref="2"/><nd ref="3"/><tag k="highway" v="road"/></way>
+</osm>
+""","""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="2" version="1" lat="0.2" lon="0.4"/>
+  <node id="3" version="1" lat="0.2" lon="0.6"/>
+  <node id="4" version="1" lat="0.1" lon="0.9"><tag k="amenity" v="clinic"/></node>
+  <way id="10" version="1"><nd ref="2"/><nd ref="3"/><tag k="highway" v="road"/></way>
+</osm>
+"""]
+
+class FakeOverpass(object):
+    """Overpass stand-in answering each tile with the next of TILE_OSM."""
+    calls = []
+
+    def __init__(self,hostname,geom,path,tempdir=None,use_curl=False,mapping=None):
+        self.geom = geom
+        self._path = path.replace('.osm.pbf','.osm')
+        self.index = len(FakeOverpass.calls)
+        FakeOverpass.calls.append(geom)
+
+    def path(self):
+        with open(self._path,'w') as f:
+            f.write(TILE_OSM[self.index])
+        return self._path
+
+class HangingOverpass(FakeOverpass):
+    """Overpass stand-in whose query runs until it is killed."""
+    started = threading.Event()
+    process = None
+
+    def path(self):
+        HangingOverpass.process = subprocess.Popen(['sleep','60'])
+        HangingOverpass.started.set()
+        if HangingOverpass.process.wait():
+            raise subprocess.CalledProcessError(HangingOverpass.process.returncode,'sleep')
+        return super(HangingOverpass,self).path()
+
+class Counter(osmium.SimpleHandler):
+    def __init__(self):
+        super(Counter,self).__init__()
+        self.ids = {'n':[],'w':[]}
+
+    def node(self,n):
+        self.ids['n'].append(n.id)
+
+    def way(self,w):
+        self.ids['w'].append(w.id)
+
+class TestTiling(SimpleTestCase):
+    def setUp(self):
+        self.aoi = GEOSGeometry(Polygon.from_bbox((-0.5,51.2,0.3,51.7)),srid=4326)
+
+    def test_small_aoi_is_one_tile(self):
+        tiles = plan_tiles(self.aoi,estimate_nodes(self.aoi.clone()) + 1,16)
+        self.assertEqual(len(tiles),1)
+
+    def test_tiles_cover_aoi(self):
+        tiles = plan_tiles(self.aoi,1,4)
+        self.assertEqual(len(tiles),4)
+        union = tiles[0]
+        for tile in tiles[1:]:
+            union = union.union(tile)
+        self.assertAlmostEqual(union.area,self.aoi.area,places=6)
+        self.assertAlmostEqual(sum(t.area for t in tiles),self.aoi.area,places=6)
+
+    def test_areal_parts(self):
+        tile = GeometryCollection(
+            Polygon.from_bbox((0,0,1,1)),
+            LineString((1,0),(1,1)),
+            Point(2,2),
+            MultiPolygon(Polygon.from_bbox((3,3,4,4)),Polygon.from_bbox((5,5,6,6))),
+            srid=4326
+        )
+        parts = areal_parts(tile)
+        self.assertEqual([p.geom_type for p in parts],['Polygon'] * 3)
+        self.assertEqual([p.srid for p in parts],[4326] * 3)
+        self.assertEqual(areal_parts(LineString((0,0),(1,1),srid=4326)),[])
+        self.assertEqual(areal_parts(Polygon(srid=4326)),[])
+
+    def test_multipolygon_aoi_tiles_are_polygons(self):
+        aoi = GEOSGeometry(MultiPolygon(
+            Polygon.from_bbox((-0.5,51.2,-0.1,51.7)),
+            Polygon.from_bbox((0.0,51.2,0.3,51.7))
+        ),srid=4326)
+        for tile in plan_tiles(aoi,1,4):
+            self.assertEqual(tile.geom_type,'Polygon')
+            self.assertFalse(tile.empty)
+
+class TestTiledOverpass(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        FakeOverpass.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @mock.patch('tasks.tiling.Overpass',FakeOverpass)
+    def test_tiles_are_merged_without_duplicates(self):
+        tiles = [
+            GEOSGeometry(Polygon.from_bbox((0,0,0.5,1)),srid=4326),
+            GEOSGeometry(Polygon.from_bbox((0.5,0,1,1)),srid=4326)
+        ]
+        target = join(self.dir,'overpass.osm.pbf')
+        with self.settings(OVERPASS_TILE_CONCURRENCY=1):
+            path = TiledOverpass('http://overpass',tiles,target,self.dir).path()
+        self.assertEqual(path,target)
+        self.assertEqual(len(FakeOverpass.calls),2)
+
+        counter = Counter()
+        counter.apply_file(path)
+        self.assertEqual(counter.ids,{'n':[1,2,3,4],'w':[10]})
+
+    @mock.patch('tasks.tiling.Overpass',HangingOverpass)
+    def test_cancel_kills_tile_queries(self):
+        tiles = [
+            GEOSGeometry(Polygon.from_bbox((0,0,0.5,1)),srid=4326),
+            GEOSGeometry(Polygon.from_bbox((0.5,0,1,1)),srid=4326)
+        ]
+        HangingOverpass.started.clear()
+        watcher = CancelWatcher('run')
+        def cancel():
+            HangingOverpass.started.wait(10)
+            watcher.canceled = True
+            watcher.kill_subprocesses()
+        canceler = threading.Thread(target=cancel)
+        canceler.start()
+        try:
+            with self.settings(OVERPASS_TILE_CONCURRENCY=1):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    TiledOverpass('http://overpass',tiles,join(self.dir,'overpass.osm.pbf'),self.dir).path()
+        finally:
+            canceler.join()
+            watcher.stop()
+        self.assertEqual(HangingOverpass.process.returncode,-9)
+        # the second tile was still queued and never queried.
+        self.assertEqual(len(FakeOverpass.calls),1)
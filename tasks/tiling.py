@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+from osm_export_tool.geometry import load_geometry
+from osm_export_tool.sources import Overpass
+
+from jobs.models import ESTIMATOR
+
+from .cancellation import RunCanceled, current_watcher
+
+LOG = logging.getLogger(__name__)
+
+# bisection steps when looking for the split that halves a tile's nodes.
+SPLIT_STEPS = 12
+
+def clip(aoi,bounds):
+    box = Polygon.from_bbox(bounds)
+    box.srid = aoi.srid
+    return aoi.intersection(box)
+
+def tile_nodes(aoi,bounds):
+    """Estimated nodes of the part of aoi, in EPSG:3857, within bounds."""
+    part = clip(aoi,bounds)
+    if part.empty:
+        return 0
+    return ESTIMATOR.nodes(part)
+
+def split(bounds):
+    """
+    Splits bounds across its longer side where the node density raster
+    puts half of its nodes on either side.
+    """
+    minx, miny, maxx, maxy = bounds
+    axis = 0 if maxx - minx >= maxy - miny else 1
+    lo, hi = bounds[axis], bounds[axis + 2]
+    total = ESTIMATOR.bbox_sum(bounds)
+
+    def first(at):
+        return (minx,miny,at,maxy) if axis == 0 else (minx,miny,maxx,at)
+
+    def second(at):
+        return (at,miny,maxx,maxy) if axis == 0 else (minx,at,maxx,maxy)
+
+    a, b = lo, hi
+    if total > 0:
+        for _ in range(SPLIT_STEPS):
+            mid = (a + b) / 2
+            if ESTIMATOR.bbox_sum(first(mid)) < total / 2:
+                a = mid
+            else:
+                b = mid
+    at = (a + b) / 2
+    # keep degenerate tiles out when all nodes sit at one edge.
+    at = min(max(at,lo + (hi - lo) * 0.1),hi - (hi - lo) * 0.1)
+    return first(at), second(at)
+
+def areal_parts(geom):
+    """
+    The polygons of geom, an intersection that may be a MultiPolygon or a
+    GeometryCollection with stray lines and points along tile edges.
+    """
+    if geom.empty:
+        return []
+    if geom.geom_type == 'Polygon':
+        return [geom]
+    if geom.geom_type in ('MultiPolygon','GeometryCollection'):
+        parts = []
+        for part in geom:
+            part.srid = geom.srid
+            parts += areal_parts(part)
+        return parts
+    return []
+
+def plan_tiles(aoi,max_nodes,max_tiles):
+    """
+    Partitions aoi, a GEOSGeometry in EPSG:4326, into at most max_tiles
+    parts of roughly equal estimated node counts, splitting the busiest
+    tile until every tile is estimated below max_nodes.
+    Returns the parts in EPSG:4326, as single polygons: a tile cutting a
+    multipolygon AOI is queried as one tile per polygon.
+    """
+    aoi = aoi.transform(3857,clone=True)
+    tiles = [(tile_nodes(aoi,aoi.extent),aoi.extent)]
+    while len(tiles) < max_tiles:
+        tiles.sort(key=lambda t: t[0])
+        nodes, bounds = tiles[-1]
+        if nodes <= max_nodes:
+            break
+        tiles.pop()
+        for half in split(bounds):
+            tiles.append((tile_nodes(aoi,half),half))
+
+    parts = []
+    for nodes, bounds in tiles:
+        for part in areal_parts(clip(aoi,bounds)):
+            part.transform(4326)
+            parts.append(part)
+    return parts
+
+class TiledOverpass(object):
+    """
+    Source that fetches an AOI from Overpass as several tiles at once,
+    each as its own query, and merges them into a single .osm.pbf.
+    osmium merge keeps one copy of each object that several tiles
+    returned, such as ways crossing a tile boundary.
+    """
+    def __init__(self,hostname,tiles,path,tempdir,mapping=None,use_existing=True):
+        self.hostname = hostname
+        self.tiles = tiles
+        self._path = path
+        self.tempdir = tempdir
+        self.mapping = mapping
+        self.use_existing = use_existing
+
+    def fetch_tile(self,i,tile):
+        tile_dir = join(self.tempdir,'tile_{0}'.format(i))
+        if not os.path.exists(tile_dir):
+            os.makedirs(tile_dir)
+        target = join(tile_dir,'overpass.osm.pbf')
+        source = Overpass(self.hostname,load_geometry(tile.json),target,tempdir=tile_dir,use_curl=True,mapping=self.mapping)
+        return source.path()
+
+    def fetch(self):
+        LOG.debug('Fetching {0} Overpass tiles into {1}'.format(len(self.tiles),self._path))
+        watcher = current_watcher()
+        def fetch_tile(i,tile):
+            # tiles are fetched on pool threads, whose queries the run's
+            # watcher must be able to kill; queued tiles of a canceled run don't start.
+            if watcher:
+                if watcher.canceled:
+                    raise RunCanceled()
+                watcher.add_thread()
+            try:
+                return self.fetch_tile(i,tile)
+            finally:
+                if watcher:
+                    watcher.remove_thread()
+
+        with ThreadPoolExecutor(max_workers=settings.OVERPASS_TILE_CONCURRENCY) as executor:
+            futures = [executor.submit(fetch_tile,i,tile) for i, tile in enumerate(self.tiles)]
+            paths = [future.result() for future in futures]
+        subprocess.check_call(['osmium','merge'] + paths + ['-o',self._path,'--overwrite'])
+        for i in range(len(self.tiles)):
+            shutil.rmtree(join(self.tempdir,'tile_{0}'.format(i)),True)
+
+    def path(self):
+        if os.path.isfile(self._path) and self.use_existing:
+            return self._path
+        self.fetch()
+        return self._path
+
+def overpass_source(aoi,estimated_nodes,path,tempdir,mapping=None):
+    """
+    Overpass source for aoi: a single query, or TiledOverpass
+    when the AOI is estimated above settings.OVERPASS_TILE_NODES.
+    """
+    if estimated_nodes and estimated_nodes > settings.OVERPASS_TILE_NODES:
+        tiles = plan_tiles(aoi,settings.OVERPASS_TILE_NODES,settings.OVERPASS_MAX_TILES)
+        if len(tiles) > 1:
+            return TiledOverpass(settings.OVERPASS_API_URL,tiles,path,tempdir,mapping=mapping)
+    return Overpass(settings.OVERPASS_API_URL,load_geometry(aoi.json),path,tempdir=tempdir,use_curl=True,mapping=mapping)
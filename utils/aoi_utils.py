@@ -1,3 +1,7 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 from django.contrib.gis.geos import GEOSGeometry, Polygon
 from django.contrib.gis.geos.prototypes.io import wkt_w
 
@@ -10,20 +14,67 @@ from django.contrib.gis.geos.prototypes.io import wkt_w
 # * geometries with an excessive amount of points can't
 #   be buffered efficiently, they must be simplified first.
 #   so first simplify them to 0.01 degrees.
+# * simplify with the smallest tolerance that gets under 500 points,
+#   found by binary search, so as little detail as possible is lost.
+
+MAX_COORDS = 500
+
+# bisection steps after bracketing the tolerance; the result is within
+# 1/2^SEARCH_STEPS of the smallest tolerance that fits.
+SEARCH_STEPS = 8
+
+CACHE_SIZE = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
 
 def force2d(geom):
     # force geom to be 2d: https://groups.google.com/forum/#!topic/django-users/7c1NZ76UwRU
     wkt = wkt_w(dim=2).write(geom).decode()
     return GEOSGeometry(wkt)
 
-def simplify_geom(geom,force_buffer=False):
+def _simplify_geom(geom,force_buffer):
     if geom.num_coords > 10000:
         geom = geom.simplify(0.01)
-    if geom.num_coords > 500 or force_buffer:
+    if geom.num_coords > MAX_COORDS or force_buffer:
         geom = geom.buffer(0.02)
-    param = 0.01
-    while geom.num_coords > 500:
-        geom = geom.simplify(param, preserve_topology=True)
-        param = param * 2
-    return geom
+    if geom.num_coords <= MAX_COORDS:
+        return geom
+
+    # bracket: double the tolerance until the result fits.
+    low = 0
+    high = 0.01
+    result = geom.simplify(high, preserve_topology=True)
+    while result.num_coords > MAX_COORDS:
+        low = high
+        high = high * 2
+        result = geom.simplify(high, preserve_topology=True)
+
+    # then narrow it down, keeping the best result that fits.
+    for _ in range(SEARCH_STEPS):
+        mid = (low + high) / 2
+        candidate = geom.simplify(mid, preserve_topology=True)
+        if candidate.num_coords > MAX_COORDS:
+            low = mid
+        else:
+            high = mid
+            result = candidate
+    return result
+
+def simplify_geom(geom,force_buffer=False):
+    """
+    geom simplified to at most MAX_COORDS coordinates, buffered so that it
+    covers the original. Results are cached by geometry and force_buffer.
+    """
+    key = (hashlib.sha1(bytes(geom.ewkb)).hexdigest(),force_buffer)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key].clone()
+
+    result = _simplify_geom(geom,force_buffer)
 
+    with _cache_lock:
+        _cache[key] = result.clone()
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+import requests
+from cachetools import TTLCache
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOG = logging.getLogger(__name__)
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling a service that has been failing."""
+    pass
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive failures, failing calls fast
+    for reset_timeout seconds before letting one through to try again.
+    """
+    def __init__(self,failure_threshold,reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half open: the next call decides.
+                self.opened_at = None
+                self.failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class HttpClient(object):
+    """
+    GETs through one pooled requests.Session per service, with connect
+    and read timeouts, retries of idempotent requests on connection
+    errors and 502/503/504, and a circuit breaker so an unresponsive
+    service can't tie up web workers.
+    """
+    def __init__(self,name,timeout=None,retries=2,failure_threshold=5,reset_timeout=30,pool_size=10):
+        self.name = name
+        self.timeout = timeout or (settings.HTTP_CONNECT_TIMEOUT,settings.HTTP_READ_TIMEOUT)
+        self.breaker = CircuitBreaker(failure_threshold,reset_timeout)
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(502,503,504),
+            method_whitelist=frozenset(['GET','HEAD']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size,max_retries=retry)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+
+    def get(self,url,params=None,**kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError('{0} is unavailable'.format(self.name))
+        kwargs.setdefault('timeout',self.timeout)
+        try:
+            response = self.session.get(url,params=params,**kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.failed()
+            raise
+        if response.status_code >= 500:
+            self.breaker.failed()
+        else:
+            self.breaker.succeeded()
+        return response
+
+def normalize_params(params):
+    """Hashable form of query params, ignoring case and extra whitespace."""
+    return tuple(sorted(
+        (k,' '.join(str(v).split()).lower()) for k, v in params.items() if v is not None
+    ))
+
+class CachedJson(object):
+    """
+    JSON responses of a client kept in a TTL cache by url and
+    normalized params. Only successful responses are cached.
+    """
+    def __init__(self,client,ttl,maxsize=1024):
+        self.client = client
+        self.cache = TTLCache(maxsize=maxsize,ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self,url,params):
+        key = (url,normalize_params(params))
+        with self._lock:
+            if key in self.cache:
+                return self.cache[key]
+        response = self.client.get(url,params=params)
+        response.raise_for_status()
+        data = response.json()
+        with self._lock:
+            self.cache[key] = data
+        return data
+
+overpass = HttpClient('Overpass')
+nominatim = HttpClient('Nominatim')
+geonames = HttpClient('GeoNames')
+
+# country boundaries hardly change; place searches are repeated as users type.
+nominatim_json = CachedJson(nominatim,ttl=24 * 60 * 60,maxsize=512)
+geonames_json = CachedJson(geonames,ttl=60 * 60)
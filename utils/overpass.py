@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .http_client import overpass
+
+LOG = logging.getLogger(__name__)
+
+def fetch_timestamp():
+    r = overpass.get('{}timestamp'.format(settings.OVERPASS_API_URL))
+    r.raise_for_status()
+    timestamp = r.content.decode().strip()
+    if not timestamp:
+        # Overpass sometimes answers 200 with no content.
+        raise ValueError('Empty Overpass timestamp')
+    return timestamp
+
+def fetch_status():
+    r = overpass.get('{}status'.format(settings.OVERPASS_API_URL))
+    r.raise_for_status()
+    status = r.content.decode()
+    if not status.strip():
+        raise ValueError('Empty Overpass status')
+    return status
+
+class SharedCache(object):
+    """
+    Values shared by every web worker through Redis.
+
+    Reads are a single GET. Once a value is older than refresh_interval,
+    the worker that wins a short Redis lock refreshes it on a background
+    thread while everyone keeps reading the old value. If a refresh fails
+    the old value stays in place until max_age, so a flaky upstream shows
+    slightly stale data instead of errors. Only a cold cache waits on
+    the upstream. If Redis itself is unreachable, values are fetched
+    directly, and failing to store or lock them is never an error.
+    """
+    def __init__(self,connection,fetchers,refresh_interval=60,max_age=24 * 60 * 60,prefix='cache'):
+        self.connection = connection
+        self.fetchers = fetchers
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.prefix = prefix
+
+    def key(self,name):
+        return '{0}:{1}'.format(self.prefix,name)
+
+    def refresh(self,name):
+        value = self.fetchers[name]()
+        entry = json.dumps({'value':value,'fetched_at':time.time()})
+        try:
+            self.connection.set(self.key(name),entry,ex=self.max_age)
+        except redis.RedisError as e:
+            LOG.warn('Could not store {0} in the shared cache: {1}'.format(name,e))
+        return value
+
+    def _refresh_in_background(self,name):
+        def run():
+            try:
+                self.refresh(name)
+            except Exception as e:
+                LOG.warn('Could not refresh {0}, keeping the cached value: {1}'.format(name,e))
+            finally:
+                try:
+                    self.connection.delete(self.key(name) + ':lock')
+                except redis.RedisError as e:
+                    LOG.warn('Could not release the {0} refresh lock: {1}'.format(name,e))
+
+        # whoever holds the lock refreshes; it expires in case that worker dies.
+        try:
+            locked = self.connection.set(self.key(name) + ':lock','1',nx=True,ex=30)
+        except redis.RedisError as e:
+            LOG.warn('Could not lock {0} for refresh: {1}'.format(name,e))
+            return
+        if locked:
+            threading.Thread(target=run,daemon=True).start()
+
+    def get(self,name):
+        try:
+            entry = self.connection.get(self.key(name))
+        except redis.RedisError as e:
+            LOG.warn('Shared cache unavailable: {0}'.format(e))
+            return self.fetchers[name]()
+
+        if entry is None:
+            return self.refresh(name)
+
+        entry = json.loads(entry.decode())
+        if time.time() - entry['fetched_at'] > self.refresh_interval:
+            self._refresh_in_background(name)
+        return entry['value']
+
+overpass_cache = SharedCache(
+    redis.Redis(host=settings.REDIS_HOST,port=settings.REDIS_PORT,socket_timeout=1),
+    {'timestamp':fetch_timestamp,'status':fetch_status},
+    refresh_interval=settings.OVERPASS_CACHE_INTERVAL,
+    prefix='overpass'
+)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from ..http_client import CachedJson, CircuitOpenError, HttpClient, normalize_params
+
+class FakeResponse(object):
+    def __init__(self,status_code=200,data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        return self.data
+
+class FakeClient(object):
+    """HttpClient stand-in answering every GET with the next of responses."""
+    def __init__(self,responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self,url,params=None):
+        self.calls.append((url,params))
+        return self.responses.pop(0)
+
+class TestCircuitBreaker(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('utils.http_client.time.monotonic',lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = HttpClient('Test',timeout=1,failure_threshold=2,reset_timeout=30)
+        self.session = mock.Mock()
+        self.client.session = self.session
+
+    def test_opens_after_failures_and_recovers(self):
+        self.session.get.side_effect = [
+            FakeResponse(503),
+            requests.exceptions.ConnectionError(),
+            FakeResponse(503),
+            FakeResponse(200)
+        ]
+        self.assertEqual(self.client.get('http://test').status_code,503)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get('http://test')
+
+        # open: calls fail fast without reaching the service.
+        with self.assertRaises(CircuitOpenError):
+            self.client.get('http://test')
+        self.assertEqual(self.session.get.call_count,2)
+
+        # half open: one call goes through, and a failure opens it again.
+        self.now += 30
+        self.assertEqual(self.client.get('http://test').status_code,503)
+        with self.assertRaises(CircuitOpenError):
+            self.client.get('http://test')
+
+        # a success closes it.
+        self.now += 30
+        self.assertEqual(self.client.get('http://test').status_code,200)
+        self.assertEqual(self.client.breaker.failures,0)
+        self.assertIsNone(self.client.breaker.opened_at)
+
+    def test_client_errors_are_not_failures(self):
+        self.session.get.return_value = FakeResponse(404)
+        for _ in range(3):
+            self.assertEqual(self.client.get('http://test').status_code,404)
+        self.assertEqual(self.client.breaker.failures,0)
+
+class TestCachedJson(SimpleTestCase):
+    def test_normalize_params(self):
+        self.assertEqual(
+            normalize_params({'q':'  Free   Town ','country':None,'maxRows':5}),
+            normalize_params({'maxRows':'5','q':'free town'})
+        )
+
+    def test_hits_do_not_call_upstream(self):
+        client = FakeClient([FakeResponse(data={'a':1}),FakeResponse(data={'b':2})])
+        cached = CachedJson(client,ttl=60)
+        self.assertEqual(cached.get('http://test',{'q':'Freetown'}),{'a':1})
+        self.assertEqual(cached.get('http://test',{'q':' freetown'}),{'a':1})
+        self.assertEqual(len(client.calls),1)
+        self.assertEqual(cached.get('http://test',{'q':'Accra'}),{'b':2})
+        self.assertEqual(len(client.calls),2)
+
+    def test_errors_are_not_cached(self):
+        client = FakeClient([FakeResponse(500),FakeResponse(data={'a':1})])
+        cached = CachedJson(client,ttl=60)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            cached.get('http://test',{'q':'Freetown'})
+        self.assertEqual(cached.get('http://test',{'q':'Freetown'}),{'a':1})
+        self.assertEqual(len(client.calls),2)
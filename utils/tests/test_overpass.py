@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase
+
+from ..overpass import SharedCache
+
+class FakeRedis(object):
+    """Dict-backed stand-in for the few redis.Redis calls SharedCache makes."""
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def check(self):
+        if self.down:
+            raise redis.ConnectionError('down')
+
+    def get(self,key):
+        self.check()
+        return self.data.get(key)
+
+    def set(self,key,value,ex=None,nx=False):
+        self.check()
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode()
+        return True
+
+    def delete(self,key):
+        self.check()
+        self.data.pop(key,None)
+
+class InlineThread(object):
+    """Runs a background refresh before start() returns."""
+    def __init__(self,target,daemon=None):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+@mock.patch('utils.overpass.threading.Thread',InlineThread)
+class TestSharedCache(SimpleTestCase):
+    def setUp(self):
+        self.connection = FakeRedis()
+        self.fetched = 0
+        self.cache = SharedCache(self.connection,{'timestamp':self.fetch},refresh_interval=60,prefix='test')
+
+    def fetch(self):
+        self.fetched += 1
+        return 'value {0}'.format(self.fetched)
+
+    def store(self,value,age):
+        self.connection.data['test:timestamp'] = json.dumps({'value':value,'fetched_at':time.time() - age}).encode()
+
+    def test_cold_cache_waits_for_upstream(self):
+        self.assertEqual(self.cache.get('timestamp'),'value 1')
+        self.assertEqual(self.cache.get('timestamp'),'value 1')
+        self.assertEqual(self.fetched,1)
+
+    def test_stale_value_is_refreshed_in_background(self):
+        self.store('old',120)
+        # the stale value is served while the refresh runs.
+        self.assertEqual(self.cache.get('timestamp'),'old')
+        self.assertEqual(self.fetched,1)
+        self.assertEqual(self.cache.get('timestamp'),'value 1')
+        self.assertNotIn('test:timestamp:lock',self.connection.data)
+
+    def test_locked_refresh_is_left_to_its_holder(self):
+        self.store('old',120)
+        self.connection.data['test:timestamp:lock'] = b'1'
+        self.assertEqual(self.cache.get('timestamp'),'old')
+        self.assertEqual(self.fetched,0)
+
+    def test_failed_refresh_keeps_old_value(self):
+        self.store('old',120)
+        self.cache.fetchers['timestamp'] = mock.Mock(side_effect=ValueError('empty'))
+        self.assertEqual(self.cache.get('timestamp'),'old')
+        self.assertNotIn('test:timestamp:lock',self.connection.data)
+
+    def test_redis_down_fetches_directly(self):
+        self.connection.down = True
+        self.assertEqual(self.cache.get('timestamp'),'value 1')
+        self.assertEqual(self.cache.get('timestamp'),'value 2')
+
+    def test_redis_errors_after_read_are_not_raised(self):
+        # Redis goes away between reading an entry and storing or locking.
+        connection = self.connection
+        get = connection.get
+        def get_then_fail(key):
+            value = get(key)
+            connection.down = True
+            return value
+        connection.get = get_then_fail
+        self.assertEqual(self.cache.get('timestamp'),'value 1')
+
+        connection.down = False
+        self.store('old',120)
+        self.assertEqual(self.cache.get('timestamp'),'old')
+        self.assertEqual(self.fetched,1)
+
+    def test_lock_release_error_is_not_raised(self):
+        self.store('old',120)
+        def fetch_then_fail():
+            self.connection.down = True
+            return 'new'
+        self.cache.fetchers['timestamp'] = fetch_then_fail
+        self.assertEqual(self.cache.get('timestamp'),'old')